@@ -0,0 +1,262 @@
+"""
+Генерация статьи по разделам: сначала план, потом H2-разделы параллельно.
+
+Обычная генерация — один длинный ответ на 1000–1500 слов, и время
+растёт вместе с длиной ответа. Здесь модель сначала отдаёт короткий
+план (заголовки, мета-поля, image_prompt, вступление и список H2 с
+объёмом каждого), а разделы пишутся одновременно, каждый своим
+запросом. Время статьи ≈ план + самый долгий раздел.
+
+Здесь же — досборка готовой статьи: если она валидна, но короче
+min_words или без таблицы/списка, самые тонкие H2-разделы дописываются
+отдельными запросами и новый текст вклеивается в конец раздела. Это
+дешевле, чем генерировать всю статью заново.
+
+Модуль только строит и разбирает запросы; вызовы модели, метрики и
+запасной переход на обычную генерацию — в publisher_multisite.py.
+"""
+
+import html
+import json
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+from html_sanitizer import HtmlReport, sanitize_html
+from prompts import PromptProfile
+
+
+OUTLINE_KEYS = ("title", "meta_title", "meta_description", "slug", "image_prompt", "sections")
+META_KEYS = ("title", "meta_title", "meta_description", "slug", "image_prompt")
+
+MIN_SECTIONS = 3
+MAX_SECTIONS = 8
+# План просит разделы с запасом к min_words: модели чаще недописывают, чем пишут лишнее
+WORDS_MARGIN = 1.2
+INTRO_WORDS = 90
+MIN_SECTION_WORDS = 120
+
+# Досборка: не больше стольких разделов за раз и не меньше стольких слов в добавке
+REPAIR_MAX_SECTIONS = 3
+REPAIR_MIN_WORDS = 60
+
+_LEADING_H2_RE = re.compile(r"^\s*<h2[^>]*>.*?</h2>", re.IGNORECASE | re.DOTALL)
+# H2 в очищенном HTML (html_sanitizer) всегда без атрибутов
+_H2_SPLIT_RE = re.compile(r"<h2>(.*?)</h2>", re.DOTALL)
+
+
+@dataclass
+class Section:
+    h2: str
+    points: list[str] = field(default_factory=list)
+    words: int = 0
+    needs_table: bool = False
+    needs_list: bool = False
+
+    def extras(self) -> str:
+        """Добавка к заданию раздела про таблицу и список."""
+        parts = []
+        if self.needs_table:
+            parts.append(" Обязательно включи таблицу.")
+        if self.needs_list:
+            parts.append(" Обязательно включи список.")
+        return "".join(parts)
+
+
+@dataclass
+class Repair(Section):
+    """Раздел готовой статьи к досборке; words — сколько слов дописать."""
+    index: int = 0  # номер H2 в статье
+    current_words: int = 0
+
+
+@dataclass
+class Outline:
+    raw: str  # ответ модели как есть: идёт в диалог запросов разделов
+    meta: dict  # title, meta_title, meta_description, slug, image_prompt
+    intro_html: str
+    sections: list[Section]
+    # объём из запроса плана: запросы разделов повторяют его слово в слово
+    requested_words: int = 0
+
+
+def target_words(min_words: int) -> int:
+    """Сколько слов просить у плана, чтобы итог не оказался короче min_words."""
+    return int(min_words * WORDS_MARGIN)
+
+
+def _as_int(value, default: int) -> int:
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_outline(raw: str, min_words: int) -> Optional[Outline]:
+    """
+    Разбирает план. Объёмы разделов масштабируются так, чтобы в сумме
+    дать target_words(min_words); если модель не отметила таблицу или
+    список ни в одном разделе — отмечаем сами.
+    """
+    try:
+        data = json.loads(raw)
+    except (TypeError, json.JSONDecodeError) as e:
+        print(f"[WARN] Невалидный JSON плана: {e}")
+        return None
+
+    if not isinstance(data, dict):
+        print("[WARN] План не является JSON-объектом")
+        return None
+
+    missing = [k for k in OUTLINE_KEYS if k not in data]
+    if missing:
+        print(f"[WARN] В плане отсутствуют ключи: {missing}")
+        return None
+
+    sections = []
+    for item in data["sections"] if isinstance(data["sections"], list) else []:
+        if not isinstance(item, dict) or not str(item.get("h2") or "").strip():
+            continue
+        points = item.get("points") or []
+        sections.append(Section(
+            h2=str(item["h2"]).strip(),
+            points=[str(p) for p in points] if isinstance(points, list) else [str(points)],
+            words=_as_int(item.get("words"), 0),
+            needs_table=bool(item.get("table")),
+            needs_list=bool(item.get("list")),
+        ))
+    if len(sections) < MIN_SECTIONS:
+        print(f"[WARN] В плане {len(sections)} разделов, нужно хотя бы {MIN_SECTIONS}")
+        return None
+    sections = sections[:MAX_SECTIONS]
+
+    # бюджет слов: пропорции из плана, сумма — под нужный объём
+    budget = max(target_words(min_words) - INTRO_WORDS, MIN_SECTION_WORDS * len(sections))
+    planned = sum(s.words for s in sections) or len(sections)
+    for s in sections:
+        share = (s.words or planned / len(sections)) / planned
+        s.words = max(MIN_SECTION_WORDS, round(budget * share / 10) * 10)
+
+    if not any(s.needs_table for s in sections):
+        sections[min(1, len(sections) - 1)].needs_table = True
+    if not any(s.needs_list for s in sections):
+        sections[0].needs_list = True
+
+    return Outline(
+        raw=raw,
+        meta={k: data[k] for k in META_KEYS},
+        intro_html=str(data.get("intro_html") or ""),
+        sections=sections,
+        requested_words=target_words(min_words),
+    )
+
+
+def section_messages(profile: PromptProfile, topic: str, outline: Outline, section: Section) -> list[dict]:
+    return profile.section_messages(
+        topic,
+        outline.requested_words,
+        outline.raw,
+        section.h2,
+        section.points,
+        section.words,
+        section.extras(),
+    )
+
+
+def parse_section(raw: str) -> Optional[str]:
+    """HTML раздела из ответа модели (без повторённого H2) или None."""
+    try:
+        data = json.loads(raw)
+    except (TypeError, json.JSONDecodeError) as e:
+        print(f"[WARN] Невалидный JSON раздела: {e}")
+        return None
+
+    body = data.get("content_html") if isinstance(data, dict) else None
+    if not isinstance(body, str) or not body.strip():
+        print("[WARN] В ответе раздела нет content_html")
+        return None
+    # заголовок раздела ставим сами — повтор от модели убираем
+    return _LEADING_H2_RE.sub("", body, count=1).strip()
+
+
+def assemble(outline: Outline, bodies: list[str]) -> str:
+    """Вступление и разделы по порядку плана в один content_html."""
+    parts = [outline.intro_html]
+    for section, body in zip(outline.sections, bodies):
+        parts.append(f"<h2>{html.escape(section.h2, quote=False)}</h2>")
+        parts.append(body)
+    return "\n".join(parts)
+
+
+# =========================
+#   ДОСБОРКА
+# =========================
+
+def split_h2(content_html: str) -> tuple[str, list[tuple[str, str]]]:
+    """Очищенный HTML -> (вступление, [(текст H2 как в HTML, тело раздела)])."""
+    parts = _H2_SPLIT_RE.split(content_html)
+    return parts[0], list(zip(parts[1::2], parts[2::2]))
+
+
+def plan_repairs(report: HtmlReport, min_words: int) -> list[Repair]:
+    """
+    Какие разделы дописать, чтобы статья прошла проверку: недостающий
+    объём (с запасом WORDS_MARGIN) делится между самыми тонкими H2,
+    таблица и список — в самые тонкие из них. Пустой список — досборка
+    не поможет (нет H2) или не нужна.
+    """
+    _, parts = split_h2(report.html)
+    if not parts:
+        return []
+
+    counts = [sanitize_html(body).word_count for _, body in parts]
+    thinnest = sorted(range(len(parts)), key=counts.__getitem__)
+    repairs: dict[int, Repair] = {}
+
+    def repair(index: int) -> Repair:
+        if index not in repairs:
+            repairs[index] = Repair(
+                h2=html.unescape(parts[index][0]),
+                index=index,
+                current_words=counts[index],
+            )
+        return repairs[index]
+
+    deficit = min_words - report.word_count
+    if deficit > 0:
+        need = math.ceil(deficit * WORDS_MARGIN)
+        k = min(REPAIR_MAX_SECTIONS, len(parts), math.ceil(need / MIN_SECTION_WORDS))
+        add = max(REPAIR_MIN_WORDS, math.ceil(need / k / 10) * 10)
+        for index in thinnest[:k]:
+            repair(index).words = add
+    if report.tables < 1:
+        repair(thinnest[0]).needs_table = True
+    if report.lists < 1:
+        # таблицу и список по возможности — в разные разделы
+        repair(thinnest[1] if len(thinnest) > 1 and report.tables < 1 else thinnest[0]).needs_list = True
+
+    return sorted(repairs.values(), key=lambda r: r.index)
+
+
+def repair_messages(profile: PromptProfile, topic: str, article_raw: str, repair: Repair) -> list[dict]:
+    return profile.repair_messages(
+        topic,
+        article_raw,
+        repair.h2,
+        repair.current_words,
+        repair.words,
+        repair.extras(),
+    )
+
+
+def apply_repairs(content_html: str, repairs: list[Repair], additions: list[str]) -> str:
+    """Вклеивает дописанный HTML в конец соответствующих разделов."""
+    intro, parts = split_h2(content_html)
+    bodies = [body for _, body in parts]
+    for r, addition in zip(repairs, additions):
+        bodies[r.index] = f"{bodies[r.index]}\n{addition}"
+    out = [intro]
+    for (h2, _), body in zip(parts, bodies):
+        out.append(f"<h2>{h2}</h2>{body}")
+    return "".join(out)
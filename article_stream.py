@@ -0,0 +1,280 @@
+"""
+Потоковая генерация статьи.
+
+Ответ модели читается по мере поступления токенов и разбирается
+инкрементально: парсер следит за ключами верхнего уровня JSON-объекта
+и считает слова видимого текста в content_html, пока тот ещё пишется.
+Если ответ явно нарушает контракт (не JSON, content_html закрылся
+сильно короче минимума, объект закрылся без обязательных ключей),
+поток обрывается сразу, не дожидаясь конца генерации.
+
+Заодно меряются время до первого токена и скорость генерации.
+"""
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+
+_ESCAPES = {
+    "n": "\n",
+    "t": "\t",
+    "r": "\r",
+    "b": "\b",
+    "f": "\f",
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+}
+
+
+class ArticleStreamParser:
+    """
+    Инкрементальный разбор JSON-объекта статьи.
+    Вложенные значения пропускаются; строка content_html декодируется
+    на лету, а слова считаются только вне HTML-тегов.
+    """
+
+    def __init__(self, content_key: str = "content_html"):
+        self.content_key = content_key
+
+        self.started = False
+        self.closed = False
+        self.malformed: Optional[str] = None
+        self.keys_seen: set[str] = set()
+
+        self.content_open = False
+        self.content_closed = False
+        self.content_words = 0
+
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode: Optional[list[str]] = None
+        self._expect_key = False
+        self._key_buf: Optional[list[str]] = None
+        self._current_key: Optional[str] = None
+
+        self._in_tag = False
+        self._in_word = False
+
+    # ---- подсчёт слов в content_html ----
+
+    def _end_word(self) -> None:
+        if self._in_word:
+            self.content_words += 1
+            self._in_word = False
+
+    def _content_char(self, ch: str) -> None:
+        if self._in_tag:
+            if ch == ">":
+                self._in_tag = False
+            return
+        if ch == "<":
+            self._in_tag = True
+            self._end_word()
+        elif ch.isspace():
+            self._end_word()
+        else:
+            self._in_word = True
+
+    # ---- разбор ----
+
+    def feed(self, chunk: str) -> None:
+        for ch in chunk:
+            if self.malformed or self.closed:
+                return
+
+            if not self.started:
+                if ch.isspace():
+                    continue
+                if ch != "{":
+                    self.malformed = "ответ не начинается с JSON-объекта"
+                    return
+                self.started = True
+                self._depth = 1
+                self._expect_key = True
+                continue
+
+            if self._in_string:
+                self._string_char(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_buf = []
+                elif self._depth == 1 and self._current_key == self.content_key:
+                    self.content_open = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.closed = True
+            elif ch == ":" and self._depth == 1:
+                self._expect_key = False
+            elif ch == "," and self._depth == 1:
+                self._expect_key = True
+
+    def _string_char(self, ch: str) -> None:
+        capturing = self.content_open and not self.content_closed
+
+        if self._unicode is not None:
+            self._unicode.append(ch)
+            if len(self._unicode) == 4:
+                code = "".join(self._unicode)
+                self._unicode = None
+                if capturing:
+                    try:
+                        self._content_char(chr(int(code, 16)))
+                    except ValueError:
+                        pass
+            return
+
+        if self._escape:
+            self._escape = False
+            if ch == "u":
+                self._unicode = []
+                return
+            decoded = _ESCAPES.get(ch, ch)
+            if self._key_buf is not None:
+                self._key_buf.append(decoded)
+            elif capturing:
+                self._content_char(decoded)
+            return
+
+        if ch == "\\":
+            self._escape = True
+            return
+
+        if ch == '"':
+            self._in_string = False
+            if self._key_buf is not None:
+                self._current_key = "".join(self._key_buf)
+                self.keys_seen.add(self._current_key)
+                self._key_buf = None
+            elif capturing:
+                self._end_word()
+                self.content_closed = True
+            return
+
+        if self._key_buf is not None:
+            self._key_buf.append(ch)
+        elif capturing:
+            self._content_char(ch)
+
+
+@dataclass
+class StreamResult:
+    raw: str
+    aborted: Optional[str] = None
+    ttft: Optional[float] = None
+    elapsed: float = 0.0
+    chunks: int = 0
+    completion_tokens: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    content_words: int = 0
+    keys_seen: set = field(default_factory=set)
+
+    @property
+    def tokens_per_sec(self) -> float:
+        tokens = self.completion_tokens or self.chunks
+        gen_time = self.elapsed - (self.ttft or 0.0)
+        return tokens / gen_time if gen_time > 0 else 0.0
+
+
+def check_stream(
+    parser: ArticleStreamParser,
+    min_words: int,
+    required_keys: Iterable[str],
+    short_ratio: float,
+) -> Optional[str]:
+    """Причина досрочного обрыва или None, если пока всё в порядке."""
+    if parser.malformed:
+        return parser.malformed
+
+    if parser.content_closed and parser.content_words < min_words * short_ratio:
+        return (
+            f"content_html закрыт на {parser.content_words} словах "
+            f"(минимум {min_words})"
+        )
+
+    if parser.closed:
+        missing = [k for k in required_keys if k not in parser.keys_seen]
+        if missing:
+            return f"JSON закрыт без ключей: {missing}"
+
+    return None
+
+
+def stream_article_completion(
+    client,
+    request: dict,
+    min_words: int,
+    required_keys: Iterable[str],
+    short_ratio: float = 0.6,
+    cancel: Optional[threading.Event] = None,
+) -> StreamResult:
+    """
+    Выполняет chat.completions.create(**request) в потоковом режиме.
+    Обрывает поток, как только check_stream находит нарушение контракта
+    или выставлен cancel. Сырой текст возвращается в любом случае.
+    """
+    required_keys = tuple(required_keys)
+    parser = ArticleStreamParser()
+    parts: list[str] = []
+    result = StreamResult(raw="")
+
+    started = time.monotonic()
+    stream = client.chat.completions.create(
+        **request,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+
+    try:
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                result.completion_tokens = usage.completion_tokens
+                result.prompt_tokens = usage.prompt_tokens
+                details = getattr(usage, "prompt_tokens_details", None)
+                result.cached_tokens = getattr(details, "cached_tokens", None)
+
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+
+            if result.ttft is None:
+                result.ttft = time.monotonic() - started
+            result.chunks += 1
+            parts.append(delta)
+            parser.feed(delta)
+
+            if cancel is not None and cancel.is_set():
+                result.aborted = "отменено"
+                break
+
+            reason = check_stream(parser, min_words, required_keys, short_ratio)
+            if reason:
+                result.aborted = reason
+                break
+    finally:
+        if result.aborted:
+            stream.close()
+
+    if result.aborted is None and not parser.closed:
+        result.aborted = check_stream(parser, min_words, required_keys, short_ratio) or (
+            "поток закончился до закрытия JSON-объекта"
+        )
+
+    result.raw = "".join(parts)
+    result.elapsed = time.monotonic() - started
+    result.content_words = parser.content_words
+    result.keys_seen = set(parser.keys_seen)
+    return result
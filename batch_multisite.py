@@ -0,0 +1,346 @@
+"""
+Офлайн-режим через OpenAI Batch API для больших списков тем.
+
+Темы превращаются в JSONL с теми же запросами chat.completions, что
+отправляет generate_article, и уходят одним или несколькими батчами
+(дешевле синхронных вызовов и не упирается в лимиты скорости).
+Скрипт опрашивает батчи и, как только очередной готов, проверяет ответы
+той же parse_article, кладёт годные статьи в кэш статей и прогоняет
+эти темы через обычный конвейер: статья берётся из кэша без вызова
+модели, дальше картинка, загрузка и create_post как обычно. Публикация
+идёт в фоновом потоке, поэтому опрос остальных батчей не ждёт её.
+
+Невалидные ответы и статьи, не прошедшие локальную проверку (объём,
+таблица, список, порядок заголовков), уходят в следующий раунд батча
+(до max_rounds); в последнем раунде берётся самая длинная валидная.
+
+Транспорт подключаемый (BatchTransport): по умолчанию это OpenAI,
+для проверки можно указать base_url локальной заглушки Batch API.
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, Optional, Protocol
+
+import publisher_multisite as publisher
+from html_sanitizer import HtmlReport
+from job_journal import JobJournal
+from metrics import get_metrics
+from pipeline_multisite import PublishJob, run_sites
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_DIR = "batches"
+
+# Лимит OpenAI — 50 000 запросов в батче; берём с запасом по размеру файла.
+MAX_BATCH_REQUESTS = 10_000
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Batch API вдвое дешевле синхронных вызовов
+BATCH_PRICE_FACTOR = 0.5
+
+
+# =========================
+#   ТРАНСПОРТ
+# =========================
+
+@dataclass
+class BatchStatus:
+    status: str
+    output_file_id: Optional[str] = None
+    error_file_id: Optional[str] = None
+    completed: int = 0
+    failed: int = 0
+    total: int = 0
+
+
+class BatchTransport(Protocol):
+    def submit(self, jsonl: bytes) -> str:
+        """Загружает JSONL и создаёт батч, возвращает batch_id."""
+
+    def status(self, batch_id: str) -> BatchStatus:
+        ...
+
+    def download(self, file_id: str) -> Iterator[str]:
+        """Строки файла результатов."""
+
+
+class OpenAIBatchTransport:
+    """Batch API через клиент openai (или локальную заглушку по base_url)."""
+
+    def __init__(self, client=None):
+        self.client = client or publisher.get_openai_client()
+
+    def submit(self, jsonl: bytes) -> str:
+        f = self.client.files.create(file=("batch.jsonl", jsonl), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=f.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> BatchStatus:
+        b = self.client.batches.retrieve(batch_id)
+        counts = b.request_counts
+        return BatchStatus(
+            status=b.status,
+            output_file_id=b.output_file_id,
+            error_file_id=b.error_file_id,
+            completed=counts.completed if counts else 0,
+            failed=counts.failed if counts else 0,
+            total=counts.total if counts else 0,
+        )
+
+    def download(self, file_id: str) -> Iterator[str]:
+        text = self.client.files.content(file_id).text
+        for line in text.splitlines():
+            if line.strip():
+                yield line
+
+
+def make_transport(base_url: Optional[str] = None) -> BatchTransport:
+    """OpenAI по умолчанию; с base_url — локальная заглушка Batch API."""
+    if not base_url:
+        return OpenAIBatchTransport()
+
+    from openai import OpenAI
+
+    return OpenAIBatchTransport(
+        OpenAI(api_key=os.getenv("OPENAI_API_KEY") or "local", base_url=base_url)
+    )
+
+
+# =========================
+#   ЗАПРОСЫ И ОТВЕТЫ
+# =========================
+
+def _custom_id(site_key: str, topic: str) -> str:
+    digest = hashlib.sha1(topic.strip().encode("utf-8")).hexdigest()[:16]
+    return f"{site_key}:{digest}"
+
+
+def build_batch_requests(items: list[tuple[str, str]]) -> tuple[bytes, dict]:
+    """
+    JSONL батча для пар (сайт, тема) и манифест custom_id -> [сайт, тема].
+    Тело каждого запроса — ровно то, что отправил бы generate_article.
+    """
+    lines = []
+    manifest: dict[str, list[str]] = {}
+    for site_key, topic in items:
+        cid = _custom_id(site_key, topic)
+        if cid in manifest:
+            continue
+        prompt_profile = publisher.SITES_CONFIG[site_key]["prompt_profile"]
+        lines.append(json.dumps({
+            "custom_id": cid,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": publisher.build_article_request(topic, prompt_profile),
+        }, ensure_ascii=False))
+        manifest[cid] = [site_key, topic]
+
+    return ("\n".join(lines) + "\n").encode("utf-8"), manifest
+
+
+def _article_from_result(item: dict) -> Optional[tuple[dict, HtmlReport]]:
+    """Статья и отчёт санитайзера из строки файла результатов (или None)."""
+    if item.get("error"):
+        print(f"[BATCH][WARN] {item.get('custom_id')}: {item['error']}")
+        return None
+
+    resp = item.get("response") or {}
+    if resp.get("status_code") != 200:
+        print(f"[BATCH][WARN] {item.get('custom_id')}: HTTP {resp.get('status_code')}")
+        return None
+
+    try:
+        raw = resp["body"]["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+    return publisher.parse_article(raw)
+
+
+def _record_usage(item: dict, site_key: str, topic: str, batch_id: str) -> None:
+    """Токены одного ответа батча — в метрики, по цене Batch API."""
+    body = (item.get("response") or {}).get("body") or {}
+    usage = body.get("usage")
+    if not usage:
+        return
+    metrics = get_metrics()
+    with metrics.labels(site=site_key, topic=topic):
+        metrics.record_usage(
+            publisher.TEXT_MODEL,
+            usage.get("prompt_tokens"),
+            usage.get("completion_tokens"),
+            (usage.get("prompt_tokens_details") or {}).get("cached_tokens"),
+            price_factor=BATCH_PRICE_FACTOR,
+            batch_id=batch_id,
+        )
+
+
+def _save_manifest(batch_id: str, manifest: dict) -> None:
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    path = os.path.join(BATCH_DIR, f"{batch_id}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+
+# =========================
+#   ЗАПУСК
+# =========================
+
+def run_batch(
+    site_topics: dict[str, list[str]],
+    transport: Optional[BatchTransport] = None,
+    publish: Optional[bool] = None,
+    journal: Optional[JobJournal] = None,
+    min_words: int = 1000,
+    max_rounds: int = 2,
+    poll_interval: float = 60.0,
+    chunk_size: int = MAX_BATCH_REQUESTS,
+) -> list[PublishJob]:
+    """Генерирует статьи батчами и публикует их по мере готовности батчей."""
+    transport = transport or make_transport()
+    cache = publisher.get_content_cache()
+    results: list[PublishJob] = []
+
+    # готовые темы публикуются одним фоновым потоком по очереди:
+    # пока конвейер работает, цикл опроса следит за остальными батчами
+    publish_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-publish")
+    publishing: list[Future] = []
+
+    def publish_landed(landed: dict[str, list[str]]) -> None:
+        publishing.append(publish_pool.submit(run_sites, landed, publish=publish, journal=journal))
+
+    def cache_and_collect(site_key: str, topic: str, article: dict, landed: dict) -> None:
+        prompt_profile = publisher.SITES_CONFIG[site_key]["prompt_profile"]
+        cache.put_article(publisher.article_cache_key(topic, prompt_profile), article)
+        landed.setdefault(site_key, []).append(topic)
+
+    # уже сгенерированное (кэш) и опубликованное (журнал) в батч не отправляем
+    items: list[tuple[str, str]] = []
+    ready: dict[str, list[str]] = {}
+    for site_key, topics in site_topics.items():
+        prompt_profile = publisher.SITES_CONFIG[site_key]["prompt_profile"]
+        for topic in topics:
+            if journal is not None:
+                rec = journal.get(site_key, topic)
+                if rec is not None and rec.finished:
+                    continue
+            key = publisher.article_cache_key(topic, prompt_profile)
+            if cache.get_article(key) is not None:
+                ready.setdefault(site_key, []).append(topic)
+            else:
+                items.append((site_key, topic))
+
+    if ready:
+        print(f"[BATCH] Статьи уже в кэше: {sum(map(len, ready.values()))}, публикую сразу")
+        publish_landed(ready)
+
+    best: dict[tuple[str, str], tuple[dict, HtmlReport]] = {}
+
+    try:
+        for round_no in range(1, max_rounds + 1):
+            if not items:
+                break
+            last_round = round_no == max_rounds
+
+            active: dict[str, dict] = {}
+            for start in range(0, len(items), chunk_size):
+                jsonl, manifest = build_batch_requests(items[start:start + chunk_size])
+                batch_id = transport.submit(jsonl)
+                _save_manifest(batch_id, manifest)
+                active[batch_id] = manifest
+                print(f"[BATCH] Раунд {round_no}: батч {batch_id}, запросов: {len(manifest)}")
+
+            retry: list[tuple[str, str]] = []
+            while active:
+                time.sleep(poll_interval)
+
+                for batch_id in list(active):
+                    st = transport.status(batch_id)
+                    print(
+                        f"[BATCH] {batch_id}: {st.status} "
+                        f"({st.completed}/{st.total}, ошибок {st.failed})"
+                    )
+                    if st.status not in TERMINAL_STATUSES:
+                        continue
+
+                    manifest = active.pop(batch_id)
+                    seen = set()
+                    landed: dict[str, list[str]] = {}
+
+                    lines = transport.download(st.output_file_id) if st.output_file_id else []
+                    for line in lines:
+                        item = json.loads(line)
+                        cid = item.get("custom_id")
+                        if cid not in manifest:
+                            continue
+                        seen.add(cid)
+                        site_key, topic = manifest[cid]
+                        _record_usage(item, site_key, topic, batch_id)
+
+                        parsed = _article_from_result(item)
+                        prev = best.get((site_key, topic))
+                        if parsed is not None and (
+                            prev is None or parsed[1].word_count > prev[1].word_count
+                        ):
+                            best[(site_key, topic)] = parsed
+                            prev = parsed
+
+                        problems = prev[1].problems(min_words) if prev is not None else None
+                        if prev is not None and (not problems or last_round):
+                            if problems:
+                                print(
+                                    f"[BATCH][WARN] [{site_key}] {topic!r}: беру лучшую "
+                                    f"версию несмотря на: {'; '.join(problems)}"
+                                )
+                            cache_and_collect(site_key, topic, prev[0], landed)
+                        else:
+                            retry.append((site_key, topic))
+
+                    # запросы, по которым ответа нет вовсе (failed/expired)
+                    for cid, (site_key, topic) in manifest.items():
+                        if cid in seen:
+                            continue
+                        prev = best.get((site_key, topic))
+                        if prev is not None and last_round:
+                            cache_and_collect(site_key, topic, prev[0], landed)
+                        else:
+                            retry.append((site_key, topic))
+
+                    if landed:
+                        print(f"[BATCH] Публикую темы из батча {batch_id}: {sum(map(len, landed.values()))}")
+                        publish_landed(landed)
+
+            items = retry
+    finally:
+        if any(not f.done() for f in publishing):
+            print("[BATCH] Жду окончания публикации готовых тем")
+        publish_pool.shutdown(wait=True)
+
+    for f in publishing:
+        results += f.result()
+
+    if items:
+        print(f"[BATCH][ERROR] Не удалось получить статьи для {len(items)} тем:")
+        for site_key, topic in items:
+            print(f"[BATCH][ERROR] [{site_key}] {topic!r}")
+
+    return results
+
+
+if __name__ == "__main__":
+    # то же, что `python cli_multisite.py batch`
+    import sys
+
+    from cli_multisite import main
+
+    sys.exit(main(["batch", *sys.argv[1:]]))
@@ -0,0 +1,297 @@
+"""
+Бенчмарк публикации на локальных заглушках (fake_services.py).
+
+Прогоняет темы на нескольких фейковых сайтах через выбранный раннер —
+конвейер run_sites, воркеры общей очереди run_queue или последовательный
+generate_and_publish_for_site — без расходов на OpenAI и без записи в настоящий WordPress. Печатает
+статей в минуту, задержки по стадиям и вызовам (p50/p95 из metrics.py)
+и пик памяти процесса; --json сохраняет отчёт, чтобы сравнивать
+производительность до и после изменения.
+
+    python cli_multisite.py bench --topics 30 --sites 2
+    python cli_multisite.py bench --runner sequential --stream --json before.json
+    python cli_multisite.py bench --runner queue --workers 3
+
+Каждый прогон идёт во временной папке: кэш статей, индекс записей и
+события метрик не смешиваются с рабочими.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict
+from typing import Optional
+
+from config_multisite import SITES_CONFIG
+from fake_services import FakeOpenAIConfig, FakeServices, FakeWPConfig
+from metrics import get_metrics
+
+
+RUNNERS = ("pipeline", "queue", "sequential")
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Пик RSS процесса в МБ (на Windows модуля resource нет — None)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss в Linux — килобайты, в macOS — байты
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def bench_topics(site_no: int, count: int) -> list[str]:
+    """Уникальные темы сайта: номер в начале, чтобы ЧПУ не совпадали."""
+    return [f"Тема {site_no} {i} стратегия ставок на футбол" for i in range(1, count + 1)]
+
+
+def bench_sites(
+    count: int,
+    wp_url: str,
+    stream: bool = False,
+    speculative: int = 0,
+    wp_rate: Optional[float] = None,
+    post_batch: Optional[int] = None,
+    image_reuse: Optional[float] = None,
+    sections: bool = False,
+    repair: bool = False,
+    variants: tuple = (),
+    links: int = 0,
+    post_batch_wait: Optional[float] = None,
+) -> list[str]:
+    """Добавляет в SITES_CONFIG сайты bench1..benchN на фейковом WP."""
+    base = next(iter(SITES_CONFIG.values()))
+    keys = []
+    for n in range(1, count + 1):
+        key = f"bench{n}"
+        SITES_CONFIG[key] = {
+            **base,
+            "wp_url": f"{wp_url}/{key}",
+            "username": "bench",
+            "app_password": "bench",
+            "topics_file": None,
+            "stream_generation": stream,
+            "section_generation": sections,
+            "repair_articles": repair,
+            "speculative_candidates": speculative,
+            "hedge_after": None,
+            "wp_rate": wp_rate,
+            "group_rate": wp_rate,
+            "post_batch_size": post_batch,
+            "post_batch_wait": post_batch_wait,
+            "image_reuse_threshold": image_reuse,
+            "image_variants": list(variants),
+            "internal_links": links,
+        }
+        keys.append(key)
+    return keys
+
+
+def run_bench(
+    topics: int = 20,
+    sites: int = 2,
+    runner: str = "pipeline",
+    openai: Optional[FakeOpenAIConfig] = None,
+    wp: Optional[FakeWPConfig] = None,
+    stream: bool = False,
+    speculative: int = 0,
+    wp_rate: Optional[float] = None,
+    post_batch: Optional[int] = None,
+    post_batch_wait: Optional[float] = None,
+    image_reuse: Optional[float] = None,
+    sections: bool = False,
+    repair: bool = False,
+    variants: tuple = (),
+    links: int = 0,
+    workers: int = 1,
+    verbose: bool = False,
+) -> dict:
+    """
+    Один прогон: topics тем на каждый из sites сайтов.
+    Раннер queue кладёт темы в очередь во временной папке и разбирает её
+    workers воркерами (потоки одного процесса, у каждого свой конвейер).
+    Возвращает отчёт (см. print_report); вывод конвейера глушится,
+    если не verbose.
+    """
+    if runner not in RUNNERS:
+        raise ValueError(f"Неизвестный раннер {runner!r}, есть: {', '.join(RUNNERS)}")
+
+    openai = openai or FakeOpenAIConfig()
+    wp = wp or FakeWPConfig()
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    cwd = os.getcwd()
+    queue_stats = None
+
+    fake = FakeServices(openai, wp).start()
+    try:
+        os.chdir(workdir)
+        # клиент OpenAI создаётся при первом вызове и сам читает эти переменные
+        os.environ["OPENAI_API_KEY"] = "bench"
+        os.environ["OPENAI_BASE_URL"] = fake.openai_url
+
+        import publisher_multisite as publisher
+        import wp_client
+        from pipeline_multisite import run_queue, run_sites
+        from work_queue import open_work_queue
+
+        keys = bench_sites(
+            sites, fake.wp_url, stream, speculative, wp_rate, post_batch, image_reuse, sections,
+            repair, variants, links, post_batch_wait,
+        )
+        site_topics = {key: bench_topics(n, topics) for n, key in enumerate(keys, 1)}
+
+        metrics = get_metrics()
+        metrics.reset()
+        metrics.open_jsonl(os.path.join(workdir, "events.jsonl"))
+        rss_before = _peak_rss_mb()
+
+        started = time.monotonic()
+        out = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        with out:
+            if runner == "pipeline":
+                run_sites(site_topics)
+            elif runner == "queue":
+                work_queue = open_work_queue(os.path.join(workdir, "work_queue.sqlite3"))
+                work_queue.enqueue((key, topic) for key, site_list in site_topics.items() for topic in site_list)
+                threads = [
+                    threading.Thread(target=run_queue, args=(work_queue, f"bench-{n}"), name=f"worker-{n}")
+                    for n in range(1, workers + 1)
+                ]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                queue_stats = {}
+                for _, state, n in work_queue.stats():
+                    queue_stats[state] = queue_stats.get(state, 0) + n
+                work_queue.close()
+                wp_client.close_all()
+            else:
+                for site_key, site_list in site_topics.items():
+                    for topic in site_list:
+                        with metrics.labels(site=site_key, topic=topic):
+                            try:
+                                with metrics.timer("stage_seconds", stage="all"):
+                                    publisher.generate_and_publish_for_site(site_key, topic)
+                                metrics.inc("jobs_total", status="ok")
+                            except Exception:
+                                metrics.inc("jobs_total", status="failed")
+                wp_client.close_all()
+        elapsed = time.monotonic() - started
+
+        metrics.write_prometheus(os.path.join(workdir, "publisher.prom"))
+        metrics.close()
+        server_stats = fake.stats()
+    finally:
+        os.chdir(cwd)
+        fake.stop()
+
+    ok = metrics.counter("jobs_total", status="ok")
+    peak = _peak_rss_mb()
+    return {
+        "runner": runner,
+        "sites": sites,
+        "topics": sites * topics,
+        "ok": int(ok),
+        "failed": int(metrics.counter("jobs_total", status="failed")),
+        "elapsed_s": round(elapsed, 2),
+        "articles_per_min": round(ok / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        "stages": metrics.stats("stage_seconds", "stage"),
+        "queue_wait": metrics.stats("queue_wait_seconds", "stage"),
+        "openai": metrics.stats("openai_seconds", "op"),
+        "image": metrics.stats("image_process_seconds", "op"),
+        "links": {
+            kind: metrics.counter("internal_links_total", result=kind) for kind in ("inline", "list")
+        },
+        "wp": metrics.stats("wp_seconds", "op"),
+        "post_batches": list(metrics.stats("wp_batch_size", "site").values()),
+        "retries": {
+            "wp": metrics.counter("retries_total", source="wp"),
+            "article": metrics.counter("retries_total", source="article"),
+        },
+        "tokens": {
+            kind: metrics.counter("tokens_total", type=kind)
+            for kind in ("prompt", "cached", "completion")
+        },
+        "cost_usd": round(metrics.counter("cost_usd_total"), 4),
+        "peak_rss_mb": round(peak, 1) if peak is not None else None,
+        "rss_growth_mb": round(peak - rss_before, 1) if peak is not None else None,
+        "fake": server_stats,
+        "queue": queue_stats,
+        "config": {
+            "openai": asdict(openai),
+            "wp": asdict(wp),
+            "stream": stream,
+            "speculative": speculative,
+            "wp_rate": wp_rate,
+            "post_batch": post_batch,
+            "post_batch_wait": post_batch_wait,
+            "image_reuse": image_reuse,
+            "sections": sections,
+            "repair": repair,
+            "variants": list(variants),
+            "links": links,
+            "workers": workers if runner == "queue" else None,
+        },
+        "workdir": workdir,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"\n[BENCH] {report['runner']}: {report['ok']}/{report['topics']} статей "
+        f"на {report['sites']} сайтах за {report['elapsed_s']:.1f} с — "
+        f"{report['articles_per_min']:.1f} статей/мин (ошибок {report['failed']})"
+    )
+    for section, title in (
+        ("stages", "Стадии"),
+        ("queue_wait", "Ожидание в очереди"),
+        ("openai", "OpenAI"),
+        ("image", "Обработка картинки"),
+        ("wp", "WordPress"),
+    ):
+        groups = report[section]
+        if not groups:
+            continue
+        width = max(12, *map(len, groups))
+        print(f"[BENCH] {title}:")
+        for key, st in sorted(groups.items()):
+            print(
+                f"[BENCH]     {key:<{width}} n={st['n']:<5} p50 {st['p50']:.3f} с  "
+                f"p95 {st['p95']:.3f} с  max {st['max']:.3f} с"
+            )
+    tokens = report["tokens"]
+    print(
+        f"[BENCH] Токены: вход {tokens['prompt']:,.0f} + из кэша {tokens['cached']:,.0f}, "
+        f"выход {tokens['completion']:,.0f}; по прайсу ${report['cost_usd']:.2f}"
+    )
+    if report["config"]["links"]:
+        links = report["links"]
+        print(f"[BENCH] Внутренние ссылки: {links['inline']:g} в тексте, {links['list']:g} списком")
+    batches = report["post_batches"]
+    if batches:
+        calls = sum(st["n"] for st in batches)
+        posts = sum(st["total"] for st in batches)
+        print(
+            f"[BENCH] batch/v1: {calls} запросов, {posts:g} записей, "
+            f"в пакете в среднем {posts / calls:.1f}, max {max(st['max'] for st in batches):g}"
+        )
+    print(f"[BENCH] Повторы: WP {report['retries']['wp']:g}, статья {report['retries']['article']:g}")
+    if report["peak_rss_mb"] is not None:
+        print(f"[BENCH] Пик памяти: {report['peak_rss_mb']:.0f} МБ (+{report['rss_growth_mb']:.0f} МБ за прогон)")
+    if report.get("queue"):
+        print(f"[BENCH] Очередь: {json.dumps(report['queue'], ensure_ascii=False)}")
+    print(f"[BENCH] Заглушки: {json.dumps(report['fake'], ensure_ascii=False)}")
+    print(f"[BENCH] События и publisher.prom: {report['workdir']}")
+
+
+if __name__ == "__main__":
+    # то же, что `python cli_multisite.py bench`
+    from cli_multisite import main
+
+    sys.exit(main(["bench", *sys.argv[1:]]))
@@ -0,0 +1,610 @@
+"""
+Консольная точка входа.
+
+    python cli_multisite.py run        — генерация и публикация конвейером
+    python cli_multisite.py batch      — то же через OpenAI Batch API
+    python cli_multisite.py queue      — общая очередь задач: add, stats, dead, requeue
+    python cli_multisite.py worker     — разбирать общую очередь (воркеров может быть много)
+    python cli_multisite.py validate   — проверка тем без вызовов модели (он же dry-run)
+    python cli_multisite.py sites      — сайты из SITES_CONFIG
+    python cli_multisite.py journal    — сводка журнала задач, ошибки, одна тема
+    python cli_multisite.py bench      — бенчмарк на локальных заглушках OpenAI и WP
+
+Тяжёлые модули (openai, PIL, requests) и клиент OpenAI подгружаются только
+там, где они нужны, поэтому sites/journal/validate и запуск воркеров
+занимают доли секунды. Скрипт ничего не ждёт от терминала и годится для
+cron/systemd; --pause оставляет окно открытым до Enter.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from typing import Optional
+
+from config_multisite import SITES_CONFIG
+from job_journal import DEFAULT_JOURNAL_PATH, STAGES, JobJournal, JournalReader
+from metrics import get_metrics
+from topic_dedupe import threshold_error
+from work_queue import DEFAULT_LEASE_TTL, DEFAULT_MAX_ATTEMPTS, DEFAULT_QUEUE_PATH, STATES, open_work_queue
+
+
+REQUIRED_SITE_KEYS = ("wp_url", "username", "app_password", "prompt_profile")
+
+DEFAULT_METRICS_DIR = "run_metrics"
+PROMETHEUS_FILE = "publisher.prom"
+
+
+# =========================
+#   ОБЩИЕ ОПЦИИ
+# =========================
+
+def _parse_shard(value: str) -> tuple[int, int]:
+    """'2/4' -> (2, 4): шард с нуля и число шардов."""
+    shard, sep, shards = value.partition("/")
+    try:
+        shard, shards = int(shard), int(shards if sep else 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается 'номер/всего', например 0/4: {value!r}")
+    if not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError(f"шард {shard} вне диапазона 0..{shards - 1}")
+    return shard, shards
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def _add_topic_options(p: argparse.ArgumentParser) -> None:
+    g = p.add_argument_group("темы")
+    g.add_argument(
+        "--site", action="append", metavar="KEY",
+        help="только этот сайт (можно несколько раз)",
+    )
+    g.add_argument(
+        "--assignments", metavar="PATH",
+        help="файл назначений 'site_key<TAB>тема' (по умолчанию site_topics.txt, если есть)",
+    )
+    g.add_argument(
+        "--shard", type=_parse_shard, default=_parse_shard(os.getenv("TOPIC_SHARD") or "0/1"),
+        metavar="I/N", help="взять только шард I из N (по хэшу темы); env TOPIC_SHARD",
+    )
+    g.add_argument(
+        "--offset", type=int, default=_env_int("TOPIC_OFFSET") or 0,
+        help="пропустить столько тем шарда; env TOPIC_OFFSET",
+    )
+    g.add_argument(
+        "--limit", type=int, default=_env_int("TOPIC_LIMIT"),
+        help="взять не больше стольких тем шарда; env TOPIC_LIMIT",
+    )
+    g.add_argument("--no-dedupe", action="store_true", help="не отсеивать похожие темы")
+
+
+def _add_journal_options(p: argparse.ArgumentParser, optional: bool = True) -> None:
+    p.add_argument("--journal", default=DEFAULT_JOURNAL_PATH, metavar="PATH", help="файл журнала задач")
+    if optional:
+        p.add_argument("--no-journal", action="store_true", help="не вести журнал (без возобновления)")
+
+
+def _add_publish_options(p: argparse.ArgumentParser) -> None:
+    p.add_argument("--publish", action="store_true", help="публиковать сразу (по умолчанию черновики)")
+    p.add_argument("--category", type=int, metavar="ID", help="рубрика вместо default_category_id")
+    p.add_argument("--pause", action="store_true", help="в конце ждать Enter (для запуска двойным кликом)")
+
+
+def _add_metrics_options(p: argparse.ArgumentParser) -> None:
+    p.add_argument(
+        "--metrics-dir", default=os.getenv("METRICS_DIR") or DEFAULT_METRICS_DIR, metavar="DIR",
+        help=f"куда писать события (run-*.jsonl) и {PROMETHEUS_FILE}; env METRICS_DIR",
+    )
+    p.add_argument("--no-metrics", action="store_true", help="не писать файлы метрик (сводка печатается)")
+
+
+def _collect(args, sync_index: bool = True) -> dict:
+    from pipeline_multisite import SITE_TOPICS_FILE, collect_site_topics
+
+    assignments = args.assignments
+    if assignments is None and os.path.exists(SITE_TOPICS_FILE):
+        assignments = SITE_TOPICS_FILE
+
+    shard, shards = args.shard
+    site_topics = collect_site_topics(
+        assignments,
+        dedupe=not args.no_dedupe,
+        shard=shard,
+        shards=shards,
+        offset=args.offset,
+        limit=args.limit,
+        sites=args.site,
+        sync_index=sync_index,
+    )
+    print(f"[MAIN] Сайтов с темами: {len(site_topics)}")
+    return site_topics
+
+
+def _add_queue_options(p: argparse.ArgumentParser) -> None:
+    p.add_argument(
+        "--queue", default=os.getenv("WORK_QUEUE") or DEFAULT_QUEUE_PATH, metavar="PATH",
+        help="файл общей очереди задач (или sqlite:///путь); env WORK_QUEUE",
+    )
+
+
+def _open_journal(args) -> Optional[JobJournal]:
+    if getattr(args, "no_journal", False):
+        return None
+    return JobJournal(args.journal)
+
+
+def _start_metrics(args) -> float:
+    if not args.no_metrics:
+        path = os.path.join(args.metrics_dir, f"run-{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+        get_metrics().open_jsonl(path)
+        print(f"[METRICS] События прогона: {path}")
+    return time.monotonic()
+
+
+def _finish_metrics(args, started: float) -> None:
+    metrics = get_metrics()
+    metrics.print_summary(time.monotonic() - started)
+    if not args.no_metrics:
+        path = os.path.join(args.metrics_dir, PROMETHEUS_FILE)
+        metrics.write_prometheus(path)
+        metrics.close()
+        print(f"[METRICS] Prometheus: {path}")
+
+
+# =========================
+#   КОМАНДЫ
+# =========================
+
+def cmd_run(args) -> int:
+    import publisher_multisite as publisher
+    from pipeline_multisite import run_sites
+
+    publisher.get_openai_client()  # без ключа падаем сразу, а не на каждой теме
+    site_topics = _collect(args)
+    journal = _open_journal(args)
+    started = _start_metrics(args)
+    try:
+        results = run_sites(
+            site_topics,
+            publish=args.publish,
+            category_id=args.category,
+            journal=journal,
+        )
+    finally:
+        if journal is not None:
+            journal.close()
+        _finish_metrics(args, started)
+
+    print("\n[MAIN] Обработка всех тем завершена.")
+    return 1 if any(job.error is not None for job in results) else 0
+
+
+def cmd_batch(args) -> int:
+    from batch_multisite import make_transport, run_batch
+
+    site_topics = _collect(args)
+    journal = _open_journal(args)
+    started = _start_metrics(args)
+    try:
+        results = run_batch(
+            site_topics,
+            transport=make_transport(args.base_url),
+            publish=args.publish,
+            journal=journal,
+            max_rounds=args.max_rounds,
+            poll_interval=args.poll_interval,
+        )
+    finally:
+        if journal is not None:
+            journal.close()
+        _finish_metrics(args, started)
+
+    return 1 if any(job.error is not None for job in results) else 0
+
+
+def cmd_queue(args) -> int:
+    work_queue = open_work_queue(args.queue)
+    try:
+        if args.action == "add":
+            site_topics = _collect(args)
+            added = total = 0
+            for site_key, topics in site_topics.items():
+                topics = list(topics)
+                n = work_queue.enqueue(
+                    ((site_key, t) for t in topics), publish=args.publish, category_id=args.category
+                )
+                print(f"[QUEUE] [{site_key}] добавлено {n} из {len(topics)} тем")
+                added += n
+                total += len(topics)
+            print(f"[QUEUE] Всего добавлено {added}, уже были в очереди {total - added}")
+            return 0
+
+        if args.action == "requeue":
+            n = work_queue.requeue(args.state, args.site[0] if args.site else None)
+            print(f"[QUEUE] Возвращено в очередь: {n} (из {args.state})")
+            return 0
+
+        if args.action == "dead":
+            items = work_queue.items("dead", args.site[0] if args.site else None)
+            for item in items:
+                print(f"[{item.site_key}] {item.topic!r} (попыток {item.attempts}): {item.error}")
+            if not items:
+                print("[QUEUE] В dead пусто.")
+            return 0
+
+        rows = [r for r in work_queue.stats() if not args.site or r[0] in args.site]
+        if not rows:
+            print("[QUEUE] Очередь пуста.")
+            return 0
+        counts: dict[str, dict[str, int]] = {}
+        for site_key, state, count in rows:
+            counts.setdefault(site_key, {})[state] = count
+        print(f"{'сайт':<16}" + "".join(f"{state:>9}" for state in STATES))
+        for site_key, by_state in counts.items():
+            print(f"{site_key:<16}" + "".join(f"{by_state.get(state, 0):>9}" for state in STATES))
+        return 0
+    finally:
+        work_queue.close()
+
+
+def cmd_worker(args) -> int:
+    import publisher_multisite as publisher
+    from pipeline_multisite import run_queue
+
+    publisher.get_openai_client()  # без ключа падаем сразу, а не на каждой теме
+    work_queue = open_work_queue(
+        args.queue, lease_ttl=args.lease_ttl, max_attempts=args.max_attempts
+    )
+    journal = _open_journal(args)
+    started = _start_metrics(args)
+    try:
+        results = run_queue(
+            work_queue,
+            worker_id=args.worker_id,
+            sites=args.site,
+            in_flight=args.in_flight,
+            wait=args.wait,
+            journal=journal,
+        )
+    finally:
+        work_queue.close()
+        if journal is not None:
+            journal.close()
+        _finish_metrics(args, started)
+
+    print("\n[MAIN] Воркер закончил.")
+    return 1 if any(job.error is not None for job in results) else 0
+
+
+def cmd_validate(args) -> int:
+    problems = 0
+    for site_key in args.site or SITES_CONFIG:
+        cfg = SITES_CONFIG.get(site_key)
+        if cfg is None:
+            continue
+        missing = [k for k in REQUIRED_SITE_KEYS if not cfg.get(k)]
+        if missing:
+            problems += 1
+            print(f"[VALIDATE][ERROR] [{site_key}] Не заданы ключи: {', '.join(missing)}")
+        for key in ("image_reuse_threshold", "topic_dedupe_threshold"):
+            error = threshold_error(cfg[key]) if cfg.get(key) else None
+            if error:
+                problems += 1
+                print(f"[VALIDATE][ERROR] [{site_key}] {key}: {error}")
+
+    # журнал только читаем (mode=ro): если его нет, все темы считаются новыми
+    journal = JournalReader(args.journal) if os.path.exists(args.journal) else None
+    try:
+        site_topics = _collect(args, sync_index=args.sync_index)
+        for site_key, topics in site_topics.items():
+            counts = {"new": 0, "started": 0, "finished": 0, "failed": 0}
+            for topic in topics:
+                rec = journal.get(site_key, topic) if journal is not None else None
+                if rec is None or rec.stage is None:
+                    status = "failed" if rec is not None and rec.error else "new"
+                elif rec.finished:
+                    status = "finished"
+                else:
+                    status = "started"
+                counts[status] += 1
+                if args.list:
+                    print(f"[VALIDATE] [{site_key}] {status:<8} {topic}")
+
+            print(
+                f"[VALIDATE] [{site_key}] тем к работе: {counts['new'] + counts['started'] + counts['failed']} "
+                f"(новых {counts['new']}, начатых {counts['started']}, с ошибкой {counts['failed']}), "
+                f"уже опубликовано: {counts['finished']}"
+            )
+    finally:
+        if journal is not None:
+            journal.close()
+
+    return 1 if problems else 0
+
+
+def cmd_sites(args) -> int:
+    if args.resync:
+        from post_index import get_post_index
+
+        failed = 0
+        for site_key in args.site or SITES_CONFIG:
+            if site_key not in SITES_CONFIG:
+                print(f"[MAIN] Сайт '{site_key}' не найден в SITES_CONFIG")
+                failed += 1
+                continue
+            try:
+                get_post_index(site_key, resync=True)
+            except Exception as e:
+                print(f"[{site_key}] Не удалось синхронизировать индекс записей: {e}")
+                failed += 1
+        return 1 if failed else 0
+
+    for site_key, cfg in SITES_CONFIG.items():
+        topics_file = cfg.get("topics_file")
+        if topics_file:
+            topics_file += "" if os.path.exists(topics_file) else " (файла нет)"
+        print(f"{site_key}")
+        print(f"    wp_url:          {cfg.get('wp_url')}")
+        print(f"    prompt_profile:  {cfg.get('prompt_profile')}")
+        print(f"    seo_plugin:      {cfg.get('seo_plugin') or '—'}")
+        print(f"    category_id:     {cfg.get('default_category_id') or '—'}")
+        print(f"    topics_file:     {topics_file or '—'}")
+    return 0
+
+
+def cmd_journal(args) -> int:
+    if not os.path.exists(args.journal):
+        print(f"[MAIN] Журнал не найден: {args.journal}")
+        return 1
+
+    journal = JournalReader(args.journal)
+    try:
+        if args.topic:
+            site_key = args.site[0] if args.site else next(iter(SITES_CONFIG))
+            rec = journal.get(site_key, args.topic)
+            if rec is None:
+                print(f"[{site_key}] Темы нет в журнале: {args.topic!r}")
+                return 1
+            print(f"[{site_key}] {rec.topic!r}")
+            print(f"    стадия:    {rec.stage or '—'}")
+            print(f"    media_id:  {rec.media_id or '—'}")
+            print(f"    post_id:   {rec.post_id or '—'}")
+            print(f"    попыток с ошибкой: {rec.attempts}")
+            print(f"    ошибка:    {rec.error or '—'}")
+            return 0
+
+        rows = [r for r in journal.stats() if not args.site or r[0] in args.site]
+        if not rows:
+            print("[MAIN] Журнал пуст.")
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        rows.sort(key=lambda r: (r[0], order.get(r[1], -1)))
+        print(f"{'сайт':<16} {'стадия':<10} {'задач':>7} {'с ошибкой':>10}")
+        for site_key, stage, count, failed in rows:
+            print(f"{site_key:<16} {stage or '—':<10} {count:>7} {failed or 0:>10}")
+
+        if args.errors:
+            site_key = args.site[0] if args.site and len(args.site) == 1 else None
+            print()
+            for rec in journal.errors(site_key, limit=args.errors):
+                print(f"[{rec.site_key}] {rec.topic!r} (стадия {rec.stage or '—'}): {rec.error}")
+    finally:
+        journal.close()
+    return 0
+
+
+def cmd_bench(args) -> int:
+    from bench_multisite import print_report, run_bench
+    from fake_services import FakeOpenAIConfig, FakeWPConfig
+
+    report = run_bench(
+        topics=args.topics,
+        sites=args.sites,
+        runner=args.runner,
+        openai=FakeOpenAIConfig(
+            ttft=args.ttft,
+            cached_ttft=args.cached_ttft,
+            tokens_per_sec=args.tokens_per_sec,
+            words_mean=args.words,
+            words_sd=args.words_sd,
+            malformed_rate=args.malformed,
+            image_latency=args.image_latency,
+            rpm=args.rpm,
+            seed=args.seed,
+        ),
+        wp=FakeWPConfig(
+            latency=args.wp_latency,
+            media_latency=args.media_latency,
+            rate_429=args.rate_429,
+            rate_5xx=args.rate_5xx,
+            max_rps=args.wp_max_rps,
+            batch_max=args.wp_batch_max,
+            seed=args.seed,
+        ),
+        stream=args.stream,
+        speculative=args.speculative,
+        wp_rate=args.wp_rate,
+        post_batch=args.post_batch,
+        post_batch_wait=args.post_batch_wait,
+        image_reuse=args.image_reuse,
+        sections=args.sections,
+        repair=args.repair,
+        variants=tuple(args.variants),
+        links=args.links,
+        workers=args.workers,
+        verbose=args.verbose,
+    )
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[BENCH] Отчёт: {args.json}")
+    return 0
+
+
+# =========================
+#   РАЗБОР АРГУМЕНТОВ
+# =========================
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="cli_multisite.py",
+        description="Генерация и публикация статей на сайты WordPress.",
+    )
+    sub = parser.add_subparsers(dest="command", metavar="КОМАНДА")
+    sub.required = True
+
+    p = sub.add_parser("run", help="сгенерировать и опубликовать темы")
+    _add_topic_options(p)
+    _add_publish_options(p)
+    _add_journal_options(p)
+    _add_metrics_options(p)
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("batch", help="сгенерировать через OpenAI Batch API и опубликовать")
+    _add_topic_options(p)
+    _add_publish_options(p)
+    _add_journal_options(p)
+    _add_metrics_options(p)
+    p.add_argument(
+        "--base-url", default=os.getenv("BATCH_BASE_URL"),
+        help="локальная заглушка Batch API; env BATCH_BASE_URL",
+    )
+    p.add_argument("--poll-interval", type=float, default=60.0, metavar="SEC")
+    p.add_argument("--max-rounds", type=int, default=2)
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser("queue", help="общая очередь задач для нескольких воркеров")
+    p.add_argument(
+        "action", nargs="?", default="stats", choices=("add", "stats", "dead", "requeue"),
+        help="add — положить темы; stats — сводка (по умолчанию); dead — задачи, у которых кончились попытки; "
+             "requeue — вернуть задачи из --state в очередь",
+    )
+    _add_queue_options(p)
+    _add_topic_options(p)
+    p.add_argument("--publish", action="store_true", help="задачи публиковать сразу (по умолчанию черновики)")
+    p.add_argument("--category", type=int, metavar="ID", help="рубрика задач вместо default_category_id")
+    p.add_argument("--state", default="dead", choices=STATES, help="для requeue: из какого состояния")
+    p.set_defaults(func=cmd_queue)
+
+    p = sub.add_parser("worker", help="разбирать общую очередь задач")
+    _add_queue_options(p)
+    p.add_argument("--site", action="append", metavar="KEY", help="только этот сайт (можно несколько раз)")
+    p.add_argument("--worker-id", metavar="NAME", help="имя воркера в очереди (по умолчанию хост:PID)")
+    p.add_argument("--wait", action="store_true", help="не выходить, когда очередь опустела, — ждать новые задачи")
+    p.add_argument(
+        "--in-flight", type=int, metavar="N",
+        help="сколько задач держать в аренде одновременно (по умолчанию 8)",
+    )
+    p.add_argument(
+        "--lease-ttl", type=float, default=DEFAULT_LEASE_TTL, metavar="SEC",
+        help="аренда задачи; без продления через столько секунд её заберёт другой воркер",
+    )
+    p.add_argument(
+        "--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, metavar="N",
+        help="попыток на задачу, потом — dead",
+    )
+    p.add_argument("--pause", action="store_true", help="в конце ждать Enter (для запуска двойным кликом)")
+    _add_journal_options(p)
+    _add_metrics_options(p)
+    p.set_defaults(func=cmd_worker)
+
+    p = sub.add_parser(
+        "validate", aliases=["dry-run"],
+        help="прочитать и проверить темы без вызовов модели и публикации",
+    )
+    _add_topic_options(p)
+    _add_journal_options(p, optional=False)
+    p.add_argument(
+        "--sync-index", action="store_true",
+        help="выгрузить записи сайта из WP для проверки дублей (по умолчанию — только локальный индекс)",
+    )
+    p.add_argument("--list", action="store_true", help="печатать каждую тему со статусом")
+    p.set_defaults(func=cmd_validate)
+
+    p = sub.add_parser("sites", help="показать сайты из SITES_CONFIG")
+    p.add_argument(
+        "--resync", action="store_true",
+        help="заново выгрузить индекс записей из WP (удалённые записи пропадут из него)",
+    )
+    p.add_argument("--site", action="append", metavar="KEY", help="только этот сайт (с --resync)")
+    p.set_defaults(func=cmd_sites)
+
+    p = sub.add_parser("journal", help="сводка журнала задач")
+    _add_journal_options(p, optional=False)
+    p.add_argument("--site", action="append", metavar="KEY", help="только этот сайт")
+    p.add_argument("--errors", type=int, nargs="?", const=20, metavar="N", help="последние N ошибок")
+    p.add_argument("--topic", help="состояние одной темы (сайт — первый --site)")
+    p.set_defaults(func=cmd_journal)
+
+    p = sub.add_parser("bench", help="бенчмарк на локальных заглушках OpenAI и WP (без ключа и сети)")
+    p.add_argument("--topics", type=int, default=20, help="тем на сайт")
+    p.add_argument("--sites", type=int, default=2)
+    p.add_argument("--runner", choices=("pipeline", "queue", "sequential"), default="pipeline")
+    p.add_argument("--workers", type=int, default=2, help="воркеров общей очереди (--runner queue)")
+    p.add_argument("--stream", action="store_true", help="потоковая генерация (stream_generation)")
+    p.add_argument("--sections", action="store_true", help="генерация по разделам (section_generation)")
+    p.add_argument("--repair", action="store_true", help="дописывать короткие статьи (repair_articles)")
+    p.add_argument("--speculative", type=int, default=0, metavar="K", help="кандидатов статьи параллельно")
+    p.add_argument("--json", metavar="PATH", help="сохранить отчёт в JSON")
+    p.add_argument("--verbose", action="store_true", help="не глушить вывод конвейера")
+    g = p.add_argument_group("заглушка OpenAI")
+    g.add_argument("--ttft", type=float, default=0.5, metavar="SEC", help="до первого токена")
+    g.add_argument("--cached-ttft", type=float, default=0.3, metavar="SEC", help="то же при попадании в кэш префикса")
+    g.add_argument("--tokens-per-sec", type=float, default=1500.0)
+    g.add_argument("--words", type=int, default=1200, help="средний объём статьи")
+    g.add_argument("--words-sd", type=int, default=200)
+    g.add_argument("--malformed", type=float, default=0.05, metavar="RATE", help="доля битого JSON")
+    g.add_argument("--image-latency", type=float, default=1.0, metavar="SEC")
+    g.add_argument("--rpm", type=int, default=0, help="лимит запросов в минуту заглушки OpenAI, 0 — нет")
+    g = p.add_argument_group("заглушка WordPress")
+    g.add_argument("--wp-latency", type=float, default=0.05, metavar="SEC")
+    g.add_argument("--media-latency", type=float, default=0.2, metavar="SEC")
+    g.add_argument("--rate-429", type=float, default=0.02, metavar="RATE")
+    g.add_argument("--rate-5xx", type=float, default=0.02, metavar="RATE")
+    g.add_argument("--wp-max-rps", type=float, default=0.0, metavar="RPS", help="лимит заглушки WP, 0 — нет")
+    g.add_argument("--wp-rate", type=float, metavar="RPS", help="wp_rate/group_rate бенч-сайтов")
+    g.add_argument("--wp-batch-max", type=int, default=25, metavar="N", help="лимит batch/v1 заглушки, 0 — без batch/v1")
+    g.add_argument("--post-batch", type=int, metavar="N", help="post_batch_size бенч-сайтов, 1 — посты по одному")
+    g.add_argument("--post-batch-wait", type=float, metavar="SEC", help="post_batch_wait бенч-сайтов")
+    p.add_argument(
+        "--variants", nargs="*", default=[], metavar="NAME",
+        help="варианты обложки кроме featured (image_variants), например: card social",
+    )
+    p.add_argument("--links", type=int, default=0, metavar="N", help="internal_links бенч-сайтов")
+    p.add_argument(
+        "--image-reuse", type=float, metavar="THRESHOLD",
+        help="image_reuse_threshold бенч-сайтов: брать обложку с похожим промптом",
+    )
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=cmd_bench)
+
+    return parser
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+
+    try:
+        return args.func(args)
+    except KeyboardInterrupt:
+        print("\n[MAIN] Прервано.")
+        return 130
+    except Exception:
+        print("\nПроизошла ошибка при выполнении скрипта (глобальная):\n")
+        traceback.print_exc()
+        return 1
+    finally:
+        if getattr(args, "pause", False):
+            input("\nНажми Enter, чтобы закрыть окно...")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,5 +7,21 @@ SITES_CONFIG = {
         "prompt_profile": "default",
         "seo_plugin": "rankmath",
         "default_category_id": 1,
+        "topics_file": "topics.txt",  # темы этого сайта (можно и через site_topics.txt)
+        "wp_concurrency": 2,  # одновременных запросов к этому WP
+        "wp_rate": 4.0,  # запросов в секунду к хосту (потолок; на 429/503 снижается сам)
+        "rate_group": None,  # общий лимит сайтов одного сервера, например "46.62.229.237"; None — IP из DNS
+        "group_rate": 8.0,  # запросов в секунду на всю группу rate_group
+        "post_batch_size": 25,  # готовых постов в одном запросе batch/v1 (1 — по одному)
+        "image_variants": [],  # кроме обложки featured, например ["card", "social"]: 640x360 для списков, 1200x630 для соцсетей
+        "internal_links": 0,  # >0 — столько ссылок на похожие статьи сайта ставить в новую запись
+        "image_reuse_threshold": None,  # (0.5, 1]: брать обложку с похожим image_prompt; None — всегда новая
+        "max_in_flight": 6,  # задач сайта одновременно в работе
+        "stream_generation": False,  # потоковая генерация с досрочным обрывом плохих попыток
+        "repair_articles": False,  # True — короткую статью дописывать по разделам, а не генерировать заново
+        "section_generation": False,  # план статьи, затем H2-разделы параллельно (article_sections.py)
+        "speculative_candidates": 0,  # >0 — столько кандидатов статьи параллельно, берём первый годный
+        "hedge_after": None,  # секунды (p95 генерации): если ответа нет — ещё один страхующий запрос
+        "topic_dedupe_threshold": 0.6,  # сходство тем (Жаккар по основам), выше — дубль; None — не проверять
     },
 }
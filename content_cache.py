@@ -0,0 +1,180 @@
+"""
+Дисковый кэш сгенерированных статей и картинок.
+
+Ключ — sha256 от всего, что влияет на результат модели (тема, профиль
+промпта, текст шаблона, модель, температура), поэтому изменение шаблона
+автоматически «сбрасывает» кэш. Если WordPress упал после генерации,
+повторный прогон берёт статью и обложку отсюда и не платит за модель.
+
+Записи старше max_age удаляются при чтении и при чистке; когда общий
+объём превышает max_bytes, удаляются самые давно использованные.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+
+DEFAULT_CACHE_DIR = os.path.join(".cache", "content")
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+
+def cache_key(*parts) -> str:
+    """Стабильный ключ из произвольных JSON-сериализуемых частей."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ContentCache:
+    """Кэш статей (JSON) и картинок (WebP) в каталоге root."""
+
+    def __init__(
+        self,
+        root: str = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age: float = DEFAULT_MAX_AGE,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None  # считаем лениво при первой записи
+
+    # ---- пути и низкоуровневые операции ----
+
+    def _path(self, kind: str, key: str, ext: str) -> str:
+        return os.path.join(self.root, kind, key[:2], f"{key}.{ext}")
+
+    def _read(self, path: str) -> Optional[bytes]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        if time.time() - st.st_mtime > self.max_age:
+            self._remove(path, st.st_size)
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        # отмечаем использование — для вытеснения по давности
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write(self, path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+
+        try:
+            old_size = os.path.getsize(path)
+        except FileNotFoundError:
+            old_size = 0
+        os.replace(tmp, path)
+
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_size()
+            else:
+                self._total += len(data) - old_size
+            over = self._total > self.max_bytes
+
+        if over:
+            self.evict()
+
+    def _remove(self, path: str, size: int) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._total is not None:
+                self._total -= size
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _scan_size(self) -> int:
+        return sum(size for _mtime, size, _path in self._entries())
+
+    # ---- вытеснение ----
+
+    def evict(self) -> int:
+        """Удаляет просроченные записи и самые старые сверх max_bytes. Возвращает число удалённых."""
+        entries = sorted(self._entries())
+        now = time.time()
+        total = sum(size for _mtime, size, _path in entries)
+        removed = 0
+
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self._total = total
+        return removed
+
+    # ---- статьи ----
+
+    def get_article(self, key: str) -> Optional[dict]:
+        data = self._read(self._path("articles", key, "json"))
+        if data is None:
+            return None
+        try:
+            return json.loads(data.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return None
+
+    def put_article(self, key: str, article: dict) -> None:
+        data = json.dumps(article, ensure_ascii=False).encode("utf-8")
+        self._write(self._path("articles", key, "json"), data)
+
+    # ---- картинки ----
+
+    def get_image(self, key: str, ext: str = "webp") -> Optional[bytes]:
+        return self._read(self._path("images", key, ext))
+
+    def put_image(self, key: str, data: bytes, ext: str = "webp") -> None:
+        self._write(self._path("images", key, ext), data)
+
+
+_cache: Optional[ContentCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_content_cache() -> ContentCache:
+    """Общий кэш процесса. Каталог можно переопределить через CONTENT_CACHE_DIR."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ContentCache(os.getenv("CONTENT_CACHE_DIR") or DEFAULT_CACHE_DIR)
+        return _cache
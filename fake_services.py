@@ -0,0 +1,566 @@
+"""
+Локальные заглушки OpenAI и WordPress для бенчмарка и офлайн-проверок.
+
+FakeOpenAI отвечает на /v1/chat/completions (обычный ответ и SSE-поток,
+с usage) и /v1/images/generations (PNG в base64). Длина статьи берётся
+из нормального распределения, часть ответов — битый JSON. Задержка
+ответа: время до первого токена плюс токены / скорость генерации.
+
+FakeWP отвечает на /wp-json/wp/v2/posts (выгрузка индекса, создание и
+обновление записи) и /wp-json/wp/v2/media, с задержкой и случайными
+429 (с Retry-After) и 5xx. Префикс пути до /wp-json/ считается сайтом,
+поэтому один сервер обслуживает сколько угодно сайтов.
+
+Оба сервера запускаются в отдельном процессе (FakeServices), чтобы их
+работа не отнимала GIL у измеряемого кода. GET /__stats — счётчики
+запросов и отданных ошибок.
+
+    python fake_services.py    — поднять заглушки и ждать Ctrl+C
+"""
+
+import base64
+import io
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+import urllib.request
+from collections import deque
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+@dataclass
+class FakeOpenAIConfig:
+    ttft: float = 0.5  # секунды до первого токена
+    cached_ttft: float = 0.3  # то же, если префикс запроса уже в кэше
+    tokens_per_sec: float = 1500.0
+    words_mean: int = 1200
+    words_sd: int = 200
+    malformed_rate: float = 0.05  # доля ответов с битым JSON
+    image_latency: float = 1.0
+    rpm: int = 0  # лимит запросов в минуту (0 — без лимита), с заголовками x-ratelimit-*
+    seed: int = 0
+
+
+@dataclass
+class FakeWPConfig:
+    latency: float = 0.05
+    media_latency: float = 0.2
+    rate_429: float = 0.02
+    rate_5xx: float = 0.02
+    retry_after: int = 0  # значение заголовка Retry-After у 429
+    max_rps: float = 0.0  # лимит POST в секунду на весь сервер (0 — без лимита)
+    batch_max: int = 25  # запросов в batch/v1 (0 — WP без batch/v1, 404)
+    seed: int = 0
+
+
+# Примерно столько символов кириллицы приходится на токен
+CHARS_PER_TOKEN = 3
+
+STREAM_PIECE_CHARS = 16
+
+_VOCABULARY = (
+    "ставка коэффициент матч команда игрок турнир сезон стратегия анализ прогноз "
+    "линия букмекер рынок тотал фора победа поражение ничья статистика форма "
+    "тренер состав травма мотивация выезд стадион лига чемпионат кубок раунд "
+    "банкролл риск выигрыш проигрыш депозит бонус фрибет кэшаут экспресс ординар"
+).split()
+
+
+# =========================
+#   ОБЩЕЕ
+# =========================
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, handler, config):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.stats: dict[str, int] = {}
+        self.prefixes: set[str] = set()
+        self.lock = threading.Lock()
+        self._window: deque = deque()
+
+    def count(self, key: str) -> int:
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+            return self.stats[key]
+
+    def roll(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+    def admit(self, limit: float, period: float) -> tuple[bool, int]:
+        """Скользящее окно: (пропустить ли запрос, сколько ещё осталось в окне)."""
+        now = time.monotonic()
+        with self.lock:
+            while self._window and self._window[0] <= now - period:
+                self._window.popleft()
+            if len(self._window) >= limit:
+                self.stats["rate_limited"] = self.stats.get("rate_limited", 0) + 1
+                return False, 0
+            self._window.append(now)
+            return True, int(limit - len(self._window))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: _Server
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _json(self, code: int, obj, headers: Optional[dict] = None) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/__stats":
+            with self.server.lock:
+                return self._json(200, dict(self.server.stats))
+        self._json(404, {"error": "not found"})
+
+
+# =========================
+#   OPENAI
+# =========================
+
+def fake_article(words: int, rng: random.Random, n: int = 0) -> dict:
+    """Статья со структурой, которую требует промпт: H2, абзацы, список, таблица."""
+    sections = max(3, words // 250)
+    per_section = max(20, words // sections)
+    parts = []
+    for s in range(sections):
+        parts.append(f"<h2>Раздел {s + 1}</h2>")
+        text = " ".join(rng.choice(_VOCABULARY) for _ in range(per_section))
+        parts.append(f"<p>{text}</p>")
+        if s == 0:
+            parts.append("<ul><li>первый пункт</li><li>второй пункт</li></ul>")
+        if s == 1:
+            parts.append("<table><tr><td>рынок</td><td>коэффициент</td></tr>"
+                         "<tr><td>П1</td><td>1.85</td></tr></table>")
+    return {
+        "title": f"Статья бенчмарка {n}",
+        "meta_title": f"Статья бенчмарка {n}",
+        "meta_description": "Описание статьи для проверки производительности.",
+        "slug": f"bench-{n}",
+        "content_html": "".join(parts),
+        "image_prompt": f"Стадион вечером, реалистичная фотография, кадр {n}",
+    }
+
+
+def fake_outline(words: int, n: int = 0, sections: int = 5) -> dict:
+    """План статьи для генерации по разделам (см. prompts.OUTLINE_TEMPLATE)."""
+    article = fake_article(words, random.Random(n), n)
+    del article["content_html"]
+    return {
+        **article,
+        "intro_html": "<p>Вступление статьи бенчмарка о ставках и статистике матчей.</p>",
+        "sections": [
+            {
+                "h2": f"Раздел {s + 1}",
+                "points": ["первый тезис", "второй тезис"],
+                "words": words // sections,
+                "table": s == 1,
+                "list": s == 0,
+            }
+            for s in range(sections)
+        ],
+    }
+
+
+def fake_section(words: int, rng: random.Random, table: bool, bullets: bool) -> dict:
+    """Один раздел: абзацы на words слов, таблица и список по заданию."""
+    parts = [f"<p>{' '.join(rng.choice(_VOCABULARY) for _ in range(words))}</p>"]
+    if bullets:
+        parts.append("<ul><li>первый пункт</li><li>второй пункт</li></ul>")
+    if table:
+        parts.append("<table><tr><td>рынок</td><td>коэффициент</td></tr>"
+                     "<tr><td>П1</td><td>1.85</td></tr></table>")
+    return {"content_html": "".join(parts)}
+
+
+_SECTION_WORDS_RE = re.compile(r"около (\d+) слов")
+
+
+def _fake_image(width: int = 1536, height: int = 1024):
+    """Градиент с шумом: WebP-кодировщик работает примерно как на фотографии."""
+    from PIL import Image
+
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    return Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+
+
+def _fake_png(image, n: int) -> bytes:
+    """
+    PNG картинки с цветной плашкой по номеру n: у каждого ответа свои
+    байты, как у настоящей модели (иначе все обложки совпадут по хэшу).
+    Плашка в центре — её не срезает обрезка ни под один вариант.
+    """
+    image = image.copy()
+    x, y = image.width // 2 - 48, image.height // 2 - 48
+    image.paste((n * 37 % 256, n * 91 % 256, n * 53 % 256), (x, y, x + 96, y + 96))
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+class _OpenAIHandler(_Handler):
+    _limit_headers: dict = {}
+
+    def end_headers(self):
+        for k, v in self._limit_headers.items():
+            self.send_header(k, str(v))
+        super().end_headers()
+
+    def do_POST(self):
+        try:
+            request = json.loads(self._body() or b"{}")
+        except json.JSONDecodeError:
+            return self._json(400, {"error": {"message": "invalid json"}})
+
+        rpm = self.server.config.rpm
+        if rpm:
+            ok, remaining = self.server.admit(rpm, 60.0)
+            self._limit_headers = {
+                "x-ratelimit-limit-requests": rpm,
+                "x-ratelimit-remaining-requests": remaining,
+                "x-ratelimit-reset-requests": f"{60 / rpm:.3f}s",
+            }
+            if not ok:
+                return self._json(
+                    429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                    {"retry-after": 1},
+                )
+
+        if self.path.endswith("/chat/completions"):
+            return self._chat(request)
+        if self.path.endswith("/images/generations"):
+            return self._image(request)
+        self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _chat(self, request: dict) -> None:
+        srv, cfg = self.server, self.server.config
+        n = srv.count("chat")
+        messages = request.get("messages", [])
+        task = (messages[-1].get("content") or "") if messages else ""
+
+        with srv.lock:
+            words = max(100, int(srv.rng.gauss(cfg.words_mean, cfg.words_sd)))
+            malformed = srv.rng.random() < cfg.malformed_rate
+            # запросы генерации по разделам (article_sections.py): раздел идёт
+            # после ответа-плана, план узнаём по ключу "sections" в задании;
+            # досборка — тоже после ответа (статьи), отвечаем добавкой к разделу
+            if any(m.get("role") == "assistant" for m in messages):
+                kind = "chat_repair" if "Дополни раздел" in task else "chat_section"
+                match = _SECTION_WORDS_RE.search(task)
+                # досборка без объёма — только таблица или список
+                section_words = int(match.group(1)) if match else 40
+                section_words = max(20, int(srv.rng.gauss(section_words, section_words * 0.15)))
+                obj = fake_section(section_words, srv.rng, "таблиц" in task, "список" in task)
+            elif '"sections"' in task:
+                kind = "chat_outline"
+                obj = fake_outline(words, n)
+            else:
+                kind = None
+                obj = fake_article(words, srv.rng, n)
+            content = json.dumps(obj, ensure_ascii=False)
+        if kind:
+            srv.count(kind)
+        if malformed:
+            srv.count("chat_malformed")
+            content = content[: len(content) // 2]
+
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        prompt_tokens = prompt_chars // CHARS_PER_TOKEN
+
+        # кэш префикса как у OpenAI: всё, кроме последнего сообщения, от 1024
+        # токенов, кэшируется блоками по 128 токенов
+        prefix = json.dumps(messages[:-1], ensure_ascii=False)
+        prefix_tokens = sum(len(m.get("content") or "") for m in messages[:-1]) // CHARS_PER_TOKEN
+        with srv.lock:
+            seen = prefix in srv.prefixes
+            srv.prefixes.add(prefix)
+        cached_tokens = prefix_tokens // 128 * 128 if seen and prefix_tokens >= 1024 else 0
+        ttft = cfg.cached_ttft if cached_tokens else cfg.ttft
+
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // CHARS_PER_TOKEN,
+            "total_tokens": prompt_tokens + len(content) // CHARS_PER_TOKEN,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        generation = usage["completion_tokens"] / cfg.tokens_per_sec
+        base = {
+            "id": f"chatcmpl-{n}",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-fake"),
+        }
+
+        if not request.get("stream"):
+            time.sleep(ttft + generation)
+            return self._json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(obj) -> None:
+            data = obj if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False)
+            payload = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+
+        def chunk(delta: dict, finish: Optional[str] = None) -> dict:
+            return {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+
+        pieces = [content[i:i + STREAM_PIECE_CHARS] for i in range(0, len(content), STREAM_PIECE_CHARS)]
+        pause = generation / max(1, len(pieces))
+        try:
+            time.sleep(ttft)
+            send(chunk({"role": "assistant", "content": ""}))
+            started = time.monotonic()
+            for i, piece in enumerate(pieces, 1):
+                send(chunk({"content": piece}))
+                # спим пачками: time.sleep на каждый кусок слишком неточен
+                if i % 50 == 0:
+                    time.sleep(max(0.0, started + i * pause - time.monotonic()))
+            send(chunk({}, "stop"))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                send({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            srv.count("chat_cancelled")  # клиент оборвал поток
+            self.close_connection = True
+
+    def _image(self, request: dict) -> None:
+        srv, cfg = self.server, self.server.config
+        started = time.monotonic()
+        png = _fake_png(srv.image, srv.count("images"))
+        time.sleep(max(0.0, started + cfg.image_latency - time.monotonic()))
+        prompt_tokens = len(request.get("prompt") or "") // CHARS_PER_TOKEN
+        self._json(200, {
+            "created": int(time.time()),
+            "data": [{"b64_json": base64.b64encode(png).decode("ascii")}],
+            "usage": {
+                "input_tokens": prompt_tokens,
+                "output_tokens": 1056,
+                "total_tokens": prompt_tokens + 1056,
+                "input_tokens_details": {"text_tokens": prompt_tokens, "image_tokens": 0},
+            },
+        })
+
+
+# =========================
+#   WORDPRESS
+# =========================
+
+class _WPHandler(_Handler):
+    def _route(self) -> tuple[str, str]:
+        prefix, _, route = self.path.partition("/wp-json/")
+        return prefix.strip("/") or "-", route.split("?", 1)[0].strip("/")
+
+    def do_GET(self):
+        if self.path == "/__stats":
+            return super().do_GET()
+        site, route = self._route()
+        if route == "wp/v2/posts":
+            self.server.count(f"GET {route}")
+            return self._json(200, [], {"X-WP-Total": 0, "X-WP-TotalPages": 1})
+        self._json(404, {"code": "rest_no_route"})
+
+    def do_OPTIONS(self):
+        site, route = self._route()
+        batch_max = self.server.config.batch_max
+        if route == "batch/v1" and batch_max:
+            return self._json(200, {
+                "namespace": "batch/v1",
+                "methods": ["POST"],
+                "endpoints": [{"methods": ["POST"], "args": {"requests": {"maxItems": batch_max}}}],
+            })
+        self._json(404, {"code": "rest_no_route"})
+
+    def _fail(self) -> bool:
+        """Случайный 429 или 5xx по настройкам; True — ошибка уже отправлена."""
+        srv, cfg = self.server, self.server.config
+        roll = srv.roll()
+        if roll < cfg.rate_429:
+            srv.count("sent_429")
+            self._json(429, {"code": "too_many_requests"}, {"Retry-After": cfg.retry_after})
+            return True
+        if roll < cfg.rate_429 + cfg.rate_5xx:
+            srv.count("sent_5xx")
+            self._json(503, {"code": "service_unavailable"})
+            return True
+        return False
+
+    def do_POST(self):
+        srv, cfg = self.server, self.server.config
+        body = self._body()
+        site, route = self._route()
+
+        if cfg.max_rps and not srv.admit(cfg.max_rps, 1.0)[0]:
+            return self._json(429, {"code": "too_many_requests"}, {"Retry-After": 1})
+
+        if route == "wp/v2/media":
+            srv.count("POST wp/v2/media")
+            time.sleep(cfg.media_latency)
+            if self._fail():
+                return
+            media_id = srv.count("media_created")
+            return self._json(201, {"id": media_id, "source_url": f"/{site}/media/{media_id}.webp"})
+
+        if route == "batch/v1" and cfg.batch_max:
+            srv.count("POST batch/v1")
+            try:
+                calls = json.loads(body or b"{}")["requests"]
+            except (json.JSONDecodeError, KeyError):
+                return self._json(400, {"code": "rest_invalid_json"})
+            if len(calls) > cfg.batch_max:
+                return self._json(400, {"code": "rest_batch_max_size_exceeded"})
+            # один цикл загрузки WP на весь пакет — задержка одна
+            time.sleep(cfg.latency)
+            if self._fail():
+                return
+            responses = []
+            for call in calls:
+                code, obj = self._save_post(site, call["path"].strip("/"), call.get("body") or {})
+                responses.append({"body": obj, "status": code, "headers": {}})
+            return self._json(207, {"failOnError": False, "responses": responses})
+
+        if route == "wp/v2/posts" or route.startswith("wp/v2/posts/"):
+            srv.count("POST wp/v2/posts")
+            time.sleep(cfg.latency)
+            if self._fail():
+                return
+            try:
+                payload = json.loads(body or b"{}")
+            except json.JSONDecodeError:
+                return self._json(400, {"code": "rest_invalid_json"})
+            return self._json(*self._save_post(site, route, payload))
+
+        self._json(404, {"code": "rest_no_route"})
+
+    def _save_post(self, site: str, route: str, payload: dict) -> tuple[int, dict]:
+        """Создание (wp/v2/posts) или обновление (wp/v2/posts/ID) записи."""
+        if route != "wp/v2/posts" and not route.startswith("wp/v2/posts/"):
+            return 404, {"code": "rest_no_route"}
+        srv = self.server
+        srv.count("posts_saved")
+        post_id = route.rpartition("/")[2]
+        if post_id.isdigit():
+            code, post_id = 200, int(post_id)
+        else:
+            code, post_id = 201, srv.count("posts_created")
+        slug = payload.get("slug") or f"post-{post_id}"
+        return code, {
+            "id": post_id,
+            "slug": slug,
+            "status": payload.get("status") or "draft",
+            "link": f"http://{site}.local/{slug}/",
+        }
+
+
+# =========================
+#   ЗАПУСК
+# =========================
+
+def _serve(openai_cfg: dict, wp_cfg: dict, ports) -> None:
+    openai_srv = _Server(_OpenAIHandler, FakeOpenAIConfig(**openai_cfg))
+    openai_srv.image = _fake_image()
+    wp_srv = _Server(_WPHandler, FakeWPConfig(**wp_cfg))
+
+    threading.Thread(target=wp_srv.serve_forever, daemon=True).start()
+    ports.put((openai_srv.server_port, wp_srv.server_port))
+    openai_srv.serve_forever()
+
+
+class FakeServices:
+    """Заглушки OpenAI и WP в дочернем процессе; with FakeServices() as fake: ..."""
+
+    def __init__(
+        self,
+        openai: Optional[FakeOpenAIConfig] = None,
+        wp: Optional[FakeWPConfig] = None,
+    ):
+        self.openai_config = openai or FakeOpenAIConfig()
+        self.wp_config = wp or FakeWPConfig()
+        self.openai_url: Optional[str] = None
+        self.wp_url: Optional[str] = None
+        self._proc = None
+
+    def start(self) -> "FakeServices":
+        ctx = multiprocessing.get_context("spawn")
+        ports = ctx.Queue()
+        self._proc = ctx.Process(
+            target=_serve,
+            args=(asdict(self.openai_config), asdict(self.wp_config), ports),
+            daemon=True,
+        )
+        self._proc.start()
+        openai_port, wp_port = ports.get(timeout=60)
+        self.openai_url = f"http://127.0.0.1:{openai_port}/v1"
+        self.wp_url = f"http://127.0.0.1:{wp_port}"
+        return self
+
+    def stats(self) -> dict:
+        """Счётчики обоих серверов: {'openai': {...}, 'wp': {...}}."""
+        result = {}
+        for name, url in (("openai", self.openai_url.rsplit("/v1", 1)[0]), ("wp", self.wp_url)):
+            with urllib.request.urlopen(f"{url}/__stats", timeout=10) as resp:
+                result[name] = json.loads(resp.read())
+        return result
+
+    def stop(self) -> None:
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.join(timeout=10)
+            self._proc = None
+
+    def __enter__(self) -> "FakeServices":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    with FakeServices() as fake:
+        print(f"OpenAI: {fake.openai_url}  (OPENAI_BASE_URL)")
+        print(f"WP:     {fake.wp_url}/<сайт>  (wp_url в SITES_CONFIG)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -28,6 +28,20 @@ add_action( 'init', function() {
                 },
             ]
         );
+
+        // JSON {"card": 123, "social": 124} — ID вариантов обложки в медиатеке
+        register_post_meta(
+            $type,
+            'atlas_image_variants',
+            [
+                'show_in_rest'  => true,
+                'single'        => true,
+                'type'          => 'string',
+                'auth_callback' => function() {
+                    return current_user_can( 'edit_posts' );
+                },
+            ]
+        );
     }
 } );
 
@@ -55,4 +69,16 @@ function atlas_sync_rank_math_meta_from_rest( $post, $request, $creating ) {
             sanitize_textarea_field( $meta['rank_math_description'] )
         );
     }
+
+    // Вариант social (1200x630) — картинка для Facebook и Twitter в Rank Math
+    if ( isset( $meta['atlas_image_variants'] ) ) {
+        $variants = json_decode( $meta['atlas_image_variants'], true );
+        $social_id = is_array( $variants ) && isset( $variants['social'] ) ? absint( $variants['social'] ) : 0;
+        $social_url = $social_id ? wp_get_attachment_url( $social_id ) : false;
+        if ( $social_url ) {
+            update_post_meta( $post->ID, 'rank_math_facebook_image', esc_url_raw( $social_url ) );
+            update_post_meta( $post->ID, 'rank_math_facebook_image_id', $social_id );
+            update_post_meta( $post->ID, 'rank_math_twitter_use_facebook', 'on' );
+        }
+    }
 }
@@ -0,0 +1,221 @@
+"""
+Санитайзер HTML статьи за один проход.
+
+Потоковый разбор (html.parser) делает всё сразу:
+- оставляет только теги из ALLOWED_TAGS без атрибутов, остальные теги
+  снимает (текст сохраняется), <script>/<style> вырезает целиком;
+- убирает ведущий <h1> вместе с текстом, остальные <h1> превращает в <h2>;
+- закрывает незакрытые теги, чтобы на выходе был корректный HTML;
+- считает слова видимого текста (теги словами не считаются), таблицы,
+  списки, H2/H3 и проверяет порядок заголовков.
+
+Результат — HtmlReport: чистый HTML и вся статистика, по которой можно
+решать, нужна ли повторная генерация, без повторных проходов по тексту.
+"""
+
+from dataclasses import dataclass, field
+from html import escape
+from html.parser import HTMLParser
+
+
+# Теги, которые разрешает промпт
+ALLOWED_TAGS = frozenset({
+    "h2", "h3", "p", "ul", "ol", "li", "table", "thead", "tbody", "tr", "td",
+})
+
+# Замены: близкие по смыслу теги приводим к разрешённым
+TAG_ALIASES = {
+    "h1": "h2",
+    "th": "td",
+    "h4": "h3",
+    "h5": "h3",
+    "h6": "h3",
+}
+
+# Вырезаются вместе с содержимым
+DROP_CONTENT_TAGS = frozenset({"script", "style", "head", "title", "noscript"})
+
+_VOID_TAGS = frozenset({"br", "hr", "img", "meta", "link", "input", "wbr", "source"})
+
+# Открытие тега неявно закрывает эти теги на вершине стека
+# (<li>один<li>два, <p>абзац<h2>...).
+_IMPLICIT_CLOSE = {
+    "li": ("li", "p"),
+    "p": ("p",),
+    "tr": ("td", "tr"),
+    "td": ("td", "p"),
+    "h2": ("p",),
+    "h3": ("p",),
+    "ul": ("p",),
+    "ol": ("p",),
+    "table": ("p",),
+}
+
+
+@dataclass
+class HtmlReport:
+    html: str
+    word_count: int = 0
+    tables: int = 0
+    lists: int = 0
+    h2: int = 0
+    h3: int = 0
+    h1_removed: int = 0
+    h1_demoted: int = 0
+    stripped_tags: dict = field(default_factory=dict)
+    heading_issues: list = field(default_factory=list)
+
+    def problems(self, min_words: int = 0) -> list[str]:
+        """Нарушения требований промпта, которые видны без модели."""
+        issues = []
+        if self.word_count < min_words:
+            issues.append(f"объём {self.word_count} слов (минимум {min_words})")
+        if self.tables < 1:
+            issues.append("нет таблицы")
+        if self.lists < 1:
+            issues.append("нет списка")
+        issues.extend(self.heading_issues)
+        return issues
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out: list[str] = []
+        self.report = HtmlReport(html="")
+
+        self._stack: list[str] = []  # открытые разрешённые теги
+        self._drop_depth = 0  # внутри <script>/<style>/ведущего <h1>
+        self._drop_tag = None
+        self._seen_content = False
+
+        self._word_open = False  # последний символ текста — часть слова
+        self._last_block = None  # последний закрытый блок: для правила H2 → H3
+
+    # ---- слова ----
+
+    def _boundary(self) -> None:
+        self._word_open = False
+
+    def _count(self, text: str) -> None:
+        words = len(text.split())
+        if words and self._word_open and not text[0].isspace():
+            words -= 1  # продолжение слова, разорванного снятым тегом
+        self.report.word_count += words
+        if text:
+            self._word_open = not text[-1].isspace()
+
+    # ---- теги ----
+
+    def _strip(self, tag: str) -> None:
+        stripped = self.report.stripped_tags
+        stripped[tag] = stripped.get(tag, 0) + 1
+
+    def handle_starttag(self, tag, attrs):
+        if self._drop_depth:
+            if tag == self._drop_tag:
+                self._drop_depth += 1
+            return
+
+        if tag in DROP_CONTENT_TAGS:
+            self._strip(tag)
+            self._drop_tag, self._drop_depth = tag, 1
+            return
+
+        if tag == "h1" and not self._seen_content:
+            # ведущий H1 дублирует заголовок записи — убираем целиком
+            self.report.h1_removed += 1
+            self._drop_tag, self._drop_depth = tag, 1
+            return
+
+        if tag in _VOID_TAGS:
+            self._strip(tag)
+            self._boundary()
+            if tag == "br":
+                self.out.append(" ")
+            return
+
+        if tag == "h1":
+            self.report.h1_demoted += 1
+        name = TAG_ALIASES.get(tag, tag)
+        if name not in ALLOWED_TAGS:
+            self._strip(tag)
+            return
+
+        self._boundary()
+        self._seen_content = True
+
+        closes = _IMPLICIT_CLOSE.get(name, ())
+        while self._stack and self._stack[-1] in closes:
+            self._last_block = self._stack.pop()
+            self.out.append(f"</{self._last_block}>")
+
+        if name == "h3":
+            if self.report.h2 == 0:
+                self.report.heading_issues.append("H3 до первого H2")
+            elif self._last_block == "h2":
+                self.report.heading_issues.append("H3 сразу после H2 без абзаца")
+        if name == "h2":
+            self.report.h2 += 1
+        elif name == "h3":
+            self.report.h3 += 1
+        elif name == "table":
+            self.report.tables += 1
+        elif name in ("ul", "ol"):
+            self.report.lists += 1
+
+        self._stack.append(name)
+        self.out.append(f"<{name}>")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self._drop_depth:
+            if tag == self._drop_tag:
+                self._drop_depth -= 1
+                if self._drop_depth == 0:
+                    self._drop_tag = None
+                    self._boundary()
+            return
+
+        name = TAG_ALIASES.get(tag, tag)
+        if name not in ALLOWED_TAGS or name not in self._stack:
+            return
+
+        # закрываем всё, что осталось открытым внутри
+        while self._stack:
+            open_tag = self._stack.pop()
+            self.out.append(f"</{open_tag}>")
+            if open_tag == name:
+                break
+        self._boundary()
+        self._last_block = name
+
+    def handle_data(self, data):
+        if self._drop_depth or not data:
+            return
+        if data.strip():
+            self._seen_content = True
+            if self._last_block == "h2" and not self._stack:
+                self._last_block = None
+        self._count(data)
+        self.out.append(escape(data, quote=False))
+
+    def close(self):
+        super().close()
+        while self._stack:
+            self.out.append(f"</{self._stack.pop()}>")
+        self.report.html = "".join(self.out).strip()
+        return self.report
+
+
+def sanitize_html(html) -> HtmlReport:
+    """Один проход по HTML: чистый HTML плюс структурная статистика."""
+    if not isinstance(html, str):
+        html = str(html)
+    parser = _Sanitizer()
+    parser.feed(html)
+    return parser.close()
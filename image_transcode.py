@@ -0,0 +1,200 @@
+"""
+Перекодирование обложки в набор размеров в пуле процессов.
+
+Pillow держит GIL почти всё время кодирования, поэтому обрезка и
+подбор качества WebP в потоке стадии image тормозят соседние стадии
+конвейера, которые ждут сеть. Здесь исходная картинка (PNG от модели)
+уходит в ProcessPoolExecutor: каждый вариант — отдельная задача,
+варианты одной картинки и картинки разных статей кодируются на всех
+ядрах одновременно, а поток стадии только ждёт результат.
+
+Вариант — размер, формат и лимит байт (Variant). Первый в наборе
+всегда featured — обложка записи 1280x720 WebP до 100 КБ; остальные
+(card для списков, social для соцсетей) сайт выбирает ключом
+image_variants в SITES_CONFIG. Новые варианты — register_variant().
+
+IMAGE_WORKERS (переменная окружения) — число процессов, по умолчанию
+по числу ядер; 0 — кодировать в текущем процессе, без пула.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+FEATURED = "featured"
+
+# ступени качества по возрастанию
+DEFAULT_QUALITIES = tuple(range(40, 81, 5))
+
+_MIME = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+_EXT = {"WEBP": "webp", "JPEG": "jpg", "PNG": "png"}
+
+
+@dataclass(frozen=True)
+class Variant:
+    name: str
+    width: int
+    height: int
+    format: str = "WEBP"
+    max_bytes: int = 100_000
+    qualities: tuple = DEFAULT_QUALITIES
+
+    @property
+    def mime(self) -> str:
+        return _MIME[self.format]
+
+    @property
+    def ext(self) -> str:
+        return _EXT[self.format]
+
+
+@dataclass
+class EncodedImage:
+    variant: str
+    data: bytes
+    quality: int
+    encodes: int  # сколько раз кодировали, подбирая качество
+    seconds: float  # обрезка и кодирование в процессе пула
+
+
+# =========================
+#   РЕЕСТР
+# =========================
+
+IMAGE_VARIANTS: dict[str, Variant] = {}
+
+
+def register_variant(variant: Variant) -> Variant:
+    """Добавляет (или заменяет) вариант в реестре."""
+    if variant.format not in _MIME:
+        raise ValueError(f"Формат {variant.format!r} варианта '{variant.name}' не поддерживается")
+    IMAGE_VARIANTS[variant.name] = variant
+    return variant
+
+
+def get_variant(name: str) -> Variant:
+    variant = IMAGE_VARIANTS.get(name)
+    if variant is None:
+        raise KeyError(f"Вариант картинки '{name}' не найден в IMAGE_VARIANTS")
+    return variant
+
+
+def site_variants(names) -> list[Variant]:
+    """featured и варианты сайта по именам (image_variants), без повторов."""
+    out = [get_variant(FEATURED)]
+    for name in names or ():
+        if name != FEATURED and all(v.name != name for v in out):
+            out.append(get_variant(name))
+    return out
+
+
+register_variant(Variant(FEATURED, 1280, 720, "WEBP", 100_000))
+# карточка в списках записей и виджетах
+register_variant(Variant("card", 640, 360, "WEBP", 35_000))
+# og:image: 1200x630 и JPEG — его понимают все соцсети и мессенджеры
+register_variant(Variant("social", 1200, 630, "JPEG", 150_000))
+
+
+# =========================
+#   КОДИРОВАНИЕ
+# =========================
+
+def encode_image(
+    image: "Image.Image",
+    format: str = "WEBP",
+    max_bytes: int = 100_000,
+    qualities: tuple = DEFAULT_QUALITIES,
+) -> tuple[bytes, int, int]:
+    """
+    Кодирует картинку с наибольшим качеством из qualities, которое
+    укладывается в max_bytes. Размер файла растёт вместе с качеством,
+    поэтому ищем бинарным поиском: для 9 ступеней это не больше 4 кодирований.
+    Если не влезает даже минимальное качество — отдаём его.
+    Возвращает (байты, качество, число кодирований).
+    """
+    encoded: dict[int, bytes] = {}
+
+    def encode(quality: int) -> bytes:
+        if quality not in encoded:
+            buf = io.BytesIO()
+            image.save(buf, format=format, quality=quality)
+            encoded[quality] = buf.getvalue()
+        return encoded[quality]
+
+    lo, hi = 0, len(qualities) - 1
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if len(encode(qualities[mid])) <= max_bytes:
+            best = mid
+            lo = mid + 1
+        else:
+            hi = mid - 1
+
+    quality = qualities[best if best is not None else 0]
+    return encode(quality), quality, len(encoded)
+
+
+def encode_variant(raw: bytes, variant: Variant) -> EncodedImage:
+    """Исходные байты -> один вариант (обрезка по центру под пропорции). Выполняется в пуле."""
+    from PIL import Image, ImageOps
+
+    started = time.perf_counter()
+    image = Image.open(io.BytesIO(raw)).convert("RGB")
+    image = ImageOps.fit(image, (variant.width, variant.height), method=Image.LANCZOS)
+    data, quality, encodes = encode_image(image, variant.format, variant.max_bytes, variant.qualities)
+    return EncodedImage(variant.name, data, quality, encodes, time.perf_counter() - started)
+
+
+# =========================
+#   ПУЛ ПРОЦЕССОВ
+# =========================
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def image_workers() -> int:
+    value = os.environ.get("IMAGE_WORKERS")
+    return int(value) if value not in (None, "") else (os.cpu_count() or 1)
+
+
+def get_transcode_pool() -> Optional[ProcessPoolExecutor]:
+    """Общий пул процессов; None, если IMAGE_WORKERS=0."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = image_workers()
+            if workers <= 0:
+                return None
+            # spawn: дочерний процесс не наследует потоки и блокировки конвейера
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def transcode(raw: bytes, variants: list[Variant]) -> dict[str, EncodedImage]:
+    """Все варианты одной картинки параллельно в пуле; {имя варианта: результат}."""
+    pool = get_transcode_pool()
+    if pool is None:
+        return {v.name: encode_variant(raw, v) for v in variants}
+    futures = {v.name: pool.submit(encode_variant, raw, v) for v in variants}
+    return {name: f.result() for name, f in futures.items()}
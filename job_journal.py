@@ -0,0 +1,284 @@
+"""
+Журнал задач публикации в SQLite (режим WAL).
+
+Для каждой пары (сайт, тема) хранится последняя пройденная стадия
+конвейера и всё, что на ней получено: JSON статьи, байты обложки,
+media_id и post_id. Перезапущенный прогон пропускает опубликованные темы
+и продолжает остальные с того места, где они остановились.
+
+Запись идёт через отдельный поток пачками (batch_size записей или
+flush_interval секунд на транзакцию), поэтому при высокой параллельности
+журнал не становится узким местом.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+
+DEFAULT_JOURNAL_PATH = "publisher_journal.sqlite3"
+
+# Стадии в порядке прохождения (совпадают с именами стадий конвейера).
+STAGES = ("article", "image", "upload", "post")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    site_key     TEXT NOT NULL,
+    topic        TEXT NOT NULL,
+    stage        TEXT,
+    article_json TEXT,
+    image_webp   BLOB,
+    media_id     INTEGER,
+    post_id      INTEGER,
+    error        TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    updated_at   REAL NOT NULL,
+    PRIMARY KEY (site_key, topic)
+)
+"""
+
+# Пустые поля новой записи не затирают уже сохранённые значения.
+_UPSERT = """
+INSERT INTO jobs (site_key, topic, stage, article_json, image_webp,
+                  media_id, post_id, error, attempts, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (site_key, topic) DO UPDATE SET
+    stage        = COALESCE(excluded.stage, jobs.stage),
+    article_json = COALESCE(excluded.article_json, jobs.article_json),
+    image_webp   = COALESCE(excluded.image_webp, jobs.image_webp),
+    media_id     = COALESCE(excluded.media_id, jobs.media_id),
+    post_id      = COALESCE(excluded.post_id, jobs.post_id),
+    error        = excluded.error,
+    attempts     = jobs.attempts + excluded.attempts,
+    updated_at   = excluded.updated_at
+"""
+
+_CLOSE = object()
+
+
+@dataclass
+class JournalRecord:
+    site_key: str
+    topic: str
+    stage: Optional[str]
+    article: Optional[dict]
+    image_webp: Optional[bytes]
+    media_id: Optional[int]
+    post_id: Optional[int]
+    error: Optional[str]
+    attempts: int
+    updated_at: float
+
+    @property
+    def finished(self) -> bool:
+        return self.stage == STAGES[-1]
+
+
+class JournalReader:
+    """
+    Журнал только для чтения: файл открывается в режиме ro, без схемы,
+    WAL и потока записи — команды вроде validate ничего в нём не меняют.
+    """
+
+    def __init__(self, path: str = DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self._read_conn = sqlite3.connect(
+            Path(os.path.abspath(path)).as_uri() + "?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            timeout=30,
+        )
+        self._read_lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._read_lock:
+            self._read_conn.close()
+
+    # ---- чтение ----
+
+    def _row_to_record(self, row) -> JournalRecord:
+        (site_key, topic, stage, article_json, image_webp,
+         media_id, post_id, error, attempts, updated_at) = row
+        return JournalRecord(
+            site_key=site_key,
+            topic=topic,
+            stage=stage,
+            article=json.loads(article_json) if article_json else None,
+            image_webp=image_webp,
+            media_id=media_id,
+            post_id=post_id,
+            error=error,
+            attempts=attempts,
+            updated_at=updated_at,
+        )
+
+    def get(self, site_key: str, topic: str) -> Optional[JournalRecord]:
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT site_key, topic, stage, article_json, image_webp, media_id, "
+                "post_id, error, attempts, updated_at FROM jobs "
+                "WHERE site_key = ? AND topic = ?",
+                (site_key, topic.strip()),
+            ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def errors(self, site_key: Optional[str] = None, limit: int = 50) -> list[JournalRecord]:
+        """Последние задачи с ошибкой (без байтов обложки)."""
+        query = (
+            "SELECT site_key, topic, stage, article_json, NULL, media_id, "
+            "post_id, error, attempts, updated_at FROM jobs WHERE error IS NOT NULL"
+        )
+        params: tuple = ()
+        if site_key is not None:
+            query += " AND site_key = ?"
+            params = (site_key,)
+        query += " ORDER BY updated_at DESC LIMIT ?"
+        with self._read_lock:
+            rows = self._read_conn.execute(query, params + (limit,)).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def stats(self) -> list[tuple[str, Optional[str], int, int]]:
+        """Сводка: (сайт, стадия, число задач, из них с ошибкой)."""
+        with self._read_lock:
+            return self._read_conn.execute(
+                "SELECT site_key, stage, COUNT(*), SUM(error IS NOT NULL) "
+                "FROM jobs GROUP BY site_key, stage ORDER BY site_key, stage"
+            ).fetchall()
+
+
+class JobJournal(JournalReader):
+    """Журнал с фоновой пакетной записью. Потокобезопасен."""
+
+    def __init__(
+        self,
+        path: str = DEFAULT_JOURNAL_PATH,
+        batch_size: int = 50,
+        flush_interval: float = 0.5,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._read_conn = self._connect()
+        self._read_conn.execute(_SCHEMA)
+        self._read_conn.commit()
+        self._read_lock = threading.Lock()
+
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # ---- запись ----
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        pending: list[tuple] = []
+        waiters: list[threading.Event] = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            closing = item is _CLOSE
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            elif isinstance(item, tuple):
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            due = deadline is not None and time.monotonic() >= deadline
+            if pending and (len(pending) >= self.batch_size or due or waiters or closing):
+                try:
+                    with conn:
+                        conn.executemany(_UPSERT, pending)
+                except sqlite3.Error as e:
+                    print(f"[JOURNAL][ERROR] Не удалось записать {len(pending)} записей: {e}")
+                pending = []
+                deadline = None
+
+            for ev in waiters:
+                ev.set()
+            waiters = []
+
+            if closing:
+                conn.close()
+                return
+
+    def _put(
+        self,
+        site_key: str,
+        topic: str,
+        stage: Optional[str] = None,
+        article: Optional[dict] = None,
+        image_webp: Optional[bytes] = None,
+        media_id: Optional[int] = None,
+        post_id: Optional[int] = None,
+        error: Optional[str] = None,
+        attempts: int = 0,
+    ) -> None:
+        self._queue.put((
+            site_key,
+            topic.strip(),
+            stage,
+            json.dumps(article, ensure_ascii=False) if article is not None else None,
+            image_webp,
+            media_id,
+            post_id,
+            error,
+            attempts,
+            time.time(),
+        ))
+
+    def record_stage(self, job, stage: str) -> None:
+        """Отмечает, что задача job прошла стадию stage, и сохраняет её результат."""
+        fields = {}
+        if stage == "article":
+            fields["article"] = job.article
+        elif stage == "image":
+            fields["image_webp"] = job.image_data
+        elif stage == "upload":
+            fields["media_id"] = job.media_id
+            # в статье теперь ID вариантов обложки (image_variants)
+            fields["article"] = job.article
+        elif stage == "post":
+            fields["post_id"] = job.post_id
+
+        self._put(job.site_key, job.topic, stage=stage, **fields)
+
+    def record_error(self, job) -> None:
+        """Сохраняет ошибку задачи; пройденные стадии остаются в силе."""
+        self._put(
+            job.site_key,
+            job.topic,
+            error=f"{job.failed_stage}: {job.error}",
+            attempts=1,
+        )
+
+    def flush(self) -> None:
+        """Дожидается записи всего, что поставлено в очередь."""
+        ev = threading.Event()
+        self._queue.put(ev)
+        ev.wait()
+
+    def close(self) -> None:
+        self._queue.put(_CLOSE)
+        self._writer.join()
+        with self._read_lock:
+            self._read_conn.close()
@@ -0,0 +1,340 @@
+"""
+Внутренние ссылки: локальный инвертированный индекс опубликованных статей.
+
+После каждого create_post статья сайта раскладывается на термины —
+основы слов (первые STEM_LENGTH букв, без служебных) из заголовка, H2 и
+текста с весами полей — и кладётся в индекс: термин -> {пост: вес}.
+В памяти держатся только TERMS_PER_DOC самых весомых терминов статьи,
+на диске (таблицы link_docs/link_terms в файле индекса записей) — они
+же, поэтому индекс обновляется по одной статье и никогда не
+перестраивается целиком, а загрузка при старте — один SELECT.
+
+Перед публикацией related() оценивает уже опубликованные статьи по
+общим терминам (вес в новой статье × вес в старой × idf) — это
+миллисекунды даже на десятках тысяч записей, без запросов
+/wp/v2/posts?search= к хосту. insert_links() ставит не больше
+internal_links ссылок: в абзац, где встречаются подряд два-три слова
+из заголовка похожей статьи, а если такого места нет — в блок
+«Читайте также» в конце. Санитайзер ссылки вырезает, поэтому они
+вставляются в тело запроса записи, уже после очистки HTML.
+"""
+
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from html import escape, unescape
+from typing import Callable, Iterable, Optional
+
+from post_index import DEFAULT_INDEX_PATH
+from topic_dedupe import STOP_WORDS
+
+
+STEM_LENGTH = 5
+TERMS_PER_DOC = 64
+# терминов новой статьи, по которым ищутся похожие
+QUERY_TERMS = 25
+# вес вхождения по полям статьи
+FIELD_WEIGHTS = {"title": 3.0, "h2": 2.0, "body": 1.0}
+# статьи с оценкой ниже этой доли от лучшей ссылками не ставим
+MIN_RELATIVE_SCORE = 0.3
+# термины, которые есть больше чем в этой доле статей, при поиске
+# пропускаем: похожести они не добавляют, а списки у них самые длинные
+MAX_DF_SHARE = 0.5
+# длина фразы-якоря в словах: сначала длинные
+ANCHOR_WORDS = (3, 2)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS link_docs (
+    site_key TEXT NOT NULL,
+    post_id  INTEGER NOT NULL,
+    title    TEXT,
+    link     TEXT,
+    status   TEXT,
+    PRIMARY KEY (site_key, post_id)
+);
+CREATE TABLE IF NOT EXISTS link_terms (
+    site_key TEXT NOT NULL,
+    term     TEXT NOT NULL,
+    post_id  INTEGER NOT NULL,
+    weight   REAL NOT NULL,
+    PRIMARY KEY (site_key, post_id, term)
+) WITHOUT ROWID;
+"""
+
+_WORD_RE = re.compile(r"&#?\w+;|\w+")
+_TAG_RE = re.compile(r"<[^>]+>")
+_H2_RE = re.compile(r"<h2>(.*?)</h2>", re.S)
+# абзацы и пункты списков без вложенных тегов — после санитайзера так и есть
+_BLOCK_RE = re.compile(r"<(p|li)>([^<]*)</\1>")
+
+
+@dataclass
+class LinkDoc:
+    post_id: int
+    title: str
+    link: str
+    status: str
+
+
+@dataclass
+class RelatedPost:
+    post_id: int
+    title: str
+    link: str
+    score: float
+
+
+def _stem(word: str) -> Optional[str]:
+    word = word.lower().replace("ё", "е")
+    if len(word) < 3 or word in STOP_WORDS or word.isdigit():
+        return None
+    return word[:STEM_LENGTH]
+
+
+def _stems(text: str) -> list[str]:
+    out = []
+    for m in _WORD_RE.finditer(unescape(text)):
+        stem = _stem(m.group())
+        if stem:
+            out.append(stem)
+    return out
+
+
+def article_terms(title: str, html: str, limit: int = TERMS_PER_DOC) -> dict[str, float]:
+    """Термины статьи с весами: (1 + log tf) по полям с весами полей, top-limit."""
+    counts: Counter = Counter()
+    for stem in _stems(title):
+        counts[stem] += FIELD_WEIGHTS["title"]
+    for h2 in _H2_RE.findall(html):
+        for stem in _stems(_TAG_RE.sub(" ", h2)):
+            counts[stem] += FIELD_WEIGHTS["h2"]
+    for stem in _stems(_TAG_RE.sub(" ", _H2_RE.sub(" ", html))):
+        counts[stem] += FIELD_WEIGHTS["body"]
+
+    top = counts.most_common(limit)
+    return {term: 1.0 + math.log(tf) for term, tf in top}
+
+
+class LinkIndex:
+    """Инвертированный индекс статей одного сайта: словари в памяти + SQLite на диске."""
+
+    def __init__(self, site_key: str, path: str = DEFAULT_INDEX_PATH):
+        self.site_key = site_key
+        self.path = path
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+        self._docs: dict[int, LinkDoc] = {}
+        self._terms: dict[int, dict[str, float]] = {}
+        self._postings: dict[str, dict[int, float]] = {}
+
+        for row in self._conn.execute(
+            "SELECT post_id, title, link, status FROM link_docs WHERE site_key = ?", (site_key,)
+        ):
+            self._docs[row[0]] = LinkDoc(*row)
+        for term, post_id, weight in self._conn.execute(
+            "SELECT term, post_id, weight FROM link_terms WHERE site_key = ?", (site_key,)
+        ):
+            self._terms.setdefault(post_id, {})[term] = weight
+            self._postings.setdefault(term, {})[post_id] = weight
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _unpost(self, post_id: int) -> None:
+        for term in self._terms.pop(post_id, {}):
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(post_id, None)
+                if not posting:
+                    del self._postings[term]
+
+    # ---- запись ----
+
+    def add(self, post_id: int, title: str, html: str, link: Optional[str], status: str) -> None:
+        """Добавляет статью или заменяет её термины (вызывается после create_post)."""
+        if not link:
+            return
+        terms = article_terms(title, html)
+        with self._lock:
+            self._unpost(post_id)
+            self._docs[post_id] = LinkDoc(post_id, title, link, status)
+            self._terms[post_id] = terms
+            for term, weight in terms.items():
+                self._postings.setdefault(term, {})[post_id] = weight
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO link_docs (site_key, post_id, title, link, status) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (self.site_key, post_id, title, link, status),
+                )
+                self._conn.execute(
+                    "DELETE FROM link_terms WHERE site_key = ? AND post_id = ?",
+                    (self.site_key, post_id),
+                )
+                self._conn.executemany(
+                    "INSERT INTO link_terms (site_key, term, post_id, weight) VALUES (?, ?, ?, ?)",
+                    [(self.site_key, term, post_id, weight) for term, weight in terms.items()],
+                )
+
+    def forget(self, post_id: int) -> None:
+        """Убирает статью, которой в WP больше нет."""
+        with self._lock:
+            self._unpost(post_id)
+            self._docs.pop(post_id, None)
+            with self._conn:
+                self._conn.execute(
+                    "DELETE FROM link_docs WHERE site_key = ? AND post_id = ?", (self.site_key, post_id)
+                )
+                self._conn.execute(
+                    "DELETE FROM link_terms WHERE site_key = ? AND post_id = ?", (self.site_key, post_id)
+                )
+
+    # ---- поиск ----
+
+    def related(
+        self,
+        title: str,
+        html: str,
+        limit: int = 5,
+        exclude: Iterable[int] = (),
+        statuses: Optional[Iterable[str]] = None,
+        alive: Optional[Callable[[int], bool]] = None,
+    ) -> list[RelatedPost]:
+        """
+        Самые похожие статьи сайта (статусы из statuses, None — любые), лучшие
+        первыми. alive(post_id) — есть ли запись в WP (по индексу записей):
+        удалённые из WP статьи пропускаются.
+        """
+        query = article_terms(title, html)
+        skip = set(exclude)
+        allowed = set(statuses) if statuses is not None else None
+        scores: Counter = Counter()
+
+        with self._lock:
+            total = len(self._docs)
+            picked = []
+            for term, weight in query.items():
+                posting = self._postings.get(term)
+                if not posting or (total >= 20 and len(posting) > total * MAX_DF_SHARE):
+                    continue
+                picked.append((weight * math.log(1 + total / len(posting)), posting))
+            # как в «more like this»: только самые весомые термины запроса
+            picked.sort(key=lambda p: p[0], reverse=True)
+            for query_weight, posting in picked[:QUERY_TERMS]:
+                for post_id, doc_weight in posting.items():
+                    scores[post_id] += query_weight * doc_weight
+
+            out = []
+            best = None
+            for post_id, score in scores.most_common():
+                if best is not None and score < best * MIN_RELATIVE_SCORE:
+                    break
+                doc = self._docs.get(post_id)
+                if post_id in skip or doc is None or (allowed is not None and doc.status not in allowed):
+                    continue
+                if alive is not None and not alive(post_id):
+                    continue
+                best = best or score
+                out.append(RelatedPost(post_id, doc.title, doc.link, score))
+                if len(out) >= limit:
+                    break
+        return out
+
+
+# =========================
+#   ВСТАВКА ССЫЛОК
+# =========================
+
+def _anchor_grams(title: str) -> dict[int, set[tuple[str, ...]]]:
+    """N-граммы основ заголовка (подряд идущие значимые слова) по длине."""
+    stems = _stems(title)
+    return {n: {tuple(stems[i:i + n]) for i in range(len(stems) - n + 1)} for n in ANCHOR_WORDS}
+
+
+def _find_anchor(text: str, grams: dict[int, set[tuple[str, ...]]]) -> Optional[tuple[int, int]]:
+    """Позиции фразы в тексте абзаца, слова которой — n-грамма заголовка."""
+    words = []
+    for m in _WORD_RE.finditer(text):
+        if m.group().startswith("&"):
+            continue
+        stem = _stem(m.group())
+        # служебные слова внутри фразы не рвут её, но и не входят в n-грамму
+        words.append((stem, m.start(), m.end()))
+
+    for n in ANCHOR_WORDS:
+        wanted = grams.get(n)
+        if not wanted:
+            continue
+        for i, (stem, start, _) in enumerate(words):
+            if stem is None:
+                continue
+            picked = []
+            j = i
+            while j < len(words) and len(picked) < n and j - i < n * 2:
+                if words[j][0] is not None:
+                    picked.append(words[j])
+                j += 1
+            if len(picked) == n and tuple(w[0] for w in picked) in wanted:
+                return start, picked[-1][2]
+    return None
+
+
+def insert_links(html: str, related: list[RelatedPost], max_links: int) -> tuple[str, int, int]:
+    """
+    Ставит до max_links ссылок на related: в текст абзаца (по одной на
+    абзац), а оставшиеся — списком «Читайте также» в конце статьи.
+    Возвращает (html, ссылок в тексте, ссылок в списке).
+    """
+    related = related[:max_links]
+    if not related:
+        return html, 0, 0
+
+    blocks = list(_BLOCK_RE.finditer(html))
+    used: set[int] = set()
+    replacements: dict[int, tuple[int, int, str]] = {}
+    rest = []
+
+    for post in related:
+        grams = _anchor_grams(post.title)
+        for n, m in enumerate(blocks):
+            if n in used:
+                continue
+            found = _find_anchor(m.group(2), grams)
+            if found is not None:
+                start, end = found
+                offset = m.start(2)
+                replacements[n] = (offset + start, offset + end, post.link)
+                used.add(n)
+                break
+        else:
+            rest.append(post)
+
+    out = html
+    for start, end, link in sorted(replacements.values(), reverse=True):
+        out = f'{out[:start]}<a href="{escape(link)}">{out[start:end]}</a>{out[end:]}'
+
+    if rest:
+        items = "".join(f'<li><a href="{escape(p.link)}">{escape(p.title)}</a></li>' for p in rest)
+        out += f"<p>Читайте также:</p><ul>{items}</ul>"
+
+    return out, len(replacements), len(rest)
+
+
+_indexes: dict[str, LinkIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_link_index(site_key: str) -> LinkIndex:
+    with _indexes_lock:
+        index = _indexes.get(site_key)
+        if index is None:
+            index = LinkIndex(site_key)
+            _indexes[site_key] = index
+        return index
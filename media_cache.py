@@ -0,0 +1,155 @@
+"""
+Кэш медиафайлов сайта: одна и та же обложка не загружается в WP дважды.
+
+Для каждого сайта в SQLite хранится sha256 загруженного WebP, его
+media_id в медиатеке и промпт, по которому картинка сгенерирована.
+Перед загрузкой байты хэшируются: если такой файл уже есть на сайте,
+берётся его media_id без POST wp/v2/media.
+
+По промптам строится индекс похожести (тот же, что у дублей тем —
+topic_dedupe.py). Если на сайте включён image_reuse_threshold, новая
+статья с почти таким же image_prompt («стадион вечером», «купон ставки»)
+получает уже сгенерированную картинку вместо вызова gpt-image-1, а при
+загрузке — тот же media_id.
+
+Если медиатеку сайта чистили вручную, удали media_cache.sqlite3 (или
+записи этого сайта в нём) — иначе в посты попадут ID удалённых файлов.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from config_multisite import SITES_CONFIG
+from topic_dedupe import TopicDeduper, threshold_error
+
+
+DEFAULT_MEDIA_PATH = "media_cache.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    site_key   TEXT NOT NULL,
+    sha256     TEXT NOT NULL,
+    media_id   INTEGER NOT NULL,
+    prompt     TEXT,
+    image_key  TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (site_key, sha256)
+);
+"""
+
+
+@dataclass
+class MediaEntry:
+    sha256: str
+    media_id: int
+    prompt: Optional[str] = None
+    # ключ WebP в кэше контента (content_cache.py), чтобы отдать байты по промпту
+    image_key: Optional[str] = None
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class MediaCache:
+    """
+    Медиафайлы одного сайта: словарь по хэшу + SQLite на диске.
+    threshold — порог похожести промптов для similar() (None — выключено).
+    """
+
+    def __init__(
+        self,
+        site_key: str,
+        path: str = DEFAULT_MEDIA_PATH,
+        threshold: Optional[float] = None,
+    ):
+        self.site_key = site_key
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+        self._by_hash: dict[str, MediaEntry] = {}
+        # номер текста в индексе промптов -> запись
+        self._prompts = TopicDeduper(threshold) if threshold else None
+        self._by_prompt: list[MediaEntry] = []
+
+        rows = self._conn.execute(
+            "SELECT sha256, media_id, prompt, image_key FROM media "
+            "WHERE site_key = ? ORDER BY created_at",
+            (site_key,),
+        ).fetchall()
+        for row in rows:
+            self._put(MediaEntry(*row))
+
+    def _put(self, entry: MediaEntry) -> None:
+        self._by_hash[entry.sha256] = entry
+        if self._prompts is not None and entry.prompt and entry.image_key:
+            self._prompts.add(entry.prompt)
+            self._by_prompt.append(entry)
+
+    def __len__(self) -> int:
+        return len(self._by_hash)
+
+    def get(self, data: bytes) -> Optional[MediaEntry]:
+        """Запись, если ровно эти байты уже загружены на сайт."""
+        with self._lock:
+            return self._by_hash.get(content_hash(data))
+
+    def similar(self, prompt: str) -> Optional[tuple[MediaEntry, float]]:
+        """Картинка с самым похожим промптом и сходство; None — нет или выключено."""
+        if self._prompts is None:
+            return None
+        with self._lock:
+            idx, sim = self._prompts.nearest(prompt)
+            if idx is None:
+                return None
+            return self._by_prompt[idx], sim
+
+    def record(
+        self,
+        data: bytes,
+        media_id: int,
+        prompt: Optional[str] = None,
+        image_key: Optional[str] = None,
+    ) -> MediaEntry:
+        """Запоминает загруженный файл (вызывается после upload_media)."""
+        entry = MediaEntry(content_hash(data), media_id, prompt, image_key)
+        with self._lock:
+            self._put(entry)
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO media "
+                    "(site_key, sha256, media_id, prompt, image_key, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.site_key, entry.sha256, media_id, prompt, image_key, time.time()),
+                )
+        return entry
+
+
+_caches: dict[str, MediaCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_media_cache(site_key: str) -> MediaCache:
+    """Кэш медиа сайта; порог похожести промптов — image_reuse_threshold сайта."""
+    with _caches_lock:
+        cache = _caches.get(site_key)
+        if cache is None:
+            cfg = SITES_CONFIG.get(site_key, {})
+            threshold = cfg.get("image_reuse_threshold")
+            error = threshold_error(threshold) if threshold else None
+            if error:
+                # плохой порог не должен ронять публикацию: обложки просто не переиспользуем
+                print(f"[WARN] [{site_key}] image_reuse_threshold: {error}; обложки не переиспользуются")
+                threshold = None
+            cache = MediaCache(site_key, threshold=threshold)
+            _caches[site_key] = cache
+        return cache
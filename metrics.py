@@ -0,0 +1,424 @@
+"""
+Метрики и трассировка прогона.
+
+Один реестр на процесс (get_metrics): счётчики и гистограммы с метками
+плюс поток событий в JSON Lines. Метки сайта и темы берутся из контекста
+(metrics.labels(...) в воркере конвейера), поэтому вызовам внутри
+generate_article / generate_image не нужно их передавать.
+
+- Гистограммы и счётчики в Prometheus помечаются сайтом, стадией, моделью,
+  но не темой — иначе число рядов растёт с каждой темой. Тема есть
+  в каждом событии JSONL.
+- write_prometheus() пишет текстовый файл для textfile-коллектора
+  node_exporter (атомарно, через временный файл).
+- summary_lines() — итог прогона: p50/p95 по стадиям, токены, стоимость,
+  повторы и причины ошибок, статей в час. Квантили считаются по выборке
+  (не больше RESERVOIR_SIZE значений на ряд), поэтому долгий worker --wait
+  не копит в памяти каждое наблюдение; n, сумма и максимум — точные.
+"""
+
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+METRIC_PREFIX = "publisher_"
+
+# Цены OpenAI, USD за 1M токенов: (вход, кэшированный вход, выход).
+# Для gpt-image-1 выход — токены изображения. Сверять с актуальным прайсом.
+MODEL_PRICES = {
+    "gpt-5.1": (1.25, 0.125, 10.0),
+    "gpt-image-1": (5.0, 1.25, 40.0),
+}
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# Гистограммы не про время — свои границы корзин
+HISTOGRAM_BUCKETS = {
+    "webp_encodes": (1, 2, 3, 4, 5, 6, 8),
+    "image_bytes": (25_000, 50_000, 75_000, 100_000, 150_000, 250_000),
+    "article_words": (500, 800, 1000, 1200, 1500, 2000, 3000),
+    "wp_batch_size": (1, 2, 5, 10, 25, 50),
+}
+
+# Сколько наблюдений ряда гистограммы хранить для p50/p95 (равномерная выборка)
+RESERVOIR_SIZE = 1024
+
+_context: contextvars.ContextVar = contextvars.ContextVar("metrics_labels", default={})
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values) + 0.5) - 1))
+    return sorted_values[idx]
+
+
+class _Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+        # выборка для p50/p95 в итоговой сводке (reservoir sampling)
+        self.values: list[float] = []
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.max = value if self.count == 0 else max(self.max, value)
+        self.count += 1
+        if len(self.values) < RESERVOIR_SIZE:
+            self.values.append(value)
+        else:
+            j = random.randrange(self.count)
+            if j < RESERVOIR_SIZE:
+                self.values[j] = value
+
+
+class Metrics:
+    """Потокобезопасный реестр метрик процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._histograms: dict[tuple[str, tuple], _Histogram] = {}
+        self._sink = None
+        self.started = time.time()
+
+    # ---- контекст ----
+
+    @contextmanager
+    def labels(self, **labels):
+        """Метки (site, topic, ...) для всех метрик и событий внутри блока."""
+        token = _context.set({**_context.get(), **labels})
+        try:
+            yield
+        finally:
+            _context.reset(token)
+
+    def _series_labels(self, labels: dict) -> dict:
+        # в ряды Prometheus из контекста попадает только сайт
+        site = _context.get().get("site")
+        return {"site": site, **labels} if site is not None else labels
+
+    # ---- запись ----
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _label_key(self._series_labels(labels)))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, _label_key(self._series_labels(labels)))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = _Histogram(HISTOGRAM_BUCKETS.get(name, LATENCY_BUCKETS))
+                self._histograms[key] = hist
+            hist.observe(value)
+
+    def event(self, kind: str, **fields) -> None:
+        """Строка в JSONL: время, метки контекста (сайт, тема) и поля события."""
+        if self._sink is None:
+            return
+        record = {"ts": round(time.time(), 3), "event": kind, **_context.get(), **fields}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._sink is not None:
+                self._sink.write(line + "\n")
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Длительность блока в гистограмму name и событие с исходом."""
+        kind = name.removesuffix("_seconds")
+        source = labels.get("stage") or labels.get("op") or kind
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            seconds = time.monotonic() - started
+            self.observe(name, seconds, **labels)
+            self.inc("failures_total", source=source, reason=type(e).__name__)
+            self.event(kind, seconds=round(seconds, 3), status="error",
+                       error=f"{type(e).__name__}: {e}"[:500], **labels)
+            raise
+        seconds = time.monotonic() - started
+        self.observe(name, seconds, **labels)
+        self.event(kind, seconds=round(seconds, 3), status="ok", **labels)
+
+    def record_usage(
+        self,
+        model: str,
+        prompt_tokens: Optional[int],
+        completion_tokens: Optional[int],
+        cached_tokens: Optional[int] = None,
+        price_factor: float = 1.0,
+        **fields,
+    ) -> float:
+        """
+        Токены одного вызова модели и их стоимость в USD.
+        price_factor — скидка к прайсу (0.5 для Batch API).
+        """
+        prompt_tokens = prompt_tokens or 0
+        completion_tokens = completion_tokens or 0
+        cached_tokens = cached_tokens or 0
+
+        price_in, price_cached, price_out = MODEL_PRICES.get(model, (0.0, 0.0, 0.0))
+        cost = (
+            (prompt_tokens - cached_tokens) * price_in
+            + cached_tokens * price_cached
+            + completion_tokens * price_out
+        ) / 1_000_000 * price_factor
+
+        self.inc("tokens_total", prompt_tokens - cached_tokens, model=model, type="prompt")
+        self.inc("tokens_total", cached_tokens, model=model, type="cached")
+        self.inc("tokens_total", completion_tokens, model=model, type="completion")
+        self.inc("cost_usd_total", cost, model=model)
+        self.event(
+            "usage",
+            model=model,
+            prompt_tokens=prompt_tokens,
+            cached_tokens=cached_tokens,
+            completion_tokens=completion_tokens,
+            cost_usd=round(cost, 6),
+            **fields,
+        )
+        return cost
+
+    # ---- вывод ----
+
+    def open_jsonl(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            if self._sink is not None:
+                self._sink.close()
+            self._sink = open(path, "a", encoding="utf-8", buffering=1)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._sink is not None:
+                self._sink.close()
+                self._sink = None
+
+    def _snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (h.buckets, list(h.counts), h.total, h.count)
+                for key, h in self._histograms.items()
+            }
+        return counters, histograms
+
+    def write_prometheus(self, path: str) -> None:
+        """Текстовый формат Prometheus (для textfile-коллектора node_exporter)."""
+
+        def fmt(labels: tuple, extra: tuple = ()) -> str:
+            items = labels + extra
+            if not items:
+                return ""
+            body = ",".join(
+                f'{k}="{v.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"'
+                for k, v in items
+            )
+            return "{" + body + "}"
+
+        counters, histograms = self._snapshot()
+        lines = []
+
+        for name in sorted({n for n, _ in counters}):
+            metric = METRIC_PREFIX + name
+            lines.append(f"# TYPE {metric} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{metric}{fmt(labels)} {value:g}")
+
+        for name in sorted({n for n, _ in histograms}):
+            metric = METRIC_PREFIX + name
+            lines.append(f"# TYPE {metric} histogram")
+            for (n, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                for bound, c in zip(buckets, counts):
+                    lines.append(f"{metric}_bucket{fmt(labels, (('le', f'{bound:g}'),))} {c}")
+                lines.append(f"{metric}_bucket{fmt(labels, (('le', '+Inf'),))} {count}")
+                lines.append(f"{metric}_sum{fmt(labels)} {total:g}")
+                lines.append(f"{metric}_count{fmt(labels)} {count}")
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+
+    def counter(self, name: str, **match) -> float:
+        """Сумма счётчика name по всем рядам с метками match."""
+        with self._lock:
+            return sum(
+                v for (n, labels), v in self._counters.items()
+                if n == name and all((k, str(val)) in labels for k, val in match.items())
+            )
+
+    def values(self, name: str, by: str) -> dict[str, list[float]]:
+        """
+        Отсортированная выборка значений гистограммы name (все сайты вместе)
+        по метке by — до RESERVOIR_SIZE на ряд.
+        """
+        groups: dict[str, list[float]] = {}
+        with self._lock:
+            for (n, labels), hist in self._histograms.items():
+                if n == name:
+                    groups.setdefault(dict(labels).get(by, "—"), []).extend(hist.values)
+        return {k: sorted(v) for k, v in groups.items()}
+
+    def stats(self, name: str, by: str) -> dict[str, dict]:
+        """n, p50, p95, max и сумма гистограммы name по метке by (квантили — по выборке)."""
+        out: dict[str, dict] = {}
+        with self._lock:
+            for (n, labels), hist in self._histograms.items():
+                if n != name:
+                    continue
+                st = out.setdefault(
+                    dict(labels).get(by, "—"), {"n": 0, "max": hist.max, "total": 0.0, "values": []}
+                )
+                st["n"] += hist.count
+                st["max"] = max(st["max"], hist.max)
+                st["total"] += hist.total
+                st["values"].extend(hist.values)
+        for key, st in out.items():
+            values = sorted(st["values"])
+            out[key] = {
+                "n": st["n"],
+                "p50": _percentile(values, 0.5),
+                "p95": _percentile(values, 0.95),
+                "max": st["max"],
+                "total": st["total"],
+            }
+        return out
+
+    def reset(self) -> None:
+        """Обнуляет счётчики и гистограммы (файл событий не трогает)."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started = time.time()
+
+    def summary_lines(self, elapsed: Optional[float] = None) -> list[str]:
+        """Итог прогона для консоли."""
+        counters, _ = self._snapshot()
+        elapsed = elapsed if elapsed is not None else time.time() - self.started
+        total = self.counter
+
+        lines = []
+        for name, by, title in (
+            ("stage_seconds", "stage", "Стадии конвейера"),
+            ("queue_wait_seconds", "stage", "Ожидание в очереди перед стадией"),
+            ("openai_seconds", "op", "Вызовы OpenAI"),
+            ("openai_ttft_seconds", "op", "Первый токен потока"),
+            ("image_process_seconds", "op", "Обработка картинки"),
+            ("wp_seconds", "op", "Запросы к WordPress"),
+        ):
+            groups = self.stats(name, by)
+            if not groups:
+                continue
+            width = max(12, *map(len, groups))
+            lines.append(f"{title}:")
+            lines.append(
+                f"    {'':<{width}} {'n':>6} {'p50, с':>8} {'p95, с':>8} {'max, с':>8} {'всего, с':>10}"
+            )
+            for key, st in sorted(groups.items()):
+                lines.append(
+                    f"    {key:<{width}} {st['n']:>6} {st['p50']:>8.2f} "
+                    f"{st['p95']:>8.2f} {st['max']:>8.2f} {st['total']:>10.1f}"
+                )
+
+        encodes = self.stats("webp_encodes", "site").values()
+        if encodes:
+            count = sum(st["n"] for st in encodes)
+            lines.append(
+                f"Кодирований WebP на картинку: в среднем {sum(st['total'] for st in encodes) / count:.1f}, "
+                f"максимум {max(st['max'] for st in encodes):g}"
+            )
+
+        for model in sorted({dict(l).get("model") for n, l in counters if n == "tokens_total"}):
+            uncached = total("tokens_total", model=model, type="prompt")
+            cached = total("tokens_total", model=model, type="cached")
+            share = cached / (cached + uncached) * 100 if cached + uncached else 0.0
+            lines.append(
+                f"Токены {model}: вход {uncached:,.0f} + из кэша {cached:,.0f} ({share:.0f}%), "
+                f"выход {total('tokens_total', model=model, type='completion'):,.0f}, "
+                f"стоимость ${total('cost_usd_total', model=model):.2f}"
+            )
+
+        for name, title in (
+            ("article_attempts_total", "Попытки генерации статьи"),
+            ("article_repairs_total", "Досборка статей"),
+            ("queue_jobs_total", "Задачи из очереди"),
+            ("internal_links_total", "Внутренние ссылки"),
+        ):
+            results = {dict(l).get("result"): v for (n, l), v in counters.items() if n == name}
+            if results:
+                parts = ", ".join(f"{k}: {v:g}" for k, v in sorted(results.items()))
+                lines.append(f"{title}: {parts}")
+
+        cache = {}
+        for (n, labels), v in counters.items():
+            if n == "cache_requests_total":
+                d = dict(labels)
+                hit_miss = cache.setdefault(d.get("kind", "—"), [0, 0])
+                hit_miss[d.get("result") != "hit"] += v
+        for kind, (hits, misses) in sorted(cache.items()):
+            lines.append(f"Кэш ({kind}): попаданий {hits:g}, промахов {misses:g}")
+
+        for name, title in (("retries_total", "Повторы"), ("failures_total", "Ошибки")):
+            reasons: dict[str, float] = {}
+            for (n, labels), v in counters.items():
+                if n == name:
+                    d = dict(labels)
+                    key = f"{d.get('source', '—')}/{d.get('reason', '—')}"
+                    reasons[key] = reasons.get(key, 0) + v
+            if reasons:
+                parts = ", ".join(f"{k}: {v:g}" for k, v in sorted(reasons.items()))
+                lines.append(f"{title}: {parts}")
+
+        uploaded = total("uploaded_bytes_total")
+        if uploaded:
+            lines.append(f"Загружено в WP: {uploaded / 1_000_000:.1f} МБ")
+
+        published = total("jobs_total", status="ok")
+        failed = total("jobs_total", status="failed")
+        rate = published / elapsed * 3600 if elapsed > 0 else 0.0
+        lines.append(
+            f"Статей: {published:g} (ошибок {failed:g}) за {elapsed:.0f} с — {rate:.1f} статей/час"
+        )
+        return lines
+
+    def print_summary(self, elapsed: Optional[float] = None) -> None:
+        print("\n[METRICS] Итог прогона")
+        for line in self.summary_lines(elapsed):
+            print(f"[METRICS] {line}")
+
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """Общий реестр метрик процесса."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
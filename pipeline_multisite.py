@@ -0,0 +1,1041 @@
+"""
+Конвейерный запуск публикации.
+
+Вместо последовательного цикла «текст → картинка → загрузка → пост» по одной
+теме каждая стадия работает в собственном пуле потоков с ограниченной
+параллельностью и очередью между стадиями. Пока статья N загружает обложку,
+статья N+1 уже генерируется, и пропускная способность упирается в самую
+медленную стадию, а не в сумму всех.
+
+Несколько сайтов гоняются через один конвейер: стадии OpenAI общие
+(с глобальным лимитом), а стадии WordPress разведены по сайтам — у каждого
+сайта свои потоки, поэтому зависший хост не тормозит остальные.
+
+С журналом (job_journal.py) каждая пройденная стадия записывается,
+и перезапуск продолжает задачи с последней завершённой стадии.
+
+Стадия поста пакетная: воркер забирает из очереди сайта готовые статьи
+(до post_batch_size, добирая те, что придут за post_batch_wait секунд)
+и создаёт их одним запросом batch/v1. Пакет сайта собирает один воркер
+за раз, пока остальные отправляют уже собранные.
+
+Темы берутся либо из списков (SiteScheduler, run_sites), либо из общей
+очереди задач (QueueScheduler, run_queue), которую параллельно разбирают
+несколько воркеров на одной или разных машинах (work_queue.py).
+"""
+
+import contextlib
+import itertools
+import os
+import queue
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, Optional
+
+import publisher_multisite as publisher
+import wp_client
+from job_journal import JobJournal
+from metrics import get_metrics
+from post_index import get_post_index
+from topic_dedupe import DEFAULT_THRESHOLD, format_duplicate, iter_unique_topics
+from work_queue import DEFAULT_LEASE_TTL, Lease, WorkQueue, default_worker_id
+
+
+# =========================
+#   ЗАДАЧА И СТАДИИ
+# =========================
+
+@dataclass
+class PublishJob:
+    """Одна тема для одного сайта и всё, что по ней уже получено."""
+
+    site_key: str
+    topic: str
+    index: int = 0
+    publish: Optional[bool] = None
+    category_id: Optional[int] = None
+
+    article: Optional[dict] = None
+    image_data: Optional[bytes] = None
+    media_id: Optional[int] = None
+    post_id: Optional[int] = None
+
+    # имя последней успешно пройденной стадии (в т.ч. восстановленное из журнала)
+    completed: Optional[str] = None
+
+    error: Optional[BaseException] = None
+    failed_stage: Optional[str] = None
+
+    # когда задача встала в очередь очередной стадии (time.monotonic)
+    queued_at: float = 0.0
+
+
+@dataclass
+class Stage:
+    """
+    Стадия конвейера: функция над задачей и число параллельных воркеров.
+    per_site=True — у каждого сайта своя очередь и свои workers потоков
+    (значение можно переопределить ключом wp_concurrency в SITES_CONFIG).
+
+    batch — пакетный вариант func для per_site-стадии: получает до
+    batch_size задач одного сайта, что уже ждут в очереди (плюс те, что
+    придут за batch_wait секунд), и возвращает ошибку по каждой (None —
+    успех). Ключи <name>_batch_size / <name>_batch_wait в SITES_CONFIG
+    переопределяют значения на сайт; batch_size 1 — по одной через func.
+    """
+
+    name: str
+    func: Callable[[PublishJob], None]
+    workers: int = 1
+    per_site: bool = False
+    batch: Optional[Callable[[list[PublishJob]], list[Optional[BaseException]]]] = None
+    batch_size: int = 1
+    batch_wait: float = 0.0
+
+
+# Параллельность стадий по умолчанию. Текст — самая долгая стадия,
+# поэтому на неё больше всего воркеров. Для upload/post это число
+# потоков на каждый сайт.
+DEFAULT_CONCURRENCY = {
+    "article": 4,
+    "image": 2,
+    "upload": 2,
+    "post": 2,
+}
+
+# Сколько готовых статей сайта создавать одним запросом batch/v1
+# (ключ post_batch_size в SITES_CONFIG; лимит сервера обычно 25)
+# и сколько секунд ждать, добирая пакет (post_batch_wait): статьи
+# выходят из загрузки обложек по одной, и без ожидания пакет почти
+# никогда не больше одной записи
+DEFAULT_POST_BATCH_SIZE = 25
+DEFAULT_POST_BATCH_WAIT = 2.0
+
+# Сколько задач одного сайта может одновременно находиться в конвейере
+# (ключ max_in_flight в SITES_CONFIG переопределяет).
+DEFAULT_SITE_IN_FLIGHT = 6
+
+# Сколько задач воркер общей очереди держит в аренде одновременно:
+# арендованная, но ещё не начатая задача недоступна другим воркерам,
+# поэтому запас — чуть больше, чем конвейер обрабатывает разом
+DEFAULT_QUEUE_IN_FLIGHT = 8
+# Пауза между запросами к очереди, в которой нечего взять
+QUEUE_POLL_INTERVAL = 5.0
+
+# Файл назначения тем сайтам: строки вида "site_key<TAB>тема".
+SITE_TOPICS_FILE = "site_topics.txt"
+
+# Сколько пропущенных дублей печатать поимённо (дальше — только итог)
+DEDUPE_REPORT_LIMIT = 20
+
+_STOP = object()
+
+
+# =========================
+#   ФУНКЦИИ СТАДИЙ
+# =========================
+
+def _stage_article(job: PublishJob) -> None:
+    job.article = publisher.prepare_article(job.site_key, job.topic)
+
+
+def _stage_image(job: PublishJob) -> None:
+    job.image_data = publisher.prepare_image(job.site_key, job.article)
+
+
+def _stage_upload(job: PublishJob) -> None:
+    job.media_id = publisher.publish_image(
+        job.site_key,
+        job.image_data,
+        publisher.image_filename(job.article),
+        job.article.get("image_prompt"),
+    )
+    if job.media_id:
+        job.article["image_variants"] = publisher.publish_image_variants(
+            job.site_key, job.article, job.image_data
+        )
+
+
+def _stage_post(job: PublishJob) -> None:
+    job.post_id = publisher.publish_article(
+        job.site_key,
+        job.article,
+        media_id=job.media_id,
+        publish=job.publish,
+        category_id=job.category_id,
+    )
+
+
+def _stage_post_batch(jobs: list[PublishJob]) -> list[Optional[BaseException]]:
+    results = publisher.publish_articles(jobs[0].site_key, [
+        {
+            "article": job.article,
+            "media_id": job.media_id,
+            "publish": job.publish,
+            "category_id": job.category_id,
+        }
+        for job in jobs
+    ])
+    for job, (post_id, _) in zip(jobs, results):
+        job.post_id = post_id
+    return [error for _, error in results]
+
+
+def _limited(func: Callable[[PublishJob], None], slots: threading.Semaphore):
+    def wrapper(job: PublishJob) -> None:
+        with slots:
+            func(job)
+    return wrapper
+
+
+def build_publish_stages(
+    concurrency: Optional[dict] = None,
+    openai_concurrency: Optional[int] = None,
+) -> list[Stage]:
+    """
+    Стандартный набор стадий; concurrency переопределяет DEFAULT_CONCURRENCY.
+    openai_concurrency — общий потолок одновременных вызовов OpenAI
+    на стадиях текста и картинок вместе, чтобы не выбивать квоту.
+    """
+    conc = dict(DEFAULT_CONCURRENCY)
+    if concurrency:
+        conc.update(concurrency)
+
+    article_func = _stage_article
+    image_func = _stage_image
+    if openai_concurrency:
+        slots = threading.BoundedSemaphore(openai_concurrency)
+        article_func = _limited(article_func, slots)
+        image_func = _limited(image_func, slots)
+
+    return [
+        Stage("article", article_func, conc["article"]),
+        Stage("image", image_func, conc["image"]),
+        Stage("upload", _stage_upload, conc["upload"], per_site=True),
+        Stage(
+            "post",
+            _stage_post,
+            conc["post"],
+            per_site=True,
+            batch=_stage_post_batch,
+            batch_size=DEFAULT_POST_BATCH_SIZE,
+            batch_wait=DEFAULT_POST_BATCH_WAIT,
+        ),
+    ]
+
+
+# =========================
+#   КОНВЕЙЕР
+# =========================
+
+class StagePipeline:
+    """
+    Прогоняет задачи через стадии. У общей стадии одна ограниченная очередь
+    на входе (обратное давление: быстрая стадия не убегает вперёд медленной)
+    и свой набор потоков. У per_site-стадии очередь и потоки заводятся
+    на каждый сайт при первой его задаче. Задача, упавшая на какой-то
+    стадии, дальше не идёт. Стадии, уже пройденные задачей
+    (job.completed), пропускаются.
+
+    on_stage(job, stage_name) вызывается после каждой успешной стадии,
+    on_done(job) — когда задача покинула конвейер (успешно или нет).
+    """
+
+    def __init__(
+        self,
+        stages: list[Stage],
+        queue_size: Optional[int] = None,
+        on_done: Optional[Callable[[PublishJob], None]] = None,
+        on_stage: Optional[Callable[[PublishJob, str], None]] = None,
+    ):
+        if not stages:
+            raise ValueError("Конвейеру нужна хотя бы одна стадия")
+
+        self.stages = stages
+        self.on_done = on_done
+        self.on_stage = on_stage
+        self.queue_size = queue_size
+        self._order = {s.name: i for i, s in enumerate(stages)}
+
+        # очереди по стадиям: ключ None — общая очередь, иначе site_key
+        self._queues: list[dict] = [{} for _ in stages]
+        self._alive = [0 for _ in stages]
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._results: list[PublishJob] = []
+
+    def _site_workers(self, stage: Stage, site_key: str) -> int:
+        cfg = publisher.SITES_CONFIG.get(site_key, {})
+        return int(cfg.get("wp_concurrency") or stage.workers)
+
+    def _start_lane(self, i: int, lane_key: Optional[str]) -> queue.Queue:
+        """Создаёт очередь и потоки стадии i (вызывается под self._lock)."""
+        stage = self.stages[i]
+        if lane_key is None:
+            workers = stage.workers
+            maxsize = self.queue_size if self.queue_size is not None else 2 * workers
+        else:
+            workers = self._site_workers(stage, lane_key)
+            # очередь сайта не ограничена, чтобы общая стадия никогда не
+            # ждала медленный хост; размер держит DEFAULT_SITE_IN_FLIGHT
+            maxsize = 0
+
+        q = queue.Queue(maxsize=maxsize)
+        self._queues[i][lane_key] = q
+        self._alive[i] += workers
+        # пакет очереди собирает один воркер за раз, иначе воркеры
+        # растаскивают приходящие задачи по своим пакетам
+        gather = threading.Lock() if stage.batch is not None else None
+
+        for n in range(workers):
+            suffix = f"{lane_key}-{n}" if lane_key else str(n)
+            t = threading.Thread(
+                target=self._worker,
+                args=(i, q, gather),
+                name=f"{stage.name}-{suffix}",
+                daemon=True,
+            )
+            t.start()
+            self._threads.append(t)
+        return q
+
+    def _queue_for(self, i: int, job: PublishJob) -> queue.Queue:
+        lane_key = job.site_key if self.stages[i].per_site else None
+        with self._lock:
+            q = self._queues[i].get(lane_key)
+            if q is None:
+                q = self._start_lane(i, lane_key)
+            return q
+
+    def _close(self, i: int) -> None:
+        """Входящих задач у стадии i больше не будет: шлём STOP всем её потокам."""
+        with self._lock:
+            lanes = list(self._queues[i].items())
+            idle = self._alive[i] == 0
+
+        # put в ограниченную очередь может ждать, поэтому не под блокировкой
+        for lane_key, q in lanes:
+            workers = (
+                self.stages[i].workers
+                if lane_key is None
+                else self._site_workers(self.stages[i], lane_key)
+            )
+            for _ in range(workers):
+                q.put(_STOP)
+
+        # ни одной задачи до стадии не дошло — сразу закрываем следующую
+        if idle and i + 1 < len(self.stages):
+            self._close(i + 1)
+
+    def _finish(self, job: PublishJob) -> None:
+        with self._lock:
+            self._results.append(job)
+        metrics = get_metrics()
+        status = "ok" if job.error is None else "failed"
+        metrics.inc("jobs_total", status=status, site=job.site_key)
+        with metrics.labels(site=job.site_key, topic=job.topic):
+            metrics.event("job", status=status, failed_stage=job.failed_stage, post_id=job.post_id)
+        if self.on_done:
+            try:
+                self.on_done(job)
+            except Exception:
+                traceback.print_exc()
+
+    def _forward(self, i: int, job: PublishJob) -> None:
+        if job.error is not None or i + 1 == len(self.stages):
+            self._finish(job)
+        else:
+            job.queued_at = time.monotonic()
+            self._queue_for(i + 1, job).put(job)
+
+    def _site_batch(self, stage: Stage, site_key: str) -> tuple[int, float]:
+        cfg = publisher.SITES_CONFIG.get(site_key, {})
+        size = cfg.get(f"{stage.name}_batch_size")
+        wait = cfg.get(f"{stage.name}_batch_wait")
+        return (
+            int(stage.batch_size if size is None else size),
+            float(stage.batch_wait if wait is None else wait),
+        )
+
+    def _skip(self, i: int, job: PublishJob) -> bool:
+        """Стадия уже пройдена задачей (восстановлена из журнала)."""
+        return job.completed is not None and self._order.get(job.completed, -1) >= i
+
+    def _collect(self, i: int, q_in: queue.Queue, job: PublishJob) -> tuple[list[PublishJob], bool]:
+        """
+        Добирает к job задачи из очереди в пакет. Возвращает (пакет, встретился
+        STOP) — STOP этого воркера, после пакета он должен завершиться.
+        """
+        size, wait = self._site_batch(self.stages[i], job.site_key)
+        jobs = [job]
+        deadline = time.monotonic() + wait
+        while len(jobs) < size:
+            try:
+                timeout = deadline - time.monotonic()
+                nxt = q_in.get(timeout=timeout) if timeout > 0 else q_in.get_nowait()
+            except queue.Empty:
+                break
+            if nxt is _STOP:
+                return jobs, True
+            if self._skip(i, nxt):
+                self._forward(i, nxt)
+            else:
+                jobs.append(nxt)
+        return jobs, False
+
+    def _done(self, i: int, job: PublishJob, error: Optional[BaseException]) -> None:
+        """Итог стадии i для задачи: отметка в журнале или ошибка, дальше — _forward."""
+        stage = self.stages[i]
+        if error is None:
+            job.completed = stage.name
+            if self.on_stage:
+                try:
+                    self.on_stage(job, stage.name)
+                except Exception as e:
+                    error = e
+
+        if error is not None:
+            job.error = error
+            job.failed_stage = stage.name
+            print(
+                f"[PIPELINE][ERROR] [{job.site_key}] Стадия {stage.name!r}, "
+                f"тема #{job.index}: {job.topic!r}"
+            )
+            # у ошибок отдельных записей пакета traceback нет — печатается только текст
+            traceback.print_exception(type(error), error, error.__traceback__)
+        self._forward(i, job)
+
+    def _run_one(self, i: int, job: PublishJob) -> None:
+        stage = self.stages[i]
+        metrics = get_metrics()
+        error = None
+        try:
+            # метки сайта и темы видны всем метрикам внутри стадии
+            with metrics.labels(site=job.site_key, topic=job.topic):
+                metrics.observe("queue_wait_seconds", time.monotonic() - job.queued_at, stage=stage.name)
+                with metrics.timer("stage_seconds", stage=stage.name):
+                    stage.func(job)
+        except Exception as e:
+            error = e
+        self._done(i, job, error)
+
+    def _run_batch(self, i: int, jobs: list[PublishJob]) -> None:
+        stage = self.stages[i]
+        metrics = get_metrics()
+        now = time.monotonic()
+        for job in jobs:
+            with metrics.labels(site=job.site_key, topic=job.topic):
+                metrics.observe("queue_wait_seconds", now - job.queued_at, stage=stage.name)
+
+        try:
+            # время стадии — на весь пакет, метка только сайта
+            with metrics.labels(site=jobs[0].site_key), metrics.timer("stage_seconds", stage=stage.name):
+                errors = stage.batch(jobs)
+        except Exception as e:
+            errors = [e] * len(jobs)
+
+        for job, error in zip(jobs, errors):
+            self._done(i, job, error)
+
+    def _worker(self, i: int, q_in: queue.Queue, gather: Optional[threading.Lock] = None) -> None:
+        stage = self.stages[i]
+
+        while True:
+            with gather if gather is not None else contextlib.nullcontext():
+                job = q_in.get()
+                if job is _STOP:
+                    break
+
+                if self._skip(i, job):
+                    self._forward(i, job)
+                    continue
+
+                if stage.batch is None:
+                    jobs, stop = [job], False
+                else:
+                    jobs, stop = self._collect(i, q_in, job)
+
+            if len(jobs) == 1:
+                self._run_one(i, job)
+            else:
+                self._run_batch(i, jobs)
+            if stop:
+                break
+
+        # последний вышедший воркер стадии закрывает вход следующей
+        with self._lock:
+            self._alive[i] -= 1
+            last = self._alive[i] == 0
+        if last and i + 1 < len(self.stages):
+            self._close(i + 1)
+
+    def run(self, jobs: Iterable[PublishJob]) -> list[PublishJob]:
+        """Прогоняет все задачи и возвращает их в порядке завершения."""
+        for job in jobs:
+            job.queued_at = time.monotonic()
+            self._queue_for(0, job).put(job)
+        self._close(0)
+
+        # потоки per_site-стадий появляются по ходу работы, поэтому
+        # ждём, пока список перестанет расти
+        joined = 0
+        while True:
+            with self._lock:
+                pending = self._threads[joined:]
+            if not pending:
+                break
+            for t in pending:
+                t.join()
+            joined += len(pending)
+
+        return list(self._results)
+
+
+# =========================
+#   ПЛАНИРОВЩИК ПО САЙТАМ
+# =========================
+
+def _site_in_flight(site_key: str) -> int:
+    cfg = publisher.SITES_CONFIG[site_key]
+    return int(cfg.get("max_in_flight") or DEFAULT_SITE_IN_FLIGHT)
+
+
+def _resume_job(journal: Optional[JobJournal], job: PublishJob) -> bool:
+    """Подтягивает состояние задачи из журнала. False — тема уже опубликована."""
+    if journal is None:
+        return True
+
+    rec = journal.get(job.site_key, job.topic)
+    if rec is None or rec.stage is None:
+        return True
+
+    if rec.finished:
+        print(
+            f"[PIPELINE] [{job.site_key}] Тема уже опубликована "
+            f"(пост {rec.post_id}), пропускаю: {job.topic!r}"
+        )
+        return False
+
+    job.completed = rec.stage
+    job.article = rec.article
+    job.media_id = rec.media_id
+    job.image_data = rec.image_webp
+
+    print(
+        f"[PIPELINE] [{job.site_key}] Продолжаю тему после стадии "
+        f"{rec.stage!r}: {job.topic!r}"
+    )
+    return True
+
+
+class SiteScheduler:
+    """
+    Выдаёт задачи конвейеру по кругу между сайтами, не пуская в работу
+    больше max_in_flight задач одного сайта. Если сайт упёрся в лимит
+    (например, его WP отвечает по таймауту), очередь переходит к другим
+    сайтам, а не ждёт его.
+
+    С журналом уже опубликованные темы пропускаются, а начатые
+    восстанавливаются с последней завершённой стадии.
+    """
+
+    def __init__(
+        self,
+        site_topics: dict[str, Iterable[str]],
+        publish: Optional[bool] = None,
+        category_id: Optional[int] = None,
+        journal: Optional[JobJournal] = None,
+    ):
+        for site_key in site_topics:
+            if site_key not in publisher.SITES_CONFIG:
+                raise KeyError(f"Сайт '{site_key}' не найден в SITES_CONFIG")
+
+        self.publish = publish
+        self.category_id = category_id
+        self.journal = journal
+        self.skipped = 0
+        self._iters = {k: iter(v) for k, v in site_topics.items()}
+        self._counters = {k: 0 for k in site_topics}
+        self._in_flight = {k: 0 for k in site_topics}
+        self._cond = threading.Condition()
+
+    def _limit(self, site_key: str) -> int:
+        return _site_in_flight(site_key)
+
+    def _resume(self, job: PublishJob) -> bool:
+        return _resume_job(self.journal, job)
+
+    def release(self, job: PublishJob) -> None:
+        """Вызывается по завершении задачи — освобождает слот сайта."""
+        with self._cond:
+            self._in_flight[job.site_key] -= 1
+            self._cond.notify_all()
+
+    def jobs(self) -> Iterator[PublishJob]:
+        active = list(self._iters)
+        pos = 0
+
+        while active:
+            job = None
+            with self._cond:
+                for _ in range(len(active)):
+                    site_key = active[pos % len(active)]
+                    pos += 1
+                    if self._in_flight[site_key] >= self._limit(site_key):
+                        continue
+
+                    topic = next(self._iters[site_key], None)
+                    if topic is None:
+                        active.remove(site_key)
+                        break
+
+                    self._counters[site_key] += 1
+                    job = PublishJob(
+                        site_key,
+                        topic,
+                        index=self._counters[site_key],
+                        publish=self.publish,
+                        category_id=self.category_id,
+                    )
+                    if not self._resume(job):
+                        self.skipped += 1
+                        job = None
+                        break
+
+                    self._in_flight[site_key] += 1
+                    break
+                else:
+                    # все активные сайты упёрлись в лимит — ждём освобождения
+                    self._cond.wait(timeout=1.0)
+
+            if job is not None:
+                yield job
+
+
+class QueueScheduler:
+    """
+    Выдаёт конвейеру задачи из общей очереди (work_queue.py): берёт их в
+    аренду по мере освобождения мест — не больше in_flight всего и
+    max_in_flight на сайт — и фоновым потоком продлевает аренду, пока
+    задача в работе. По завершении задача отмечается в очереди: done,
+    повтор позже или dead после последней попытки.
+
+    С wait=False выдача заканчивается, когда в очереди по нашим сайтам не
+    осталось незавершённых задач (в том числе чужих: если их воркер
+    упадёт, аренда истечёт и задачу заберём мы). С wait=True очередь
+    опрашивается, пока не вызван stop().
+    """
+
+    def __init__(
+        self,
+        work_queue: WorkQueue,
+        worker_id: Optional[str] = None,
+        sites: Optional[Iterable[str]] = None,
+        in_flight: int = DEFAULT_QUEUE_IN_FLIGHT,
+        journal: Optional[JobJournal] = None,
+        wait: bool = False,
+        poll_interval: float = QUEUE_POLL_INTERVAL,
+    ):
+        self.sites = list(sites) if sites is not None else list(publisher.SITES_CONFIG)
+        for site_key in self.sites:
+            if site_key not in publisher.SITES_CONFIG:
+                raise KeyError(f"Сайт '{site_key}' не найден в SITES_CONFIG")
+
+        self.queue = work_queue
+        self.worker_id = worker_id or default_worker_id()
+        self.in_flight = in_flight
+        self.journal = journal
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.skipped = 0
+
+        self._leases: dict[tuple[str, str], Lease] = {}
+        self._counters = {k: 0 for k in self.sites}
+        self._in_flight = {k: 0 for k in self.sites}
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._closed = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="queue-heartbeat", daemon=True)
+
+    def _total(self) -> int:
+        return sum(self._in_flight.values())
+
+    def _heartbeat_loop(self) -> None:
+        interval = max(1.0, getattr(self.queue, "lease_ttl", DEFAULT_LEASE_TTL) / 3)
+        while not self._closed.wait(interval):
+            with self._cond:
+                leases = list(self._leases.values())
+            try:
+                lost = self.queue.heartbeat(leases)
+            except Exception as e:
+                print(f"[QUEUE][WARN] Не удалось продлить аренду: {e}")
+                continue
+            for lease in lost:
+                print(
+                    f"[QUEUE][WARN] [{lease.site_key}] Аренда потеряна (истекла и передана "
+                    f"другому воркеру): {lease.topic!r}"
+                )
+
+    def stop(self) -> None:
+        """Не брать новые задачи; начатые доработают."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        """Останавливает heartbeat; незавершённые аренды возвращает в очередь без траты попытки."""
+        self._closed.set()
+        with self._cond:
+            leases = list(self._leases.values())
+            self._leases.clear()
+        for lease in leases:
+            self.queue.release(lease)
+
+    def release(self, job: PublishJob) -> None:
+        """Вызывается по завершении задачи — отмечает её в очереди и освобождает место."""
+        with self._cond:
+            lease = self._leases.pop((job.site_key, job.topic), None)
+            self._in_flight[job.site_key] -= 1
+            self._cond.notify_all()
+        if lease is None:
+            return
+
+        metrics = get_metrics()
+        if job.error is None:
+            result = "done" if self.queue.complete(lease) else "lost"
+        else:
+            result = self.queue.fail(lease, f"{job.failed_stage}: {job.error}")
+            if result == "ready":
+                result = "retry"
+                print(
+                    f"[QUEUE] [{job.site_key}] Попытка {lease.attempt} не удалась, "
+                    f"тема вернётся в очередь: {job.topic!r}"
+                )
+            elif result == "dead":
+                print(
+                    f"[QUEUE] [{job.site_key}] Попытки кончились ({lease.attempt}), "
+                    f"тема в dead: {job.topic!r}"
+                )
+        if result == "lost":
+            print(f"[QUEUE][WARN] [{job.site_key}] Аренда уже у другого воркера: {job.topic!r}")
+        metrics.inc("queue_jobs_total", result=result, site=job.site_key)
+
+    def jobs(self) -> Iterator[PublishJob]:
+        self._heartbeat.start()
+        print(f"[QUEUE] Воркер {self.worker_id}: сайты {', '.join(self.sites)}")
+
+        while not self._stop.is_set():
+            with self._cond:
+                while self._total() >= self.in_flight and not self._stop.is_set():
+                    self._cond.wait(timeout=1.0)
+                free = self.in_flight - self._total()
+                full = [k for k, n in self._in_flight.items() if n >= _site_in_flight(k)]
+            if self._stop.is_set():
+                break
+
+            leases = self.queue.lease(self.worker_id, free, self.sites, full)
+            if not leases:
+                if not self.wait and self._total() == 0 and self.queue.pending(self.sites) == 0:
+                    break
+                self._stop.wait(self.poll_interval)
+                continue
+
+            for lease in leases:
+                self._counters[lease.site_key] += 1
+                job = PublishJob(
+                    lease.site_key,
+                    lease.topic,
+                    index=self._counters[lease.site_key],
+                    publish=lease.publish,
+                    category_id=lease.category_id,
+                )
+                if not _resume_job(self.journal, job):
+                    self.queue.complete(lease)
+                    self.skipped += 1
+                    continue
+                with self._cond:
+                    self._leases[(job.site_key, job.topic)] = lease
+                    self._in_flight[job.site_key] += 1
+                yield job
+
+
+# =========================
+#   ЗАПУСК ПО ТЕМАМ
+# =========================
+
+def _run_scheduled(
+    scheduler,
+    sites: Iterable[str],
+    concurrency: Optional[dict] = None,
+    openai_concurrency: Optional[int] = None,
+    journal: Optional[JobJournal] = None,
+) -> list[PublishJob]:
+    """Гонит задачи планировщика (SiteScheduler или QueueScheduler) через конвейер и печатает итог."""
+
+    def on_done(job: PublishJob) -> None:
+        scheduler.release(job)
+        if journal is not None and job.error is not None:
+            journal.record_error(job)
+        # итог хранит все задачи прогона — байты обложки в нём не нужны
+        job.image_data = None
+
+    pipeline = StagePipeline(
+        build_publish_stages(concurrency, openai_concurrency),
+        on_done=on_done,
+        on_stage=journal.record_stage if journal is not None else None,
+    )
+
+    started = time.monotonic()
+    try:
+        results = pipeline.run(scheduler.jobs())
+    finally:
+        wp_client.close_all()
+        if journal is not None:
+            journal.flush()
+    elapsed = time.monotonic() - started
+
+    for site_key in sites:
+        site_jobs = [j for j in results if j.site_key == site_key]
+        failed = sum(1 for j in site_jobs if j.error is not None)
+        print(
+            f"[PIPELINE] [{site_key}] постов: {len(site_jobs) - failed}, "
+            f"ошибок: {failed}"
+        )
+
+    ok = [j for j in results if j.error is None]
+    failed = [j for j in results if j.error is not None]
+    print(
+        f"\n[PIPELINE] Готово: {len(ok)} постов, ошибок: {len(failed)}, "
+        f"пропущено готовых: {scheduler.skipped}, время: {elapsed:.1f} с"
+    )
+    for job in failed:
+        print(
+            f"[PIPELINE][ERROR] [{job.site_key}] #{job.index} {job.topic!r} — "
+            f"стадия {job.failed_stage!r}: {job.error}"
+        )
+
+    return results
+
+
+def run_sites(
+    site_topics: dict[str, Iterable[str]],
+    publish: Optional[bool] = None,
+    category_id: Optional[int] = None,
+    concurrency: Optional[dict] = None,
+    openai_concurrency: Optional[int] = None,
+    journal: Optional[JobJournal] = None,
+) -> list[PublishJob]:
+    """
+    Публикует темы на все указанные сайты параллельно и печатает итог.
+    С journal прогресс каждой задачи сохраняется, а готовые темы пропускаются.
+    """
+    scheduler = SiteScheduler(
+        site_topics,
+        publish=publish,
+        category_id=category_id,
+        journal=journal,
+    )
+    return _run_scheduled(scheduler, site_topics, concurrency, openai_concurrency, journal)
+
+
+def run_queue(
+    work_queue: WorkQueue,
+    worker_id: Optional[str] = None,
+    sites: Optional[Iterable[str]] = None,
+    in_flight: Optional[int] = None,
+    wait: bool = False,
+    concurrency: Optional[dict] = None,
+    openai_concurrency: Optional[int] = None,
+    journal: Optional[JobJournal] = None,
+) -> list[PublishJob]:
+    """
+    Воркер общей очереди: разбирает задачи, пока они есть (или, с wait,
+    пока не прервут). Сколько таких воркеров запущено и где — неважно:
+    каждую тему в один момент обрабатывает только один из них.
+    """
+    scheduler = QueueScheduler(
+        work_queue,
+        worker_id=worker_id,
+        sites=sites,
+        in_flight=in_flight or DEFAULT_QUEUE_IN_FLIGHT,
+        journal=journal,
+        wait=wait,
+    )
+    try:
+        return _run_scheduled(scheduler, scheduler.sites, concurrency, openai_concurrency, journal)
+    finally:
+        scheduler.close()
+
+
+def run_topics(
+    site_key: str,
+    topics: Iterable[str],
+    publish: Optional[bool] = None,
+    category_id: Optional[int] = None,
+    concurrency: Optional[dict] = None,
+    journal: Optional[JobJournal] = None,
+) -> list[PublishJob]:
+    """Публикует темы на один сайт через конвейер."""
+    return run_sites(
+        {site_key: topics},
+        publish=publish,
+        category_id=category_id,
+        concurrency=concurrency,
+        journal=journal,
+    )
+
+
+# =========================
+#   НАЗНАЧЕНИЕ ТЕМ САЙТАМ
+# =========================
+
+def _read_assignments(path: str) -> Iterator[tuple[str, str]]:
+    """Строки файла назначений по одной: (сайт, тема); битая строка — ошибка."""
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            t = line.strip()
+            if not t or t.startswith("#"):
+                continue
+
+            site_key, sep, topic = t.partition("\t")
+            site_key, topic = site_key.strip(), topic.strip()
+            if not sep or not topic:
+                raise ValueError(f"{path}:{n}: ожидается 'site_key<TAB>тема'")
+            if site_key not in publisher.SITES_CONFIG:
+                raise KeyError(f"{path}:{n}: сайт '{site_key}' не найден в SITES_CONFIG")
+            yield site_key, topic
+
+
+def _iter_assigned(
+    path: str,
+    site_key: str,
+    shard: int,
+    shards: int,
+    offset: int,
+    limit: Optional[int],
+) -> Iterator[str]:
+    topics = (t for k, t in _read_assignments(path) if k == site_key)
+    if shards > 1:
+        topics = (t for t in topics if publisher.topic_shard(t, shards) == shard)
+    stop = None if limit is None else offset + limit
+    yield from itertools.islice(topics, offset, stop)
+
+
+def load_site_assignments(
+    path: str,
+    shard: int = 0,
+    shards: int = 1,
+    offset: int = 0,
+    limit: Optional[int] = None,
+) -> dict[str, Iterator[str]]:
+    """
+    Читает назначение тем сайтам: одна строка = "site_key<TAB>тема".
+    Пустые строки и строки с # пропускаются.
+    Файл один раз проверяется потоком (формат строк, известные сайты) —
+    в памяти остаётся только список сайтов; темы каждого сайта потом
+    читаются лениво своим проходом по файлу, с шардом и окном
+    offset/limit, как в publisher.iter_topics.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Файл назначений не найден: {path}")
+
+    sites = dict.fromkeys(site_key for site_key, _ in _read_assignments(path))
+    return {
+        site_key: _iter_assigned(path, site_key, shard, shards, offset, limit)
+        for site_key in sites
+    }
+
+
+def dedupe_site_topics(
+    site_key: str,
+    topics: Iterable[str],
+    sync_index: bool = True,
+) -> Iterator[str]:
+    """
+    Лениво убирает почти одинаковые темы сайта — внутри списка и относительно
+    уже опубликованных записей (индекс записей). Порог — topic_dedupe_threshold
+    сайта, None отключает проверку. Без sync_index берётся только локальный
+    индекс, без запросов к WP.
+    """
+    threshold = publisher.SITES_CONFIG[site_key].get("topic_dedupe_threshold", DEFAULT_THRESHOLD)
+    if not threshold:
+        yield from topics
+        return
+
+    published = []
+    for post in get_post_index(site_key, sync_if_empty=sync_index).posts():
+        published.append(post.title)
+        if post.topic and post.topic != post.title:
+            published.append(post.topic)
+
+    skipped = 0
+
+    def report(dup) -> None:
+        nonlocal skipped
+        skipped += 1
+        if skipped <= DEDUPE_REPORT_LIMIT:
+            print(f"[DEDUPE] [{site_key}] Пропускаю дубль: {format_duplicate(dup)}")
+
+    yield from iter_unique_topics(topics, published, threshold, on_duplicate=report)
+
+    if skipped:
+        print(f"[DEDUPE] [{site_key}] Всего пропущено дублей: {skipped}")
+
+
+def collect_site_topics(
+    assignments_path: Optional[str] = None,
+    dedupe: bool = True,
+    shard: int = 0,
+    shards: int = 1,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    sites: Optional[Iterable[str]] = None,
+    sync_index: bool = True,
+) -> dict[str, Iterator[str]]:
+    """
+    Собирает темы для всех сайтов: из файла назначений (если задан)
+    и из ключа topics_file каждого сайта в SITES_CONFIG.
+    Файлы тем читаются лениво — по мере того, как конвейер берёт задачи;
+    shard/shards и offset/limit применяются к каждому источнику отдельно
+    (см. publisher.iter_topics). С dedupe почти одинаковые темы
+    отсеиваются до вызовов модели. sites — только эти сайты.
+    """
+    if sites is not None:
+        sites = set(sites)
+        unknown = sites - set(publisher.SITES_CONFIG)
+        if unknown:
+            raise KeyError(f"Сайты не найдены в SITES_CONFIG: {', '.join(sorted(unknown))}")
+
+    sources: dict[str, list[Iterable[str]]] = {}
+
+    if assignments_path:
+        assigned = load_site_assignments(assignments_path, shard, shards, offset, limit)
+        for site_key, topics in assigned.items():
+            if sites is not None and site_key not in sites:
+                continue
+            sources.setdefault(site_key, []).append(topics)
+
+    for site_key, cfg in publisher.SITES_CONFIG.items():
+        if sites is not None and site_key not in sites:
+            continue
+        topics_file = cfg.get("topics_file")
+        if topics_file:
+            topics = publisher.iter_topics(topics_file, shard, shards, offset, limit)
+            sources.setdefault(site_key, []).append(topics)
+
+    site_topics: dict[str, Iterator[str]] = {}
+    for site_key, parts in sources.items():
+        topics = itertools.chain.from_iterable(parts)
+        site_topics[site_key] = (
+            dedupe_site_topics(site_key, topics, sync_index=sync_index) if dedupe else topics
+        )
+
+    if not site_topics:
+        raise RuntimeError(
+            "Нет тем ни в одном сайте: укажи topics_file в SITES_CONFIG "
+            f"или заполни {SITE_TOPICS_FILE}"
+        )
+
+    return site_topics
@@ -0,0 +1,331 @@
+"""
+Локальный индекс уже существующих записей сайта.
+
+Для каждого сайта в SQLite хранится slug, заголовок, id, статус, ссылка
+и (для записей, созданных скриптом) исходная тема. Индекс один раз
+заполняется постраничной выгрузкой /wp-json/wp/v2/posts и дальше
+обновляется после каждого create_post; выгрузка повторяется, когда
+индекс старше SYNC_MAX_AGE (или по `sites --resync`), — записи,
+удалённые в WP, из него пропадают. Проверка занятости ЧПУ и решение
+«такая запись уже есть — обновить, а не создать» делаются по словарям
+в памяти, без лишнего запроса к WP на каждую статью.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from wp_client import WPClient, get_wp_client
+
+
+DEFAULT_INDEX_PATH = "post_index.sqlite3"
+SYNC_PER_PAGE = 100
+# Через сколько секунд индекс выгружается из WP заново (POST_INDEX_MAX_AGE, 0 — никогда)
+SYNC_MAX_AGE = float(os.environ.get("POST_INDEX_MAX_AGE") or 24 * 3600)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    site_key TEXT NOT NULL,
+    post_id  INTEGER NOT NULL,
+    slug     TEXT,
+    title    TEXT,
+    status   TEXT,
+    link     TEXT,
+    topic    TEXT,
+    PRIMARY KEY (site_key, post_id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    site_key  TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class IndexedPost:
+    post_id: int
+    slug: str
+    title: str
+    status: str
+    link: Optional[str] = None
+    topic: Optional[str] = None
+
+
+def _norm_title(title: str) -> str:
+    return " ".join((title or "").lower().replace("ё", "е").split())
+
+
+class PostIndex:
+    """Индекс записей одного сайта: словари в памяти + SQLite на диске."""
+
+    def __init__(self, site_key: str, path: str = DEFAULT_INDEX_PATH):
+        self.site_key = site_key
+        self.path = path
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+        self.sync_lock = threading.Lock()
+        self.checked_at: Optional[float] = None  # time.monotonic() последней проверки
+
+        self._by_id: dict[int, IndexedPost] = {}
+        self._by_slug: dict[str, IndexedPost] = {}
+        self._by_title: dict[str, IndexedPost] = {}
+        # ЧПУ, выданные resolve_slug, но ещё не подтверждённые record:
+        # параллельные воркеры не получат один и тот же «свободный» ЧПУ
+        self._reserved: dict[str, str] = {}
+
+        rows = self._conn.execute(
+            "SELECT post_id, slug, title, status, link, topic FROM posts WHERE site_key = ?",
+            (site_key,),
+        ).fetchall()
+        for row in rows:
+            self._put(IndexedPost(*row))
+
+    def _put(self, post: IndexedPost) -> None:
+        old = self._by_id.get(post.post_id)
+        if old is not None:
+            if self._by_slug.get(old.slug) is old:
+                del self._by_slug[old.slug]
+            if self._by_title.get(_norm_title(old.title)) is old:
+                del self._by_title[_norm_title(old.title)]
+
+        self._by_id[post.post_id] = post
+        if post.slug:
+            self._by_slug[post.slug] = post
+        if post.title:
+            self._by_title[_norm_title(post.title)] = post
+
+    # ---- чтение ----
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def by_slug(self, slug: str) -> Optional[IndexedPost]:
+        return self._by_slug.get(slug)
+
+    def by_title(self, title: str) -> Optional[IndexedPost]:
+        return self._by_title.get(_norm_title(title))
+
+    def by_id(self, post_id: int) -> Optional[IndexedPost]:
+        return self._by_id.get(post_id)
+
+    def posts(self) -> Iterator[IndexedPost]:
+        return iter(list(self._by_id.values()))
+
+    @property
+    def synced_at(self) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT synced_at FROM sync_state WHERE site_key = ?", (self.site_key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    # ---- запись ----
+
+    def _record(self, post: IndexedPost) -> None:
+        """Запись в словари и в SQLite; вызывается под self._lock внутри транзакции."""
+        prev = self._by_id.get(post.post_id)
+        if post.topic is None and prev is not None:
+            post.topic = prev.topic
+        self._reserved.pop(post.slug, None)
+        self._put(post)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO posts "
+            "(site_key, post_id, slug, title, status, link, topic) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.site_key, post.post_id, post.slug, post.title,
+             post.status, post.link, post.topic),
+        )
+
+    def _forget(self, post_id: int) -> None:
+        old = self._by_id.pop(post_id, None)
+        if old is not None:
+            if self._by_slug.get(old.slug) is old:
+                del self._by_slug[old.slug]
+            if self._by_title.get(_norm_title(old.title)) is old:
+                del self._by_title[_norm_title(old.title)]
+        self._conn.execute(
+            "DELETE FROM posts WHERE site_key = ? AND post_id = ?", (self.site_key, post_id)
+        )
+
+    def record(self, post: IndexedPost) -> None:
+        """Добавляет или обновляет запись (вызывается после create_post)."""
+        with self._lock, self._conn:
+            self._record(post)
+
+    def forget(self, post_id: int) -> None:
+        """Убирает запись, которой в WP больше нет (удалена или в корзине)."""
+        with self._lock, self._conn:
+            self._forget(post_id)
+
+    def sync(self, wp: Optional[WPClient] = None) -> int:
+        """
+        Постраничная выгрузка всех записей сайта (любой статус).
+        Возвращает число записей, полученных из WP.
+        """
+        wp = wp or get_wp_client(self.site_key)
+        # записи, созданные во время выгрузки, в «пропавшие» не попадут
+        with self._lock:
+            known = set(self._by_id)
+        fetched = []
+        page = 1
+        total_pages = 1
+
+        while page <= total_pages:
+            resp = wp.get(
+                "wp/v2/posts",
+                params={
+                    "context": "edit",
+                    "status": "any",
+                    "per_page": SYNC_PER_PAGE,
+                    "page": page,
+                    "_fields": "id,slug,generated_slug,title,status,link",
+                },
+            )
+            if resp.status_code != 200:
+                raise RuntimeError(
+                    f"[{self.site_key}] Ошибка выгрузки записей из WP: "
+                    f"{resp.status_code} {resp.text}"
+                )
+            total_pages = int(resp.headers.get("X-WP-TotalPages") or 1)
+
+            for item in resp.json():
+                title = item.get("title") or {}
+                if isinstance(title, dict):
+                    title = title.get("raw") or title.get("rendered") or ""
+                fetched.append(IndexedPost(
+                    post_id=int(item["id"]),
+                    slug=item.get("slug") or item.get("generated_slug") or "",
+                    title=title,
+                    status=item.get("status") or "",
+                    link=item.get("link"),
+                ))
+            page += 1
+
+        # одной транзакцией: записи из WP, удаление пропавших и отметка времени
+        seen = {post.post_id for post in fetched}
+        with self._lock, self._conn:
+            for post in fetched:
+                self._record(post)
+            gone = [post_id for post_id in known - seen if post_id in self._by_id]
+            for post_id in gone:
+                self._forget(post_id)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (site_key, synced_at) VALUES (?, ?)",
+                (self.site_key, time.time()),
+            )
+
+        print(
+            f"[{self.site_key}] Индекс записей синхронизирован: {len(fetched)} шт."
+            + (f", удалено пропавших из WP: {len(gone)}" if gone else "")
+        )
+        return len(fetched)
+
+    # ---- решение по ЧПУ ----
+
+    def resolve_slug(
+        self,
+        topic: str,
+        candidates: list[str],
+        max_suffix: int = 50,
+        title: Optional[str] = None,
+    ) -> tuple[str, Optional[int]]:
+        """
+        Выбирает ЧПУ для темы: (slug, post_id существующей записи или None).
+        ЧПУ занят «своей» записью (та же тема, либо тема неизвестна, но
+        совпадает заголовок title) — обновляем её. Занят любой другой
+        записью — пробуем следующий кандидат, затем суффиксы -2, -3, ...
+        """
+        candidates = [c for c in dict.fromkeys(candidates) if c]
+        topic = topic.strip()
+
+        def check(slug: str):
+            reserved = self._reserved.get(slug)
+            if reserved is not None and reserved != topic:
+                return False, None
+            existing = self._by_slug.get(slug)
+            if existing is None:
+                self._reserved[slug] = topic
+                return True, None
+            if existing.topic == topic:
+                return True, existing.post_id
+            # тема записи неизвестна (выгружена из WP) — своя, только если совпал заголовок
+            if existing.topic is None and title and self.by_title(title) is existing:
+                return True, existing.post_id
+            return False, None
+
+        with self._lock:
+            for slug in candidates:
+                ok, post_id = check(slug)
+                if ok:
+                    return slug, post_id
+
+            base = candidates[0]
+            for n in range(2, max_suffix + 1):
+                slug = f"{base}-{n}"
+                ok, post_id = check(slug)
+                if ok:
+                    return slug, post_id
+
+        raise RuntimeError(f"[{self.site_key}] Не удалось подобрать свободный ЧПУ для {base!r}")
+
+    def release(self, slug: str) -> None:
+        """Снимает резерв ЧПУ, если создать запись не удалось."""
+        with self._lock:
+            self._reserved.pop(slug, None)
+
+
+_indexes: dict[str, PostIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _check_due(index: PostIndex) -> bool:
+    if index.checked_at is None:
+        return True
+    return SYNC_MAX_AGE > 0 and time.monotonic() - index.checked_at > SYNC_MAX_AGE
+
+
+def _sync_due(index: PostIndex) -> bool:
+    synced_at = index.synced_at
+    if synced_at is None:
+        return True
+    return SYNC_MAX_AGE > 0 and time.time() - synced_at > SYNC_MAX_AGE
+
+
+def get_post_index(site_key: str, sync_if_empty: bool = True, resync: bool = False) -> PostIndex:
+    """
+    Индекс сайта. С sync_if_empty — выгрузка из WP, если индекс ещё не
+    синхронизирован или старше SYNC_MAX_AGE; resync — выгрузить заново сейчас.
+    """
+    with _indexes_lock:
+        index = _indexes.get(site_key)
+        if index is None:
+            index = PostIndex(site_key)
+            _indexes[site_key] = index
+
+    # выгрузка идёт вне общей блокировки, чтобы медленный сайт
+    # не задерживал остальные; параллельные вызовы ждут её окончания.
+    # Проверяется при первом вызове с sync_if_empty (индекс, открытый без
+    # выгрузки, выгрузится тогда) и дальше раз в SYNC_MAX_AGE — долгий
+    # воркер тоже увидит удалённые записи. Неудачная выгрузка не
+    # повторяется на каждой статье.
+    if resync or (sync_if_empty and _check_due(index)):
+        with index.sync_lock:
+            if resync or _check_due(index):
+                try:
+                    if resync or _sync_due(index):
+                        index.sync()
+                except Exception as e:
+                    if resync:
+                        raise
+                    print(f"[{site_key}] Не удалось синхронизировать индекс записей: {e}")
+                finally:
+                    index.checked_at = time.monotonic()
+
+    return index
@@ -0,0 +1,336 @@
+"""
+Реестр промптов статьи по prompt_profile (ключ в SITES_CONFIG).
+
+Промпт профиля делится на две части:
+- system — большая статическая инструкция, байт в байт одинаковая для
+  всех тем. OpenAI кэширует общий префикс запросов (от 1024 токенов),
+  поэтому со второго вызова эта часть идёт по цене кэшированного входа
+  и быстрее доходит до первого токена;
+- user — короткое сообщение с темой в самом конце запроса.
+
+Всё, что меняется от темы к теме, должно жить в user_template: любая
+подстановка в system ломает кэш префикса. Новые профили регистрируются
+через register_profile().
+
+Для генерации по разделам (article_sections.py) к тому же system
+добавляются задания OUTLINE_TEMPLATE (план) и SECTION_TEMPLATE (один
+раздел). Запросы разделов одной статьи повторяют весь диалог с планом,
+поэтому делят между собой ещё более длинный кэшированный префикс.
+Так же устроена досборка короткой статьи (REPAIR_TEMPLATE): обычный
+запрос статьи, её ответ и задание дописать один раздел.
+"""
+
+import hashlib
+from dataclasses import dataclass
+
+
+DEFAULT_PROFILE = "default"
+
+DEFAULT_USER_TEMPLATE = "Тема статьи:\n{topic}"
+
+OUTLINE_TEMPLATE = """
+Сейчас нужен только план этой статьи: текст разделов будет написан отдельно, по одному.
+Верни JSON-объект со следующими полями:
+
+- "title", "meta_title", "meta_description", "slug", "image_prompt" — как в формате ответа выше;
+- "intro_html": строка — вступление без подзаголовка, 60–120 слов, только <p>;
+- "sections": массив из 4–7 разделов H2 по порядку, последний — финальный смысловой блок.
+  У каждого раздела:
+    "h2": заголовок раздела без HTML,
+    "points": 2–4 коротких тезиса — что раскрыть в разделе,
+    "words": сколько слов в разделе,
+    "table": true, если в разделе нужна таблица,
+    "list": true, если в разделе нужен список.
+
+Сумма "words" по разделам — около {words} слов. Хотя бы у одного раздела "table": true
+и хотя бы у одного "list": true.
+
+Никакого текста вне JSON.
+"""
+
+SECTION_TEMPLATE = """
+Напиши раздел «{h2}» из этого плана.
+Что раскрыть: {points}
+Объём: около {words} слов.{extras}
+
+Верни JSON-объект с одним полем "content_html": HTML раздела БЕЗ заголовка H2
+(он будет добавлен автоматически). Допускаются только <h3>, <p>, <ul>, <ol>, <li>,
+<table>, <thead>, <tbody>, <tr>, <td>. Не повторяй вступление и другие разделы.
+
+Никакого текста вне JSON.
+"""
+
+REPAIR_TEMPLATE = """
+Статья выше не прошла проверку. Дополни раздел «{h2}» (сейчас в нём {current} слов).
+{task}{extras}
+
+Верни JSON-объект с одним полем "content_html": ТОЛЬКО новый HTML, который будет вставлен
+в конец этого раздела, без заголовка H2 и без повторов уже написанного. Допускаются только
+<h3>, <p>, <ul>, <ol>, <li>, <table>, <thead>, <tbody>, <tr>, <td>.
+
+Никакого текста вне JSON.
+"""
+
+
+@dataclass(frozen=True)
+class PromptProfile:
+    name: str
+    system: str
+    user_template: str = DEFAULT_USER_TEMPLATE
+
+    @property
+    def fingerprint(self) -> str:
+        """Короткий хэш текста промпта: меняется вместе с инструкцией."""
+        digest = hashlib.sha256(f"{self.system}\0{self.user_template}".encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def messages(self, topic: str) -> list[dict]:
+        """Статический system-префикс и тема последним сообщением."""
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user_template.format(topic=topic.strip())},
+        ]
+
+    def outline_messages(self, topic: str, words: int) -> list[dict]:
+        """Запрос плана статьи: тема и задание OUTLINE_TEMPLATE одним сообщением."""
+        task = OUTLINE_TEMPLATE.format(words=words)
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user_template.format(topic=topic.strip()) + "\n" + task},
+        ]
+
+    def section_messages(
+        self,
+        topic: str,
+        words: int,
+        outline_raw: str,
+        h2: str,
+        points: list[str],
+        section_words: int,
+        extras: str = "",
+    ) -> list[dict]:
+        """Запрос одного раздела: диалог с планом (общий префикс) и задание раздела."""
+        task = SECTION_TEMPLATE.format(
+            h2=h2,
+            points="; ".join(points) or "по заголовку",
+            words=section_words,
+            extras=extras,
+        )
+        return [
+            *self.outline_messages(topic, words),
+            {"role": "assistant", "content": outline_raw},
+            {"role": "user", "content": task},
+        ]
+
+    def repair_messages(
+        self,
+        topic: str,
+        article_raw: str,
+        h2: str,
+        current_words: int,
+        add_words: int,
+        extras: str = "",
+    ) -> list[dict]:
+        """Досборка раздела: обычный запрос статьи, её ответ и задание дописать раздел."""
+        if add_words:
+            task = f"Допиши около {add_words} слов: новые факты, цифры, примеры и практические детали."
+        else:
+            task = "Объём раздела менять не нужно."
+        return [
+            *self.messages(topic),
+            {"role": "assistant", "content": article_raw},
+            {"role": "user", "content": REPAIR_TEMPLATE.format(
+                h2=h2, current=current_words, task=task, extras=extras,
+            )},
+        ]
+
+
+# =========================
+#   ПРОФИЛЬ default
+# =========================
+
+DEFAULT_SYSTEM_PROMPT = """
+Напиши экспертную SEO-оптимизированную статью на тему из сообщения пользователя.
+
+Ты — журналист и редактор уровня Спорт-Экспресс, Чемпионат.com, Sports.ru, с большим практическим опытом в спорте, ставках и онлайн-казино. Ты пишешь как живой человек, а не как нейросеть, не как научный работник и не как банковский аналитик.
+
+1. Объём и базовые ограничения
+
+Объём статьи: 1000–1500 слов.
+Если текст получается короче 1000 слов — ОБЯЗАТЕЛЬНО расширь каждый смысловой блок,
+добавь примеры, цифры, детали и практические рекомендации, пока объём не превысит 1000 слов.
+
+Это полноценная развернутая SEO-статья, а не краткая справка.
+
+Текст должен:
+— глубоко раскрывать тему,
+— включать несколько смысловых уровней,
+— содержать примеры, цифры, детали,
+— не быть сжатым или обзорным.
+
+Запрещено использовать:
+линии-разделители
+эмодзи
+формальные нейросетевые шаблоны
+пафос, восхваление, абстрактные рассуждения
+рекламный тон
+
+2. SEO-требования (обязательно)
+
+Используй ключевые слова из кластера и LSI-термины естественно, без переспама.
+В конце статьи обязательно добавь:
+✅ Meta Title до 70 символов.
+Ключевая фраза — максимально близко к началу. Должен быть кликабельным, а не формальным.
+Не указывай количество символов в ответе.
+
+✅ Meta Description до 160 символов.
+Должен привлекать пользователя, а не быть техническим. Запрещены любые вводные формулы, в том числе:
+«Узнайте…», «На нашем сайте…», «Мы расскажем…» и любые аналоги на других языках.
+Не указывай количество символов в ответе.
+
+3. Структура статьи (строго соблюдать)
+
+H1 — Заголовок статьи.
+Введение без подзаголовка:
+— короткое, цепляющее, живое;
+— сразу объясняет значимость темы.
+
+Основные разделы с H2:
+— каждый H2 — отдельный смысловой блок;
+— внутри допускаются H3. Если блок H3 состоит из одного предложения, лучше сделать в форме списка;
+— запрещено ставить H3 сразу после H2: между ними обязательно должен быть переходный абзац.
+
+Финальный смысловой блок (без слов «Заключение», «Финальный смысловой блок» или схожих):
+— заголовок должен соотноситься с темой;
+— логично завершает тему;
+— содержит выводы и практические рекомендации.
+
+4. Таблицы и списки
+
+В тексте:
+— минимум 1 таблица;
+— минимум 1 список.
+
+Можно больше, только если это оправдано по смыслу.
+Таблицы и списки должны усиливать материал, а не быть формальностью.
+
+5. Содержание (усиленные требования)
+
+Обязательно использовать:
+— проверенные факты;
+— точные или ориентировочные цифры;
+— реальные примеры.
+
+Обязательно упоминать:
+— актуальные данные;
+— события;
+— изменения и тренды.
+
+Каждый абзац обязан нести практическую пользу.
+
+Добавлять:
+— практические советы;
+— мини-разборы;
+— последствия решений.
+
+Вода полностью запрещена.
+
+❌ Запрещённые примеры:
+«Футбол — очень популярный вид спорта…»
+«Это было величественно и незабываемо…»
+«Это не просто гонки, а нечто большее…»
+«Он показал, что такое настоящий характер…»
+
+6. Анти-ИИ требования
+
+Избегать:
+— одинаковых ритмов предложений;
+— повторяющихся начальных конструкций;
+— шаблонных связок.
+
+Текст должен выглядеть как редакторская аналитика с опытом, а не как генерация.
+
+7. Язык, стиль и подача
+
+Язык: естественный, живой, русский.
+Пояснять так, как для новичка, но без упрощённого примитивизма.
+
+Тон:
+— уверенный;
+— экспертный;
+— спокойный;
+— без заигрывания.
+
+Стиль:
+— аналитический;
+— информативный;
+— редакторский.
+
+Избегать повторов слов.
+
+8. Жёсткие стилистические запреты
+
+Сравнения — не более 1–2 раз за весь текст.
+Минимизировать тире.
+Запрещены конструкции:
+«Спорт — это…»
+
+Запрещено:
+— говорить о заработке на ставках;
+— обещать прибыль, доход, деньги;
+— писать как подросток;
+— писать как мотиватор;
+— писать как рекламный текст.
+
+9. Финальный контроль качества
+
+Перед сдачей текста проверь:
+— нет воды;
+— нет пафоса;
+— нет обещаний заработка;
+— есть факты, цифры, логика;
+— есть таблица и список;
+— нет нейросетевых штампов;
+— текст читается как профессиональная редакторская аналитика.
+
+10. Формат ответа (строго)
+
+Верни ответ строго в формате JSON-объекта со следующими полями верхнего уровня:
+
+- "title": строка — H1 статьи (без HTML-тегов), будет использован как заголовок записи в WordPress.
+- "meta_title": строка — SEO Title
+- "meta_description": строка — SEO Description
+- "slug": строка — человекопонятный URL-слиз (латиницей, через дефисы, без пробелов и спецсимволов)
+- "content_html": строка — ПОЛНЫЙ HTML-код статьи без <html>, <head>, <body>, НО:
+    * СТРОГО БЕЗ тега <h1> внутри контента.
+    * Допускаются только <h2>, <h3>, <p>, <ul>, <ol>, <li>, <table>, <thead>, <tbody>, <tr>, <td>.
+    * без <hr> и любых линий-разделителей.
+- "image_prompt": строка — подробное текстовое описание картинки 1280x720 (16:9), без текста на изображении, для WebP до 100 КБ.
+
+Никакого текста вне JSON.
+"""
+
+
+# =========================
+#   РЕЕСТР
+# =========================
+
+PROMPT_PROFILES: dict[str, PromptProfile] = {}
+
+
+def register_profile(profile: PromptProfile) -> PromptProfile:
+    """Добавляет (или заменяет) профиль в реестре."""
+    if "{topic}" not in profile.user_template:
+        raise ValueError(f"В user_template профиля '{profile.name}' нет {{topic}}")
+    PROMPT_PROFILES[profile.name] = profile
+    return profile
+
+
+def get_prompt_profile(name: str) -> PromptProfile:
+    profile = PROMPT_PROFILES.get(name)
+    if profile is None:
+        raise KeyError(f"Профиль промпта '{name}' не найден в PROMPT_PROFILES")
+    return profile
+
+
+register_profile(PromptProfile(DEFAULT_PROFILE, DEFAULT_SYSTEM_PROMPT))
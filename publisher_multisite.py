@@ -1,247 +1,163 @@
 import os
-import io
+import base64
+import contextvars
+import hashlib
 import json
 import re
-import traceback
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, Optional
 
-def load_topics_from_file(path: str) -> list[str]:
-    """Читает темы из файла: одна строка = одна тема."""
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"Файл с темами не найден: {path}")
 
-    topics = []
-    with open(path, encoding="utf-8") as f:
-        for line in f:
-            t = line.strip()
-            if not t:
-                continue
-            if t.startswith("#"):
-                continue
-            topics.append(t)
+def load_topics_from_file(path: str) -> list[str]:
+    """Читает темы из файла целиком: одна строка = одна тема."""
+    topics = list(iter_topics(path))
 
     if not topics:
         raise RuntimeError(f"Файл {path} прочитан, но тем в нём нет.")
 
     return topics
 
-from typing import Optional
-
-import requests
-from dotenv import load_dotenv
-from PIL import Image
-from openai import OpenAI
-
-from config_multisite import SITES_CONFIG
-
-
-# =========================
-#   ИНИЦИАЛИЗАЦИЯ OpenAI
-# =========================
-
-load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-if not OPENAI_API_KEY:
-    raise RuntimeError("Не указан OPENAI_API_KEY в .env")
-
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-
-# =========================
-#   PROMPT ШАБЛОН
-# =========================
-
-BASE_PROMPT_TEMPLATE = """
-Напиши экспертную SEO-оптимизированную статью по теме:
-[УКАЖИ ТЕМУ]
-
-Ты — журналист и редактор уровня Спорт-Экспресс, Чемпионат.com, Sports.ru, с большим практическим опытом в спорте, ставках и онлайн-казино. Ты пишешь как живой человек, а не как нейросеть, не как научный работник и не как банковский аналитик.
-
-1. Объём и базовые ограничения
-
-Объём статьи: 1000–1500 слов.
-Если текст получается короче 1000 слов — ОБЯЗАТЕЛЬНО расширь каждый смысловой блок,
-добавь примеры, цифры, детали и практические рекомендации, пока объём не превысит 1000 слов.
-
-Это полноценная развернутая SEO-статья, а не краткая справка.
-
-Текст должен:
-— глубоко раскрывать тему,
-— включать несколько смысловых уровней,
-— содержать примеры, цифры, детали,
-— не быть сжатым или обзорным.
-
-Запрещено использовать:
-линии-разделители
-эмодзи
-формальные нейросетевые шаблоны
-пафос, восхваление, абстрактные рассуждения
-рекламный тон
-
-2. SEO-требования (обязательно)
-
-Используй ключевые слова из кластера и LSI-термины естественно, без переспама.
-В конце статьи обязательно добавь:
-✅ Meta Title до 70 символов.
-Ключевая фраза — максимально близко к началу. Должен быть кликабельным, а не формальным.
-Не указывай количество символов в ответе.
-
-✅ Meta Description до 160 символов.
-Должен привлекать пользователя, а не быть техническим. Запрещены любые вводные формулы, в том числе:
-«Узнайте…», «На нашем сайте…», «Мы расскажем…» и любые аналоги на других языках.
-Не указывай количество символов в ответе.
-
-3. Структура статьи (строго соблюдать)
-
-H1 — Заголовок статьи.
-Введение без подзаголовка:
-— короткое, цепляющее, живое;
-— сразу объясняет значимость темы.
-
-Основные разделы с H2:
-— каждый H2 — отдельный смысловой блок;
-— внутри допускаются H3. Если блок H3 состоит из одного предложения, лучше сделать в форме списка;
-— запрещено ставить H3 сразу после H2: между ними обязательно должен быть переходный абзац.
-
-Финальный смысловой блок (без слов «Заключение», «Финальный смысловой блок» или схожих):
-— заголовок должен соотноситься с темой;
-— логично завершает тему;
-— содержит выводы и практические рекомендации.
-
-4. Таблицы и списки
-
-В тексте:
-— минимум 1 таблица;
-— минимум 1 список.
-
-Можно больше, только если это оправдано по смыслу.
-Таблицы и списки должны усиливать материал, а не быть формальностью.
 
-5. Содержание (усиленные требования)
+def topic_shard(topic: str, shards: int) -> int:
+    """Номер шарда темы: стабильный хэш текста, одинаковый на любой машине."""
+    digest = hashlib.blake2b(topic.strip().encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
 
-Обязательно использовать:
-— проверенные факты;
-— точные или ориентировочные цифры;
-— реальные примеры.
 
-Обязательно упоминать:
-— актуальные данные;
-— события;
-— изменения и тренды.
-
-Каждый абзац обязан нести практическую пользу.
-
-Добавлять:
-— практические советы;
-— мини-разборы;
-— последствия решений.
-
-Вода полностью запрещена.
-
-❌ Запрещённые примеры:
-«Футбол — очень популярный вид спорта…»
-«Это было величественно и незабываемо…»
-«Это не просто гонки, а нечто большее…»
-«Он показал, что такое настоящий характер…»
-
-6. Анти-ИИ требования
-
-Избегать:
-— одинаковых ритмов предложений;
-— повторяющихся начальных конструкций;
-— шаблонных связок.
-
-Текст должен выглядеть как редакторская аналитика с опытом, а не как генерация.
+def iter_topics(
+    path: str,
+    shard: int = 0,
+    shards: int = 1,
+    offset: int = 0,
+    limit: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Лениво читает темы из файла, по строке за раз.
+    shard/shards — берутся только темы своего шарда (по хэшу текста), так что
+    несколько процессов или машин делят один файл без пересечений и без
+    координации. offset/limit — окно внутри шарда: пропустить offset тем
+    и выдать не больше limit.
+    """
+    if not 0 <= shard < shards:
+        raise ValueError(f"Неверный шард {shard} из {shards}")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Файл с темами не найден: {path}")
+    return _read_topics(path, shard, shards, offset, limit)
 
-7. Язык, стиль и подача
 
-Язык: естественный, живой, русский.
-Пояснять так, как для новичка, но без упрощённого примитивизма.
+def _read_topics(path, shard, shards, offset, limit) -> Iterator[str]:
+    if limit is not None and limit <= 0:
+        return
 
-Тон:
-— уверенный;
-— экспертный;
-— спокойный;
-— без заигрывания.
+    seen_any = False
+    skipped = 0
+    taken = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            t = line.strip()
+            if not t or t.startswith("#"):
+                continue
+            seen_any = True
+            if shards > 1 and topic_shard(t, shards) != shard:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
 
-Стиль:
-— аналитический;
-— информативный;
-— редакторский.
+            yield t
+            taken += 1
+            if limit is not None and taken >= limit:
+                return
 
-Избегать повторов слов.
+    if not seen_any:
+        print(f"[WARN] Файл {path} прочитан, но тем в нём нет.")
 
-8. Жёсткие стилистические запреты
 
-Сравнения — не более 1–2 раз за весь текст.
-Минимизировать тире.
-Запрещены конструкции:
-«Спорт — это…»
+from config_multisite import SITES_CONFIG
+import article_sections
+from article_stream import stream_article_completion
+from content_cache import cache_key, get_content_cache
+from html_sanitizer import HtmlReport, sanitize_html
+from image_transcode import FEATURED, Variant, site_variants, transcode
+from link_index import get_link_index, insert_links
+from media_cache import get_media_cache
+from metrics import get_metrics
+from post_index import IndexedPost, get_post_index
+from prompts import get_prompt_profile
+from rate_limit import openai_event_hooks
+from wp_client import get_download_session, get_wp_client
 
-Запрещено:
-— говорить о заработке на ставках;
-— обещать прибыль, доход, деньги;
-— писать как подросток;
-— писать как мотиватор;
-— писать как рекламный текст.
 
-9. Финальный контроль качества
+# =========================
+#   ИНИЦИАЛИЗАЦИЯ OpenAI
+# =========================
 
-Перед сдачей текста проверь:
-— нет воды;
-— нет пафоса;
-— нет обещаний заработка;
-— есть факты, цифры, логика;
-— есть таблица и список;
-— нет нейросетевых штампов;
-— текст читается как профессиональная редакторская аналитика.
+# Пакет openai и клиент подгружаются при первом обращении к модели:
+# команды без генерации и дочерние процессы стартуют без ключа и мгновенно.
+_client = None
+_client_lock = threading.Lock()
+
+# SDK сам повторяет 429/5xx с паузой по retry-after; по умолчанию всего 2 раза
+OPENAI_MAX_RETRIES = 5
+
+
+def get_openai_client():
+    """Общий клиент OpenAI (создаётся при первом вызове)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from dotenv import load_dotenv
+            from openai import DefaultHttpxClient, OpenAI
+
+            load_dotenv()
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                raise RuntimeError("Не указан OPENAI_API_KEY в .env")
+            # хуки httpx срабатывают на каждой попытке, включая повторы SDK:
+            # все воркеры делят один ограничитель по лимитам из x-ratelimit-*
+            _client = OpenAI(
+                api_key=api_key,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=DefaultHttpxClient(event_hooks=openai_event_hooks()),
+            )
+        return _client
 
-10. Формат ответа (строго)
 
-Верни ответ строго в формате JSON-объекта со следующими полями верхнего уровня:
+TEXT_MODEL = "gpt-5.1"
+TEXT_TEMPERATURE = 0.55
 
-- "title": строка — H1 статьи (без HTML-тегов), будет использован как заголовок записи в WordPress.
-- "meta_title": строка — SEO Title
-- "meta_description": строка — SEO Description
-- "slug": строка — человекопонятный URL-слиз (латиницей, через дефисы, без пробелов и спецсимволов)
-- "content_html": строка — ПОЛНЫЙ HTML-код статьи без <html>, <head>, <body>, НО:
-    * СТРОГО БЕЗ тега <h1> внутри контента.
-    * Допускаются только <h2>, <h3>, <p>, <ul>, <ol>, <li>, <table>, <thead>, <tbody>, <tr>, <td>.
-    * без <hr> и любых линий-разделителей.
-- "image_prompt": строка — подробное текстовое описание картинки 1280x720 (16:9), без текста на изображении, для WebP до 100 КБ.
+# Обязательные ключи JSON-ответа модели
+ARTICLE_KEYS = (
+    "title",
+    "meta_title",
+    "meta_description",
+    "slug",
+    "content_html",
+    "image_prompt",
+)
 
-Никакого текста вне JSON.
-"""
+# В потоковом режиме попытка обрывается, если content_html закрылся
+# короче min_words * STREAM_SHORT_RATIO
+STREAM_SHORT_RATIO = 0.6
 
+# Генерация по разделам: сколько разделов статьи пишется одновременно
+# и сколько раз повторять план или раздел с битым ответом
+SECTION_WORKERS = 6
+SECTION_RETRIES = 2
 
-def build_system_prompt(topic: str, prompt_profile: str) -> str:
-    """
-    На будущее можно развести под разные сайты через prompt_profile.
-    Пока просто подставляем тему в базовый шаблон.
-    """
-    prompt = BASE_PROMPT_TEMPLATE.replace("[УКАЖИ ТЕМУ]", topic.strip())
-    return prompt
+IMAGE_MODEL = "gpt-image-1"
+IMAGE_SIZE = "1536x1024"  # ближайший к 16:9 размер gpt-image-1
+# размеры, форматы и лимиты байт вариантов обложки — image_transcode.py
+# Потоки для обложек, запущенных заранее по плану статьи (prefetch_image)
+IMAGE_PREFETCH_WORKERS = 2
 
 
 def normalize_content_html(html: str) -> str:
     """Удаляем H1 из контента на всякий случай и приводим к чистому HTML без лишнего заголовка."""
-    if not isinstance(html, str):
-        html = str(html)
-
-    # убираем ведущий <h1>...</h1>, если он стоит первым блоком
-    html = re.sub(
-        r'^\\s*<h1[^>]*>.*?</h1>\\s*',
-        '',
-        html,
-        count=1,
-        flags=re.IGNORECASE | re.DOTALL,
-    )
-
-    # если где-то ещё остался <h1> — превращаем его в <h2>
-    html = re.sub(r'<h1([^>]*)>', r'<h2\\1>', html, flags=re.IGNORECASE)
-    html = re.sub(r'</h1>', '</h2>', html, flags=re.IGNORECASE)
-
-    return html
+    return sanitize_html(html).html
 
 
 def generate_slug_from_topic(topic: str, max_length: int = 60, max_words: int = 5) -> str:
@@ -254,8 +170,6 @@ def generate_slug_from_topic(topic: str, max_length: int = 60, max_words: int =
     - чистим,
     - режем по длине.
     """
-    import re
-
     # 1) к нижнему регистру и обрезаем края
     topic = (topic or "").lower().strip()
 
@@ -314,75 +228,289 @@ def generate_article(
     topic: str,
     prompt_profile: str,
     min_words: int = 1000,
-    max_retries: int = 3
+    max_retries: int = 3,
+    use_cache: bool = True,
+    stream: bool = False,
+    speculative: int = 0,
+    hedge_after: Optional[float] = None,
+    sections: bool = False,
+    on_outline: Optional[Callable[[dict], None]] = None,
+    repair: bool = False,
 ) -> dict:
     """
     Генерация статьи с приоритетом длины.
     Пытаемся до max_retries раз получить текст не короче min_words.
     Если не получилось — возвращаем самую длинную из удачных попыток.
+    Готовая статья кэшируется на диске: повторный прогон той же темы
+    (например, после падения WP) не вызывает модель.
+    stream=True — ответ читается потоком, и заведомо негодная попытка
+    обрывается досрочно (см. article_stream.py).
+    speculative=K и/или hedge_after=секунды — вместо последовательных
+    попыток запускаем K кандидатов параллельно (и ещё один, если за
+    hedge_after ни один не подошёл), берём первый годный.
+    sections=True — сначала план, затем H2-разделы параллельно
+    (article_sections.py); on_outline(meta) вызывается, как только готов
+    план, — например, чтобы заранее запустить обложку. Если по разделам
+    не получилось, статья генерируется обычным способом.
+    repair=True — валидную, но короткую статью (или без таблицы/списка)
+    не генерируем заново, а дописываем самые тонкие разделы (досборка,
+    см. article_sections.plan_repairs).
+    """
+    key = article_cache_key(topic, prompt_profile)
+    if use_cache:
+        cached = get_content_cache().get_article(key)
+        get_metrics().inc("cache_requests_total", kind="article", result="miss" if cached is None else "hit")
+        if cached is not None:
+            print(f"[DEBUG] Статья для темы {topic!r} взята из кэша")
+            return cached
+
+    article = None
+    if sections:
+        try:
+            article = _generate_article_sections(topic, prompt_profile, min_words, on_outline, repair)
+        except Exception as e:
+            print(f"[WARN] Генерация по разделам не удалась ({e}), генерирую статью целиком")
+            get_metrics().inc("retries_total", source="article", reason="sections_failed")
+
+    if article is None and (speculative or hedge_after):
+        article = _generate_article_speculative(
+            topic, prompt_profile, min_words, max(speculative, 1), hedge_after, repair, max_retries
+        )
+    elif article is None:
+        article = _generate_article_uncached(
+            topic, prompt_profile, min_words, max_retries, stream, repair
+        )
+    if use_cache:
+        get_content_cache().put_article(key, article)
+    return article
+
+
+def article_cache_key(topic: str, prompt_profile: str) -> str:
+    """Ключ кэша статьи: всё, от чего зависит ответ модели."""
+    return cache_key(
+        "article",
+        topic.strip(),
+        prompt_profile,
+        get_prompt_profile(prompt_profile).fingerprint,
+        TEXT_MODEL,
+        TEXT_TEMPERATURE,
+    )
+
+
+def build_article_request(topic: str, prompt_profile: str) -> dict:
+    """
+    Параметры chat.completions.create для генерации статьи.
+    Инструкция профиля — неизменный префикс, тема — последним сообщением
+    (см. prompts.py), чтобы у OpenAI срабатывал кэш префикса.
     """
-    system_prompt = build_system_prompt(topic, prompt_profile)
+    profile = get_prompt_profile(prompt_profile)
+    return {
+        "model": TEXT_MODEL,
+        "response_format": {"type": "json_object"},
+        "temperature": TEXT_TEMPERATURE,
+        # один ключ на профиль: запросы с общим префиксом идут туда, где он уже в кэше
+        "prompt_cache_key": f"article-{profile.name}-{profile.fingerprint}",
+        "messages": profile.messages(topic),
+    }
+
+
+def parse_article(raw: str, attempt: int = 1) -> Optional[tuple[dict, HtmlReport]]:
+    """
+    Разбирает и проверяет ответ модели: валидный JSON и все ARTICLE_KEYS.
+    Возвращает статью с очищенным content_html и отчёт санитайзера
+    (объём видимого текста, таблицы, списки, заголовки) или None.
+    """
+    # Парсим JSON
+    try:
+        data = json.loads(raw)
+    except (TypeError, json.JSONDecodeError) as e:
+        print(f"[WARN] Невалидный JSON на попытке #{attempt}: {e}")
+        return None
+
+    # Проверяем обязательные ключи
+    missing = [k for k in ARTICLE_KEYS if k not in data]
+    if missing:
+        print(f"[WARN] На попытке #{attempt} отсутствуют ключи: {missing}")
+        return None
+
+    # Нормализуем контент за один проход: белый список тегов, без H1,
+    # заодно считаем видимые слова и структуру
+    report = sanitize_html(data["content_html"])
+    data["content_html"] = report.html
+    data["word_count"] = report.word_count
+    return data, report
+
+
+def _reject_reasons(report: HtmlReport, min_words: int) -> list[str]:
+    """Причины отказа попытке — короткие метки для метрик (см. HtmlReport.problems)."""
+    reasons = []
+    if report.word_count < min_words:
+        reasons.append("short")
+    if report.tables < 1:
+        reasons.append("no_table")
+    if report.lists < 1:
+        reasons.append("no_list")
+    if report.heading_issues:
+        reasons.append("headings")
+    return reasons
+
+
+def _record_text_usage(
+    request: dict,
+    attempt: int,
+    prompt_tokens: Optional[int],
+    completion_tokens: Optional[int],
+    cached_tokens: Optional[int],
+) -> None:
+    print(
+        f"[DEBUG] Токены попытки #{attempt}: вход {prompt_tokens} "
+        f"(из кэша {cached_tokens or 0}), выход {completion_tokens}"
+    )
+    get_metrics().record_usage(
+        request["model"], prompt_tokens, completion_tokens, cached_tokens, attempt=attempt
+    )
+
+
+def _chat_completion(request: dict, attempt: int, op: str = "chat") -> str:
+    """Обычный (не потоковый) вызов модели с учётом времени и токенов; текст ответа."""
+    with get_metrics().timer("openai_seconds", op=op):
+        response = get_openai_client().chat.completions.create(**request)
+    usage = response.usage
+    if usage is not None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        _record_text_usage(
+            request,
+            attempt,
+            usage.prompt_tokens,
+            usage.completion_tokens,
+            getattr(details, "cached_tokens", None),
+        )
+    return response.choices[0].message.content
+
+
+def _article_attempt(
+    request: dict,
+    attempt: int,
+    min_words: int,
+    stream: bool = False,
+    short_ratio: float = STREAM_SHORT_RATIO,
+    cancel: Optional[threading.Event] = None,
+) -> tuple[Optional[dict], Optional[HtmlReport], Optional[str]]:
+    """Одна попытка генерации: (статья или None, отчёт санитайзера, сырой ответ)."""
+    metrics = get_metrics()
+    if stream:
+        with metrics.timer("openai_seconds", op="chat_stream"):
+            result = stream_article_completion(
+                get_openai_client(),
+                request,
+                min_words,
+                ARTICLE_KEYS,
+                short_ratio=short_ratio,
+                cancel=cancel,
+            )
+        ttft = f"{result.ttft:.1f} с" if result.ttft is not None else "—"
+        print(
+            f"[DEBUG] Поток #{attempt}: первый токен через {ttft}, "
+            f"{result.tokens_per_sec:.0f} ток/с, {result.elapsed:.1f} с всего"
+        )
+        if result.ttft is not None:
+            metrics.observe("openai_ttft_seconds", result.ttft, op="chat_stream")
+        # у оборванного потока usage не приходит — такие токены не учитываются
+        if result.prompt_tokens is not None or result.completion_tokens is not None:
+            _record_text_usage(
+                request, attempt, result.prompt_tokens, result.completion_tokens, result.cached_tokens
+            )
+        if result.aborted:
+            print(f"[WARN] Попытка #{attempt} оборвана досрочно: {result.aborted}")
+            metrics.inc("article_attempts_total", result="aborted")
+            metrics.event("attempt", attempt=attempt, result="aborted", reason=result.aborted)
+            return None, None, result.raw
+        raw = result.raw
+    else:
+        raw = _chat_completion(request, attempt)
+
+    parsed = parse_article(raw, attempt)
+    if parsed is None:
+        metrics.inc("article_attempts_total", result="invalid")
+        metrics.inc("retries_total", source="article", reason="invalid")
+        metrics.event("attempt", attempt=attempt, result="invalid")
+        return None, None, raw
+
+    data, report = parsed
+    reasons = _reject_reasons(report, min_words)
+    metrics.inc("article_attempts_total", result="rejected" if reasons else "ok")
+    for reason in reasons:
+        metrics.inc("retries_total", source="article", reason=reason)
+    metrics.observe("article_words", report.word_count)
+    metrics.event(
+        "attempt",
+        attempt=attempt,
+        result="rejected" if reasons else "ok",
+        words=report.word_count,
+        tables=report.tables,
+        lists=report.lists,
+        problems=report.problems(min_words),
+    )
+    print(
+        f"[DEBUG] Попытка #{attempt}: {report.word_count} слов, "
+        f"таблиц {report.tables}, списков {report.lists}, H2 {report.h2}, H3 {report.h3}"
+    )
+    return data, report, raw
+
+
+def _generate_article_uncached(
+    topic: str,
+    prompt_profile: str,
+    min_words: int,
+    max_retries: int,
+    stream: bool = False,
+    repair: bool = False,
+) -> dict:
+    request = build_article_request(topic, prompt_profile)
 
     last_raw = None
     best_data = None
     best_wc = 0
+    repaired = False
 
     for attempt in range(1, max_retries + 1):
         print(f"[DEBUG] Попытка генерации текста #{attempt} для темы: {topic!r}")
 
-        response = client.chat.completions.create(
-            model="gpt-5.1",
-            response_format={"type": "json_object"},
-            temperature=0.55,
-            messages=[
-                {"role": "system", "content": system_prompt},
-            ],
+        # на последней попытке без запасного варианта не обрываем поток
+        # по длине — короткая статья лучше, чем никакой
+        last_chance = attempt == max_retries and best_data is None
+        data, report, last_raw = _article_attempt(
+            request,
+            attempt,
+            min_words,
+            stream=stream,
+            short_ratio=0.0 if last_chance else STREAM_SHORT_RATIO,
         )
-
-        raw = response.choices[0].message.content
-        last_raw = raw
-
-        # Парсим JSON
-        try:
-            data = json.loads(raw)
-        except json.JSONDecodeError as e:
-            print(f"[WARN] Невалидный JSON на попытке #{attempt}: {e}")
-            continue
-
-        # Проверяем обязательные ключи
-        required_keys = [
-            "title",
-            "meta_title",
-            "meta_description",
-            "slug",
-            "content_html",
-            "image_prompt",
-        ]
-        missing = [k for k in required_keys if k not in data]
-        if missing:
-            print(f"[WARN] На попытке #{attempt} отсутствуют ключи: {missing}")
+        if data is None:
             continue
 
-        # Нормализуем контент (убираем H1 и т.п.)
-        data["content_html"] = normalize_content_html(data["content_html"])
-
-        # Проверяем объём
-        wc = len(str(data["content_html"]).split())
-        print(f"[DEBUG] Объём текста на попытке #{attempt}: {wc} слов")
+        problems = report.problems(min_words)
+        # почти годную статью дописываем, а не генерируем заново (один раз)
+        if problems and repair and not repaired:
+            repaired = True
+            fixed = _repair_article(topic, prompt_profile, data, report, min_words)
+            if fixed is not None:
+                data, report = fixed
+                problems = report.problems(min_words)
 
         # обновляем "лучшую" попытку
-        if wc > best_wc:
-            best_wc = wc
+        if report.word_count > best_wc:
+            best_wc = report.word_count
             best_data = data
 
-        if wc < min_words:
+        if problems:
             print(
-                f"[WARN] Текст слишком короткий ({wc} слов, минимум {min_words}), "
+                f"[WARN] Текст не прошёл проверку ({'; '.join(problems)}), "
                 f"пробую сгенерировать заново…"
             )
             continue
 
-        # Всё ОК — достаточно длинный текст
+        # Всё ОК — достаточно длинный текст с нужной структурой
         return data
 
     # Если сюда дошли — ни одна попытка не достигла min_words
@@ -400,92 +528,513 @@ def generate_article(
     return best_data
 
 
+def _generate_article_sections(
+    topic: str,
+    prompt_profile: str,
+    min_words: int,
+    on_outline: Optional[Callable[[dict], None]] = None,
+    repair: bool = False,
+) -> dict:
+    """План одним запросом, затем все H2-разделы параллельно; сборка по порядку плана."""
+    profile = get_prompt_profile(prompt_profile)
+    base = build_article_request(topic, prompt_profile)
+    metrics = get_metrics()
+
+    outline = None
+    for attempt in range(1, SECTION_RETRIES + 1):
+        request = {
+            **base,
+            "messages": profile.outline_messages(topic, article_sections.target_words(min_words)),
+        }
+        outline = article_sections.parse_outline(
+            _chat_completion(request, attempt, op="outline"), min_words
+        )
+        if outline is not None:
+            break
+        metrics.inc("retries_total", source="article", reason="outline_invalid")
+    if outline is None:
+        raise RuntimeError(f"нет валидного плана за {SECTION_RETRIES} попыток")
+
+    print(
+        f"[DEBUG] План: {len(outline.sections)} разделов, "
+        f"{sum(s.words for s in outline.sections)} слов"
+    )
+    if on_outline is not None:
+        try:
+            on_outline(outline.meta)
+        except Exception as e:
+            print(f"[WARN] on_outline: {e}")
+
+    def write(section: article_sections.Section) -> str:
+        request = {**base, "messages": article_sections.section_messages(profile, topic, outline, section)}
+        for attempt in range(1, SECTION_RETRIES + 1):
+            body = article_sections.parse_section(_chat_completion(request, attempt, op="section"))
+            if body is not None:
+                return body
+            metrics.inc("retries_total", source="article", reason="section_invalid")
+        raise RuntimeError(f"нет валидного текста раздела {section.h2!r}")
+
+    workers = min(SECTION_WORKERS, len(outline.sections))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="section") as pool:
+        # метки сайта и темы (contextvars) переносим в потоки разделов
+        futures = [
+            pool.submit(contextvars.copy_context().run, write, section)
+            for section in outline.sections
+        ]
+        bodies = [f.result() for f in futures]
+
+    report = sanitize_html(article_sections.assemble(outline, bodies))
+    data = {**outline.meta, "content_html": report.html, "word_count": report.word_count}
+
+    problems = report.problems(min_words)
+    metrics.observe("article_words", report.word_count)
+    metrics.event(
+        "sections",
+        sections=len(outline.sections),
+        words=report.word_count,
+        tables=report.tables,
+        lists=report.lists,
+        problems=problems,
+    )
+    print(
+        f"[DEBUG] Статья из {len(bodies)} разделов: {report.word_count} слов, "
+        f"таблиц {report.tables}, списков {report.lists}"
+    )
+    if problems:
+        print(f"[WARN] Статья по разделам не прошла проверку: {'; '.join(problems)}")
+        if repair:
+            fixed = _repair_article(topic, prompt_profile, data, report, min_words)
+            if fixed is not None:
+                data = fixed[0]
+    return data
+
+
+def _repair_article(
+    topic: str,
+    prompt_profile: str,
+    data: dict,
+    report: HtmlReport,
+    min_words: int,
+) -> Optional[tuple[dict, HtmlReport]]:
+    """
+    Досборка валидной статьи, не прошедшей проверку: самые тонкие H2
+    дописываются параллельно (и в них же добавляются недостающие таблица
+    и список), новый текст вклеивается в конец разделов. Запросы несут
+    обычный запрос статьи и её ответ — общий кэшированный префикс, а на
+    выходе только добавки. None — досборка невозможна или не удалась;
+    тогда вызывающий поступает как раньше.
+    """
+    repairs = article_sections.plan_repairs(report, min_words)
+    if not repairs:
+        return None
+
+    profile = get_prompt_profile(prompt_profile)
+    base = build_article_request(topic, prompt_profile)
+    article_raw = json.dumps({k: data[k] for k in ARTICLE_KEYS}, ensure_ascii=False)
+    metrics = get_metrics()
+    print(
+        f"[DEBUG] Досборка: {len(repairs)} разд., "
+        f"+{sum(r.words for r in repairs)} слов к {report.word_count}"
+    )
+
+    def write(r: article_sections.Repair) -> str:
+        request = {**base, "messages": article_sections.repair_messages(profile, topic, article_raw, r)}
+        for attempt in range(1, SECTION_RETRIES + 1):
+            body = article_sections.parse_section(_chat_completion(request, attempt, op="repair"))
+            if body is not None:
+                return body
+            metrics.inc("retries_total", source="article", reason="repair_invalid")
+        raise RuntimeError(f"нет валидной добавки к разделу {r.h2!r}")
+
+    with ThreadPoolExecutor(max_workers=min(SECTION_WORKERS, len(repairs)), thread_name_prefix="repair") as pool:
+        futures = [pool.submit(contextvars.copy_context().run, write, r) for r in repairs]
+        try:
+            additions = [f.result() for f in futures]
+        except Exception as e:
+            print(f"[WARN] Досборка не удалась: {e}")
+            metrics.inc("article_repairs_total", result="failed")
+            return None
+
+    fixed = sanitize_html(article_sections.apply_repairs(report.html, repairs, additions))
+    problems = fixed.problems(min_words)
+    metrics.inc("article_repairs_total", result="rejected" if problems else "ok")
+    metrics.event(
+        "repair",
+        sections=len(repairs),
+        words_before=report.word_count,
+        words=fixed.word_count,
+        tables=fixed.tables,
+        lists=fixed.lists,
+        problems=problems,
+    )
+    print(
+        f"[DEBUG] После досборки: {fixed.word_count} слов, "
+        f"таблиц {fixed.tables}, списков {fixed.lists}"
+    )
+    return {**data, "content_html": fixed.html, "word_count": fixed.word_count}, fixed
+
+
+def _generate_article_speculative(
+    topic: str,
+    prompt_profile: str,
+    min_words: int,
+    candidates: int,
+    hedge_after: Optional[float] = None,
+    repair: bool = False,
+    max_attempts: int = 3,
+) -> dict:
+    """
+    Спекулятивная генерация: candidates запросов сразу, плюс один
+    страхующий, если за hedge_after секунд годного ответа ещё нет.
+    Первый кандидат с нужными ключами и объёмом побеждает, остальные
+    потоки обрываются. Вместо упавшего или невалидного кандидата (и
+    короткого, если нет repair) запускается новый, пока не исчерпан
+    бюджет: max_attempts запусков, но не меньше кандидатов со страхующим. Если никто не дотянул до min_words — берём
+    самый длинный валидный (с repair=True — дописанный), как и в
+    последовательном режиме. Кандидаты всегда идут потоком, иначе их
+    нельзя отменить.
+    """
+    request = build_article_request(topic, prompt_profile)
+    cancel = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=candidates + 1, thread_name_prefix="candidate")
+
+    def launch(n: int):
+        print(f"[DEBUG] Кандидат #{n} для темы: {topic!r}")
+        # по длине не обрываем: короткий кандидат может оказаться лучшим;
+        # контекст копируется, чтобы метрики кандидата несли сайт и тему
+        return pool.submit(
+            contextvars.copy_context().run,
+            _article_attempt, request, n, min_words, True, 0.0, cancel,
+        )
+
+    futures = {launch(n): n for n in range(1, candidates + 1)}
+    launched = candidates
+    # страхующий кандидат — сверх кандидатов, но в том же бюджете
+    budget = max(max_attempts, candidates + (hedge_after is not None))
+    hedged = hedge_after is None
+    deadline = time.monotonic() + (hedge_after or 0)
+
+    last_raw = None
+    best_data = None
+    best_report = None
+    best_wc = 0
+
+    try:
+        while futures:
+            timeout = None if hedged else max(0.0, deadline - time.monotonic())
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                hedged = True
+                if launched < budget:
+                    launched += 1
+                    print(f"[DEBUG] За {hedge_after} с ответа нет — запускаю страхующий кандидат #{launched}")
+                    futures[launch(launched)] = launched
+                continue
+
+            for f in done:
+                n = futures.pop(f)
+                try:
+                    data, report, raw = f.result()
+                except Exception as e:
+                    print(f"[WARN] Кандидат #{n} упал: {e}")
+                    data = None
+                else:
+                    last_raw = raw or last_raw
+
+                if data is not None:
+                    if report.word_count > best_wc:
+                        best_wc = report.word_count
+                        best_data = data
+                        best_report = report
+
+                    if not report.problems(min_words):
+                        if futures:
+                            print(f"[DEBUG] Кандидат #{n} принят, остальные отменяются")
+                        return data
+
+                # негодный кандидат заменяем, пока не исчерпаны попытки;
+                # короткий с repair не заменяем — его дешевле дописать
+                if launched < budget and (data is None or not repair):
+                    launched += 1
+                    print(f"[DEBUG] Кандидат #{n} не подошёл — запускаю кандидата #{launched}")
+                    futures[launch(launched)] = launched
+    finally:
+        cancel.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if best_data is None:
+        raise RuntimeError(
+            f"Не удалось получить валидную статью для темы {topic!r} "
+            f"ни от одного кандидата. Последний сырой ответ модели:\n{last_raw}"
+        )
+
+    if repair:
+        fixed = _repair_article(topic, prompt_profile, best_data, best_report, min_words)
+        if fixed is not None:
+            best_data, best_report = fixed
+            best_wc = best_report.word_count
+            if not best_report.problems(min_words):
+                return best_data
+
+    print(
+        f"[WARN] Ни один кандидат не достиг {min_words} слов. "
+        f"Использую лучшую версию на {best_wc} слов."
+    )
+    return best_data
+
+
 # =========================
 #   IMAGE GENERATION
 # =========================
 
-def generate_image(image_prompt: str, out_path: str) -> str:
+def image_cache_key(image_prompt: str, variant: Optional[Variant] = None) -> str:
+    """Ключ готовой картинки в кэше контента: промпт и параметры варианта (по умолчанию featured)."""
+    variant = variant or site_variants(())[0]
+    parts = [image_prompt, IMAGE_MODEL, IMAGE_SIZE, variant.width, variant.height, variant.max_bytes]
+    if variant.name != FEATURED:
+        # ключ featured остаётся прежним — старый кэш обложек годится
+        parts += [variant.name, variant.format]
+    return cache_key("image", *parts)
+
+
+def site_image_variants(site_key: str) -> list[Variant]:
+    """featured и дополнительные варианты обложки сайта (image_variants в SITES_CONFIG)."""
+    return site_variants(SITES_CONFIG.get(site_key, {}).get("image_variants"))
+
+
+def generate_image(
+    image_prompt: str,
+    use_cache: bool = True,
+    variants: Optional[list[Variant]] = None,
+) -> bytes:
     """
-    Генерация изображения через gpt-image-1.
+    Генерация изображения через gpt-image-1, целиком в памяти.
     Если в организации нет доступа к модели — вызывающий код должен ловить исключение.
+    Возвращает featured — WebP 1280x720 до 100 КБ. Обрезка и кодирование
+    всех вариантов (variants, первый — featured) идут в пуле процессов
+    (image_transcode.py); готовые байты кэшируются по тексту промпта,
+    дополнительные варианты оттуда забирает publish_image_variants.
+    Если featured уже в кэше, недостающие варианты делаются из него.
     """
-    img = client.images.generate(
-        model="gpt-image-1",
-        prompt=image_prompt,
-        size="1024x1024",
-    )
+    variants = variants or site_variants(())
+    cache = get_content_cache()
+    metrics = get_metrics()
+
+    featured = None
+    if use_cache:
+        featured = cache.get_image(image_cache_key(image_prompt))
+        metrics.inc("cache_requests_total", kind="image", result="miss" if featured is None else "hit")
+    missing = [
+        v for v in variants[1:]
+        if featured is None or cache.get_image(image_cache_key(image_prompt, v), v.ext) is None
+    ]
+    if featured is not None:
+        print("[DEBUG] Картинка взята из кэша")
+        if missing:
+            _transcode_variants(image_prompt, featured, missing)
+        return featured
+
+    with metrics.timer("openai_seconds", op="image"):
+        img = get_openai_client().images.generate(
+            model=IMAGE_MODEL,
+            prompt=image_prompt,
+            size=IMAGE_SIZE,
+        )
+    usage = getattr(img, "usage", None)
+    if usage is not None:
+        metrics.record_usage(IMAGE_MODEL, usage.input_tokens, usage.output_tokens)
+
+    # gpt-image-1 отдаёт картинку сразу в base64; URL — только запасной вариант
+    item = img.data[0]
+    if getattr(item, "b64_json", None):
+        raw = base64.b64decode(item.b64_json)
+    else:
+        resp = get_download_session().get(item.url, timeout=60)
+        if resp.status_code != 200:
+            raise RuntimeError(f"Не удалось скачать картинку, статус {resp.status_code}")
+        raw = resp.content
+
+    # Приводим к размерам вариантов (обрезка по центру), featured — 16:9, как просит промпт
+    encoded = _transcode_variants(image_prompt, raw, [variants[0], *missing])
+    data = encoded[FEATURED].data
+    if use_cache:
+        cache.put_image(image_cache_key(image_prompt), data)
+    return data
+
+
+def _transcode_variants(image_prompt: str, source: bytes, variants: list[Variant]) -> dict:
+    """
+    Варианты картинки в пуле процессов; метрики по каждому.
+    Дополнительные варианты сразу кладутся в кэш контента.
+    """
+    metrics = get_metrics()
+    with metrics.timer("image_process_seconds", op="transcode"):
+        encoded = transcode(source, variants)
+
+    for v in variants:
+        enc = encoded[v.name]
+        metrics.observe("image_process_seconds", enc.seconds, op=v.name)
+        metrics.observe("webp_encodes", enc.encodes, variant=v.name)
+        metrics.observe("image_bytes", len(enc.data), variant=v.name)
+        metrics.event(
+            "image",
+            variant=v.name,
+            bytes=len(enc.data),
+            quality=enc.quality,
+            encodes=enc.encodes,
+            seconds=round(enc.seconds, 3),
+        )
+        print(
+            f"[DEBUG] {v.name} {v.format} {v.width}x{v.height}: {len(enc.data)} байт, "
+            f"качество {enc.quality}, кодирований: {enc.encodes}, {enc.seconds:.2f} с"
+        )
+        if v.name != FEATURED:
+            get_content_cache().put_image(image_cache_key(image_prompt, v), enc.data, v.ext)
+    return encoded
+
 
-    image_url = img.data[0].url
+_prefetch_pool: Optional[ThreadPoolExecutor] = None
+_prefetched: dict[str, Future] = {}
+_prefetch_lock = threading.Lock()
 
-    resp = requests.get(image_url)
-    if resp.status_code != 200:
-        raise RuntimeError(f"Не удалось скачать картинку, статус {resp.status_code}")
 
-    image = Image.open(io.BytesIO(resp.content)).convert("RGB")
+def prefetch_image(site_key: str, image_prompt: str) -> None:
+    """
+    Запускает генерацию обложки в фоне, пока пишется текст (в режиме по
+    разделам image_prompt известен уже из плана). Результат забирает
+    prepare_image. Если обложку можно взять готовую (reuse_similar_image) —
+    ничего не делает.
+    """
+    global _prefetch_pool
+    if get_media_cache(site_key).similar(image_prompt) is not None:
+        return
+    with _prefetch_lock:
+        if image_prompt in _prefetched:
+            return
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(
+                max_workers=IMAGE_PREFETCH_WORKERS, thread_name_prefix="image-prefetch"
+            )
+        _prefetched[image_prompt] = _prefetch_pool.submit(
+            contextvars.copy_context().run,
+            generate_image, image_prompt, True, site_image_variants(site_key),
+        )
+    print(f"[{site_key}] Обложка генерируется заранее, по плану статьи")
+
 
-    # Сохраняем в WebP и сжимаем до <= 100 КБ
-    quality = 80
-    image.save(out_path, format="WEBP", quality=quality)
+def take_prefetched_image(image_prompt: str) -> Optional[Future]:
+    """Future обложки, запущенной prefetch_image, или None."""
+    with _prefetch_lock:
+        return _prefetched.pop(image_prompt, None)
 
-    while os.path.getsize(out_path) > 100_000 and quality > 40:
-        quality -= 5
-        image.save(out_path, format="WEBP", quality=quality)
 
-    return out_path
+def reuse_similar_image(site_key: str, image_prompt: str) -> Optional[bytes]:
+    """
+    Обложка, уже загруженная на сайт по почти такому же промпту
+    (порог image_reuse_threshold сайта), или None. Байты берутся из кэша
+    контента — при загрузке они совпадут по хэшу и получат тот же media_id.
+    """
+    media = get_media_cache(site_key)
+    if media.threshold is None:
+        return None
+
+    found = media.similar(image_prompt)
+    data = None
+    if found is not None:
+        entry, similarity = found
+        data = get_content_cache().get_image(entry.image_key)
+    get_metrics().inc("cache_requests_total", kind="image_similar", result="miss" if data is None else "hit")
+    if data is not None:
+        print(
+            f"[{site_key}] Обложка медиа {entry.media_id}: промпт похож "
+            f"на {entry.prompt[:80]!r} ({similarity:.2f})"
+        )
+    return data
 
 
 # =========================
 #   WORDPRESS HELPERS
 # =========================
 
-def upload_media(site_key: str, image_path: str) -> int:
-    cfg = SITES_CONFIG[site_key]
-    wp_url = cfg["wp_url"].rstrip("/")
-    username = cfg["username"]
-    app_password = cfg["app_password"]
-
-    endpoint = f"{wp_url}/wp-json/wp/v2/media"
+def upload_media(
+    site_key: str,
+    image_data: bytes,
+    filename: str,
+    mime: str = "image/webp",
+) -> int:
+    wp = get_wp_client(site_key)
 
-    filename = os.path.basename(image_path)
-    with open(image_path, "rb") as f:
-        files = {
-            "file": (filename, f, "image/webp"),
-        }
-        data = {
-            "title": filename,
-            "status": "inherit",
-        }
+    files = {
+        "file": (filename, image_data, mime),
+    }
+    data = {
+        "title": filename,
+        "status": "inherit",
+    }
 
-        resp = requests.post(
-            endpoint,
-            auth=(username, app_password),
-            files=files,
-            data=data,
-            timeout=60,
-        )
+    resp = wp.post("wp/v2/media", files=files, data=data)
 
     if resp.status_code not in (200, 201):
         raise RuntimeError(
             f"[{site_key}] Ошибка загрузки медиа в WP: {resp.status_code} {resp.text}"
         )
+    get_metrics().inc("uploaded_bytes_total", len(image_data))
 
     j = resp.json()
     return int(j["id"])
 
 
-def create_post(
+def add_internal_links(
+    site_key: str,
+    article: dict,
+    status: str,
+    exclude: Optional[int] = None,
+) -> str:
+    """
+    content_html со ссылками на похожие статьи сайта (link_index.py), не
+    больше internal_links. Опубликованная запись ссылается только на
+    опубликованные, черновик — на любые: черновики выходят пачками.
+    """
+    html = article["content_html"]
+    limit = int(SITES_CONFIG[site_key].get("internal_links") or 0)
+    if limit <= 0:
+        return html
+
+    metrics = get_metrics()
+    with metrics.timer("internal_links_seconds"):
+        related = get_link_index(site_key).related(
+            article["title"],
+            html,
+            limit=limit,
+            exclude=[exclude] if exclude else (),
+            statuses=("publish",) if status == "publish" else None,
+            alive=lambda post_id: get_post_index(site_key).by_id(post_id) is not None,
+        )
+        html, inline, listed = insert_links(html, related, limit)
+    if related:
+        metrics.inc("internal_links_total", inline, result="inline")
+        metrics.inc("internal_links_total", listed, result="list")
+        print(f"[DEBUG] [{site_key}] Внутренних ссылок: {inline} в тексте, {listed} в «Читайте также»")
+    return html
+
+
+def build_post_payload(
     site_key: str,
     article: dict,
     media_id: Optional[int] = None,
     status: Optional[str] = None,
     category_id: Optional[int] = None,
-) -> int:
+) -> tuple[str, dict]:
+    """
+    Путь REST и тело запроса записи: новая запись или обновление той,
+    что уже есть в индексе сайта под этой темой. Свободный ЧПУ подбирается
+    по локальному индексу и резервируется — после ответа WP вызови
+    record_post (успех) или release_post (ошибка).
+    """
     cfg = SITES_CONFIG[site_key]
-    wp_url = cfg["wp_url"].rstrip("/")
-    username = cfg["username"]
-    app_password = cfg["app_password"]
-
-    endpoint = f"{wp_url}/wp-json/wp/v2/posts"
+    index = get_post_index(site_key)
+    topic = article.get("topic") or article["title"]
 
     payload: dict = {
         "title": article["title"],
@@ -493,8 +1042,13 @@ def create_post(
         "status": status or "draft",
     }
 
+    existing_id = None
     slug = (article.get("slug") or "").strip()
     if slug:
+        # короткий ЧПУ занят другой темой — пробуем ЧПУ из полной темы
+        long_slug = generate_slug_from_topic(topic, max_length=90, max_words=12)
+        candidates = [slug] if long_slug == slug else [slug, long_slug]
+        slug, existing_id = index.resolve_slug(topic, candidates, title=article["title"])
         payload["slug"] = slug
 
     # Категория
@@ -506,6 +1060,10 @@ def create_post(
     # Обложка
     if media_id:
         payload["featured_media"] = media_id
+    # Остальные размеры обложки: ID в медиатеке по имени варианта
+    # (поле регистрирует functions_rankmath_snippet.php)
+    if article.get("image_variants"):
+        payload.setdefault("meta", {})["atlas_image_variants"] = json.dumps(article["image_variants"])
 
     # SEO-плагин Rank Math
     seo_plugin = cfg.get("seo_plugin")
@@ -514,63 +1072,336 @@ def create_post(
         meta["rank_math_title"] = article["meta_title"]
         meta["rank_math_description"] = article["meta_description"]
 
-    resp = requests.post(
-        endpoint,
-        auth=(username, app_password),
-        headers={"Content-Type": "application/json"},
-        json=payload,
-        timeout=60,
+    # Ссылки на похожие статьи: санитайзер их вырезает, поэтому только здесь
+    payload["content"] = add_internal_links(site_key, article, payload["status"], existing_id)
+
+    path = "wp/v2/posts"
+    if existing_id:
+        print(f"[{site_key}] Запись с ЧПУ {slug!r} уже есть (ID {existing_id}) — обновляю")
+        path = f"wp/v2/posts/{existing_id}"
+        # черновик не должен снимать с публикации уже опубликованную запись
+        if payload["status"] != "publish":
+            del payload["status"]
+
+    return path, payload
+
+
+def record_post(site_key: str, article: dict, payload: dict, j: dict) -> int:
+    """Ответ WP на запись -> индекс записей и индекс ссылок сайта; возвращает ID записи."""
+    slug = payload.get("slug") or ""
+    post = IndexedPost(
+        post_id=int(j["id"]),
+        slug=j.get("slug") or slug,
+        title=article["title"],
+        status=j.get("status") or payload.get("status", ""),
+        link=j.get("link"),
+        topic=article.get("topic") or article["title"],
     )
+    get_post_index(site_key).record(post)
+    get_link_index(site_key).add(post.post_id, post.title, article["content_html"], post.link, post.status)
+    return post.post_id
+
+
+def release_post(site_key: str, payload: dict) -> None:
+    """Запись не создана — освобождаем зарезервированный ЧПУ."""
+    get_post_index(site_key).release(payload.get("slug") or "")
+
+
+def forget_post(site_key: str, path: str, payload: dict) -> bool:
+    """
+    Обновление вернуло 404/410 — записи в WP больше нет (удалена или в
+    корзине): убираем её из индексов, чтобы тема создалась заново.
+    True, если path был обновлением существующей записи.
+    """
+    post_id = path.rpartition("/")[2]
+    if not post_id.isdigit():
+        return False
+    release_post(site_key, payload)
+    get_post_index(site_key).forget(int(post_id))
+    get_link_index(site_key).forget(int(post_id))
+    print(f"[{site_key}] Записи {post_id} в WP больше нет — убираю из индекса и создаю заново")
+    return True
+
+
+def create_post(
+    site_key: str,
+    article: dict,
+    media_id: Optional[int] = None,
+    status: Optional[str] = None,
+    category_id: Optional[int] = None,
+) -> int:
+    """
+    Создаёт запись или, если запись этой темы уже есть в индексе сайта,
+    обновляет её. Свободный ЧПУ подбирается по локальному индексу.
+    """
+    wp = get_wp_client(site_key)
+    path, payload = build_post_payload(site_key, article, media_id, status, category_id)
+
+    try:
+        resp = wp.post(path, json=payload)
+        if resp.status_code in (404, 410) and forget_post(site_key, path, payload):
+            path, payload = build_post_payload(site_key, article, media_id, status, category_id)
+            resp = wp.post(path, json=payload)
+    except Exception:
+        release_post(site_key, payload)
+        raise
 
     if resp.status_code not in (200, 201):
+        release_post(site_key, payload)
         raise RuntimeError(
             f"[{site_key}] Ошибка создания поста в WP: {resp.status_code} {resp.text}"
         )
 
-    j = resp.json()
-    return int(j["id"])
+    return record_post(site_key, article, payload, resp.json())
+
+
+def create_posts(
+    site_key: str,
+    posts: list[dict],
+) -> list[tuple[Optional[int], Optional[Exception]]]:
+    """
+    Создаёт несколько записей сайта запросами batch/v1 (пачками до лимита
+    сервера). posts — аргументы create_post: {"article", "media_id",
+    "status", "category_id"}. Возвращает (post_id, ошибка) по каждой записи
+    в том же порядке: ошибка одной записи не валит остальные. Если хост
+    batch/v1 не поддерживает — записи создаются по одной через create_post.
+    """
+    results: list[tuple[Optional[int], Optional[Exception]]] = [(None, None)] * len(posts)
+
+    def one_by_one(indexes) -> None:
+        for n in indexes:
+            try:
+                results[n] = (create_post(site_key, **posts[n]), None)
+            except Exception as e:
+                results[n] = (None, e)
+
+    wp = get_wp_client(site_key)
+    limit = wp.batch_limit() if len(posts) > 1 else 0
+    if limit <= 1:
+        one_by_one(range(len(posts)))
+        return results
+
+    # тела запросов готовим заранее: ЧПУ резервируются по очереди и не совпадут
+    prepared: list[tuple[int, str, dict]] = []
+    for n, post in enumerate(posts):
+        try:
+            path, payload = build_post_payload(
+                site_key,
+                post["article"],
+                post.get("media_id"),
+                post.get("status"),
+                post.get("category_id"),
+            )
+        except Exception as e:
+            results[n] = (None, e)
+            continue
+        prepared.append((n, path, payload))
+
+    for start in range(0, len(prepared), limit):
+        chunk = prepared[start:start + limit]
+        try:
+            responses = wp.batch([{"path": path, "body": payload} for _, path, payload in chunk])
+        except Exception as e:
+            for n, _, payload in chunk:
+                release_post(site_key, payload)
+                results[n] = (None, e)
+            continue
+
+        if responses is None:
+            # batch/v1 на хосте нет — ЧПУ подберёт заново create_post
+            for _, _, payload in prepared[start:]:
+                release_post(site_key, payload)
+            one_by_one([n for n, _, _ in prepared[start:]])
+            break
+
+        gone = []
+        for (n, path, payload), r in zip(chunk, responses):
+            article = posts[n]["article"]
+            body = r["body"] if isinstance(r["body"], dict) else {}
+            if r["status"] in (200, 201) and "id" in body:
+                results[n] = (record_post(site_key, article, payload, body), None)
+            elif r["status"] in (404, 410) and forget_post(site_key, path, payload):
+                gone.append(n)
+            else:
+                release_post(site_key, payload)
+                results[n] = (None, RuntimeError(
+                    f"[{site_key}] Ошибка создания поста в WP: {r['status']} "
+                    f"{json.dumps(r['body'], ensure_ascii=False)}"
+                ))
+        # обновляли удалённые в WP записи — создаём их заново по одной
+        one_by_one(gone)
+
+    return results
 
 
 # =========================
 #   HIGH-LEVEL PIPELINE
 # =========================
-
-def generate_and_publish_for_site(
-    site_key: str,
-    topic: str,
-    publish: Optional[bool] = None,
-    category_id: Optional[int] = None,
-) -> None:
+#
+# Публикация одной темы разбита на четыре шага. Последовательный
+# generate_and_publish_for_site просто вызывает их по очереди, а
+# pipeline_multisite.py раскладывает их по отдельным стадиям
+# с собственной параллельностью.
+
+def prepare_article(site_key: str, topic: str) -> dict:
+    """Шаг 1: генерация текста статьи и принудительный ЧПУ из темы."""
     if site_key not in SITES_CONFIG:
         raise KeyError(f"Сайт '{site_key}' не найден в SITES_CONFIG")
 
     cfg = SITES_CONFIG[site_key]
     prompt_profile = cfg["prompt_profile"]
 
+    outline_prompts = []
+
+    def on_outline(meta: dict) -> None:
+        outline_prompts.append(meta["image_prompt"])
+        prefetch_image(site_key, meta["image_prompt"])
+
     print(f"[{site_key}] Генерация статьи на тему: {topic!r}")
-    article = generate_article(topic, prompt_profile)
+    article = generate_article(
+        topic,
+        prompt_profile,
+        stream=bool(cfg.get("stream_generation")),
+        speculative=int(cfg.get("speculative_candidates") or 0),
+        hedge_after=cfg.get("hedge_after"),
+        sections=bool(cfg.get("section_generation")),
+        on_outline=on_outline,
+        repair=bool(cfg.get("repair_articles")),
+    )
+    # по разделам не вышло и статья написана целиком — обложка по плану
+    # уже оплачена и по теме, берём её промпт
+    if outline_prompts:
+        article["image_prompt"] = outline_prompts[-1]
 
-    # Жёстко задаём ЧПУ из темы (а не из модели)
+    # Жёстко задаём ЧПУ из темы (а не из модели); тема нужна индексу записей
     article["slug"] = generate_slug_from_topic(topic)
-print(f"[DEBUG] Принудительный ЧПУ: {article['slug']}")
+    article["topic"] = topic.strip()
+    print(f"[DEBUG] Принудительный ЧПУ: {article['slug']}")
 
-    word_count = len(str(article["content_html"]).split())
+    word_count = article.get("word_count")
+    if word_count is None:
+        word_count = sanitize_html(article["content_html"]).word_count
     print(f"[DEBUG] Итоговый объём текста: {word_count} слов")
 
-    media_id = None
+    return article
+
+
+def image_filename(article: dict, variant: Optional[Variant] = None) -> str:
+    if variant is None or variant.name == FEATURED:
+        return f"{article.get('slug') or 'article'}.webp"
+    return f"{article.get('slug') or 'article'}-{variant.name}.{variant.ext}"
 
-    # Картинка — по возможности, но не критична
+
+def prepare_image(site_key: str, article: dict) -> Optional[bytes]:
+    """
+    Шаг 2: генерация обложки (WebP в памяти).
+    Картинка не критична — при ошибке возвращаем None и идём дальше без неё.
+    """
     try:
-        image_path = f"{article['slug'] or 'article'}.webp"
+        prefetched = take_prefetched_image(article["image_prompt"])
+        if prefetched is not None:
+            print(f"[{site_key}] Жду обложку, запущенную по плану статьи...")
+            return prefetched.result()
+        reused = reuse_similar_image(site_key, article["image_prompt"])
+        if reused is not None:
+            return reused
         print(f"[{site_key}] Генерация изображения...")
-        generate_image(article["image_prompt"], image_path)
+        return generate_image(article["image_prompt"], variants=site_image_variants(site_key))
+    except Exception as e:
+        print(f"[{site_key}] Не удалось сгенерировать изображение: {e}")
+        print(f"[{site_key}] Продолжаю без обложки.")
+        return None
+
+
+def publish_image(
+    site_key: str,
+    image_data: Optional[bytes],
+    filename: str = "article.webp",
+    image_prompt: Optional[str] = None,
+) -> Optional[int]:
+    """
+    Шаг 3: загрузка обложки в медиатеку WP. Ошибка не критична.
+    Файл, который уже есть на сайте (тот же хэш), не загружается повторно.
+    """
+    if not image_data:
+        return None
 
+    media = get_media_cache(site_key)
+    entry = media.get(image_data)
+    get_metrics().inc("cache_requests_total", kind="media", result="miss" if entry is None else "hit")
+    if entry is not None:
+        print(f"[{site_key}] Такая картинка уже в медиатеке (ID {entry.media_id}), не загружаю")
+        return entry.media_id
+
+    try:
         print(f"[{site_key}] Загрузка изображения в WordPress...")
-        media_id = upload_media(site_key, image_path)
+        media_id = upload_media(site_key, image_data, filename)
+        media.record(
+            image_data,
+            media_id,
+            image_prompt,
+            image_cache_key(image_prompt) if image_prompt else None,
+        )
+        return media_id
     except Exception as e:
-        print(f"[{site_key}] Не удалось сгенерировать/загрузить изображение: {e}")
+        print(f"[{site_key}] Не удалось загрузить изображение: {e}")
         print(f"[{site_key}] Продолжаю без обложки.")
+        return None
+
+
+def publish_image_variants(
+    site_key: str,
+    article: dict,
+    image_data: Optional[bytes],
+) -> dict[str, int]:
+    """
+    Шаг 3б: остальные варианты обложки сайта (card, social...) в медиатеку.
+    Байты берутся из кэша контента по промпту, с которым была сделана
+    обложка image_data (у взятой с похожего промпта — её исходный промпт).
+    Возвращает {имя варианта: media_id}; ошибки не критичны.
+    """
+    variants = site_image_variants(site_key)[1:]
+    if not image_data or not variants:
+        return {}
+
+    media = get_media_cache(site_key)
+    entry = media.get(image_data)
+    prompt = entry.prompt if entry is not None and entry.prompt else article.get("image_prompt")
+    if not prompt:
+        return {}
+
+    ids = {}
+    for v in variants:
+        data = get_content_cache().get_image(image_cache_key(prompt, v), v.ext)
+        if data is None:
+            print(f"[{site_key}] Нет варианта обложки {v.name!r} в кэше, пропускаю")
+            continue
+        found = media.get(data)
+        get_metrics().inc("cache_requests_total", kind="media", result="miss" if found is None else "hit")
+        if found is not None:
+            ids[v.name] = found.media_id
+            continue
+        try:
+            media_id = upload_media(site_key, data, image_filename(article, v), v.mime)
+        except Exception as e:
+            print(f"[{site_key}] Не удалось загрузить вариант обложки {v.name!r}: {e}")
+            continue
+        media.record(data, media_id)
+        ids[v.name] = media_id
+
+    if ids:
+        print(f"[{site_key}] Варианты обложки в медиатеке: {ids}")
+    return ids
+
 
+def publish_article(
+    site_key: str,
+    article: dict,
+    media_id: Optional[int] = None,
+    publish: Optional[bool] = None,
+    category_id: Optional[int] = None,
+) -> int:
+    """Шаг 4: создание поста в WordPress."""
     status = "publish" if publish else None
     print(f"[{site_key}] Создание поста в WordPress...")
     post_id = create_post(
@@ -585,35 +1416,65 @@ print(f"[DEBUG] Принудительный ЧПУ: {article['slug']}")
     print(f"[{site_key}] Title: {article['title']}")
     print(f"[{site_key}] Meta title: {article['meta_title']}")
     print(f"[{site_key}] Meta description: {article['meta_description']}")
+    return post_id
 
 
-# =========================
-#   ENTRY POINT
-# =========================
+def publish_articles(
+    site_key: str,
+    items: list[dict],
+) -> list[tuple[Optional[int], Optional[Exception]]]:
+    """
+    Шаг 4 сразу для нескольких готовых статей сайта (см. create_posts).
+    items — аргументы publish_article: {"article", "media_id", "publish",
+    "category_id"}. Возвращает (post_id, ошибка) по каждой статье.
+    """
+    print(f"[{site_key}] Создание {len(items)} постов в WordPress...")
+    results = create_posts(site_key, [
+        {
+            "article": item["article"],
+            "media_id": item.get("media_id"),
+            "status": "publish" if item.get("publish") else None,
+            "category_id": item.get("category_id"),
+        }
+        for item in items
+    ])
 
-if __name__ == "__main__":
-    try:
-        site_key = "gapola"  # или "bricker" или любой другой ключ из SITES_CONFIG
-        topics_file = "topics.txt"
+    for item, (post_id, error) in zip(items, results):
+        if error is None:
+            print(f"[{site_key}] Готово. ID поста: {post_id}, slug: {item['article']['slug']}")
+    failed = sum(1 for _, error in results if error is not None)
+    print(f"[{site_key}] Создано постов: {len(items) - failed}, ошибок: {failed}")
+    return results
 
-        print(f"[MAIN] Загружаю темы из файла: {topics_file!r}")
-        topics = load_topics_from_file(topics_file)
-        print(f"[MAIN] Найдено тем: {len(topics)}")
 
-        for i, topic in enumerate(topics, start=1):
-            print(f"\n[MAIN] === Тема #{i}: {topic!r} ===")
-            try:
-                # publish=False — создаём черновики; поставишь True, когда будешь готов публиковать сразу
-                generate_and_publish_for_site(site_key, topic, publish=False)
-            except Exception as e:
-                print(f"[MAIN][ERROR] Ошибка при обработке темы #{i}: {topic!r}")
-                traceback.print_exc()
+def generate_and_publish_for_site(
+    site_key: str,
+    topic: str,
+    publish: Optional[bool] = None,
+    category_id: Optional[int] = None,
+) -> None:
+    article = prepare_article(site_key, topic)
+    image_data = prepare_image(site_key, article)
+    media_id = publish_image(
+        site_key, image_data, image_filename(article), article.get("image_prompt"),
+    )
+    if media_id:
+        article["image_variants"] = publish_image_variants(site_key, article, image_data)
+    publish_article(
+        site_key,
+        article,
+        media_id=media_id,
+        publish=publish,
+        category_id=category_id,
+    )
 
-        print("\n[MAIN] Обработка всех тем завершена.")
 
-    except Exception as e:
-        print("\nПроизошла ошибка при выполнении скрипта (глобальная):\n")
-        traceback.print_exc()
-    finally:
-        input("\nНажми Enter, чтобы закрыть окно...")
+# =========================
+#   ENTRY POINT
+# =========================
+
+if __name__ == "__main__":
+    # Старый способ запуска: то же, что `python cli_multisite.py run`
+    from cli_multisite import main
 
+    sys.exit(main(["run", *sys.argv[1:]]))
@@ -0,0 +1,285 @@
+"""
+Общие ограничители скорости запросов к OpenAI и WordPress.
+
+Один RateLimiter на вышестоящий сервис, общий для всех потоков процесса:
+- OpenAI — запросы и токены отдельно для каждой модели (чат, картинки);
+  лимиты берутся из заголовков x-ratelimit-limit-* ответа, скорость
+  ставится чуть ниже лимита (SAFETY);
+- каждый хост WordPress и группа хостов на одном IP (многие сайты живут
+  на одном сервере) — у WP заголовков лимита нет, поэтому скорость
+  подбирается сама: на 429/503 падает вдвое и запоминается как потолок,
+  после успешных запросов плавно растёт до SAFETY от потолка, а потолок
+  медленно отпускается, чтобы заметить, что сервер стал свободнее.
+
+Очередь честная: acquire() резервирует слот под блокировкой (GCRA —
+расписание «теоретического времени прихода») и спит уже вне её, поэтому
+потоки не крутятся в цикле и не рвутся вперёд все разом после паузы.
+Retry-After ставит на паузу весь ограничитель, а не только один поток.
+"""
+
+import json
+import re
+import socket
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlsplit
+
+from metrics import get_metrics
+
+
+# Доля от известного лимита, на которой держим скорость
+SAFETY = 0.9
+
+# Пока заголовков не было — стартовые лимиты OpenAI (в минуту)
+DEFAULT_OPENAI_RPM = 500
+DEFAULT_OPENAI_TPM = 2_000_000
+# Сколько токенов ответа резервировать на запрос статьи до прихода usage
+EXPECTED_COMPLETION_TOKENS = 4000
+# Байт UTF-8 на токен в русском тексте (≈3 символа по 2 байта)
+BYTES_PER_TOKEN = 6
+
+# WordPress: запросов в секунду на хост и на группу хостов одного IP;
+# на сайт переопределяются ключами wp_rate / rate_group в SITES_CONFIG
+DEFAULT_WP_RATE = 4.0
+DEFAULT_GROUP_RATE = 8.0
+
+DEFAULT_PAUSE = 1.0  # пауза после 429 без Retry-After, секунды
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After: секунды или HTTP-дата -> секунды ожидания."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """x-ratelimit-reset-*: '6m0s', '1.5s', '20ms' -> секунды."""
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+class RateLimiter:
+    """
+    Ограничитель rate ед./с с запасом burst ед. подряд.
+    adaptive=True — скорость подбирается по 429/503 (для WP);
+    иначе её задаёт set_limit() по заголовкам.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: float = 1.0,
+        adaptive: bool = False,
+        min_rate: float = 0.2,
+        max_rate: Optional[float] = None,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.adaptive = adaptive
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self._ceiling: Optional[float] = None  # скорость, на которой нас последний раз остановили
+        self._tat = 0.0  # теоретическое время прихода следующей единицы
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Ждёт своей очереди; возвращает время ожидания в секундах."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._tat, now, self._paused_until)
+            # запас burst позволяет начать раньше расписания
+            wait = max(0.0, start - self.burst / self.rate - now, self._paused_until - now)
+            self._tat = start + amount / self.rate
+        if wait > 0:
+            time.sleep(wait)
+            get_metrics().observe("ratelimit_wait_seconds", wait, limiter=self.name)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """Никто не начинает запрос раньше, чем через seconds."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def throttle(self, retry_after: Optional[float] = None) -> None:
+        """Сервер ответил 429/503: пауза и (для adaptive) снижение скорости."""
+        with self._lock:
+            # несколько 429 от одной перегрузки (пока идёт пауза) снижают скорость один раз
+            slowed = self.adaptive and time.monotonic() >= self._paused_until
+            if slowed:
+                self._ceiling = self.rate
+                self.rate = max(self.min_rate, self.rate / 2)
+            rate = self.rate
+        self.pause(DEFAULT_PAUSE if retry_after is None else retry_after)
+        get_metrics().inc("ratelimit_throttles_total", limiter=self.name)
+        if slowed:
+            print(f"[RATE] {self.name}: сервер просит сбавить темп, скорость {rate:.2f}/с")
+
+    def success(self) -> None:
+        """Удачный ответ: adaptive-скорость растёт к потолку."""
+        if not self.adaptive:
+            return
+        with self._lock:
+            if self._ceiling is not None:
+                self._ceiling *= 1.001  # потолок отпускаем медленно
+            target = self.max_rate if self._ceiling is None else min(self.max_rate, self._ceiling * SAFETY)
+            if self.rate < target:
+                self.rate = min(target, self.rate * 1.05)
+
+    def set_limit(self, per_minute: float, remaining: Optional[float] = None,
+                  reset: Optional[float] = None) -> None:
+        """Лимит из заголовков: скорость SAFETY от него; исчерпан — ждём сброса."""
+        if per_minute <= 0:
+            return
+        with self._lock:
+            self.rate = per_minute / 60 * SAFETY
+            self.max_rate = self.rate
+        if remaining is not None and remaining <= 0 and reset:
+            self.pause(reset)
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str, rate: float, **kwargs) -> RateLimiter:
+    """Общий ограничитель по имени (создаётся при первом обращении)."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(name, rate, **kwargs)
+            _limiters[name] = limiter
+        return limiter
+
+
+# =========================
+#   OpenAI (httpx event hooks)
+# =========================
+
+def _openai_limiters(request) -> tuple[Optional[RateLimiter], Optional[RateLimiter], float]:
+    """Ограничители запросов и токенов для запроса SDK и оценка его токенов."""
+    path = request.url.path
+    if path.endswith("/chat/completions"):
+        kind = "chat"
+    elif path.endswith("/images/generations"):
+        kind = "images"
+    else:
+        return None, None, 0.0  # файлы, батчи и т.п. не ограничиваем
+
+    try:
+        model = json.loads(request.content or b"{}").get("model") or "-"
+    except (ValueError, AttributeError):
+        model = "-"
+
+    requests_limiter = get_limiter(
+        f"openai:{model}:requests", DEFAULT_OPENAI_RPM / 60 * SAFETY, burst=5,
+    )
+    if kind != "chat":
+        return requests_limiter, None, 0.0
+
+    tokens = len(request.content or b"") / BYTES_PER_TOKEN + EXPECTED_COMPLETION_TOKENS
+    tokens_limiter = get_limiter(
+        f"openai:{model}:tokens", DEFAULT_OPENAI_TPM / 60 * SAFETY,
+        burst=EXPECTED_COMPLETION_TOKENS * 5,
+    )
+    return requests_limiter, tokens_limiter, tokens
+
+
+def _on_openai_request(request) -> None:
+    requests_limiter, tokens_limiter, tokens = _openai_limiters(request)
+    if requests_limiter is not None:
+        requests_limiter.acquire()
+    if tokens_limiter is not None:
+        tokens_limiter.acquire(tokens)
+
+
+def _on_openai_response(response) -> None:
+    requests_limiter, tokens_limiter, _ = _openai_limiters(response.request)
+    if requests_limiter is None:
+        return
+    headers = response.headers
+
+    for limiter, kind in ((requests_limiter, "requests"), (tokens_limiter, "tokens")):
+        limit = headers.get(f"x-ratelimit-limit-{kind}")
+        if limiter is None or not limit:
+            continue
+        remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+        try:
+            limiter.set_limit(
+                float(limit),
+                float(remaining) if remaining else None,
+                parse_reset(headers.get(f"x-ratelimit-reset-{kind}")),
+            )
+        except ValueError:
+            continue
+
+    if response.status_code == 429:
+        retry_after = parse_retry_after(headers.get("retry-after"))
+        ms = headers.get("retry-after-ms")
+        if ms:
+            try:
+                retry_after = float(ms) / 1000
+            except ValueError:
+                pass
+        requests_limiter.throttle(retry_after)
+
+
+def openai_event_hooks() -> dict:
+    """event_hooks для httpx-клиента OpenAI: срабатывают и на повторах SDK."""
+    return {"request": [_on_openai_request], "response": [_on_openai_response]}
+
+
+# =========================
+#   WordPress
+# =========================
+
+_groups: dict[str, str] = {}
+
+
+def host_group(host: str) -> str:
+    """IP хоста (сайты на одном сервере делят лимит); не резолвится — сам хост."""
+    with _limiters_lock:
+        group = _groups.get(host)
+    if group is None:
+        try:
+            group = socket.gethostbyname(host)
+        except OSError:
+            group = host
+        with _limiters_lock:
+            _groups[host] = group
+    return group
+
+
+def wp_limiters(cfg: dict) -> list[RateLimiter]:
+    """Ограничители сайта: его хост и группа хостов (rate_group или IP)."""
+    host = urlsplit(cfg["wp_url"]).hostname or cfg["wp_url"]
+    rate = float(cfg.get("wp_rate") or DEFAULT_WP_RATE)
+    group = cfg.get("rate_group") or host_group(host)
+    return [
+        get_limiter(f"wp:{host}", rate, burst=2, adaptive=True),
+        get_limiter(
+            f"wp-group:{group}", float(cfg.get("group_rate") or DEFAULT_GROUP_RATE),
+            burst=2, adaptive=True,
+        ),
+    ]
@@ -0,0 +1,259 @@
+"""
+Поиск почти одинаковых тем до вызова модели.
+
+Тема нормализуется (регистр, ё/е, пунктуация, служебные слова) и
+превращается в множество «основ» — слов, обрезанных до STEM_LENGTH
+символов, чтобы «ставить/ставки», «лайв/лайве» совпадали. Похожесть —
+коэффициент Жаккара этих множеств.
+
+Кандидаты ищутся фильтром по префиксу (как в PPJoin): основы темы
+упорядочены от редких к частым, и при пороге выше 0.5 две похожие темы
+обязательно делят пару основ из коротких префиксов. В инвертированный
+индекс кладутся только пары из префикса, а оценка сверху по позициям
+отсекает кандидатов, которые не могут набрать нужное пересечение.
+Частые слова («ставки», «футбол») почти не попадают в списки, поэтому
+файл на 100k+ строк проверяется за секунды, а результат точный.
+
+Темы проверяются по очереди: первая тема кластера остаётся, остальные
+помечаются как дубли. Уже опубликованные на сайте записи (темы и
+заголовки из индекса записей) добавляются заранее — темы, похожие
+на них, тоже пропускаются.
+"""
+
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator, Optional
+
+
+DEFAULT_THRESHOLD = 0.6
+STEM_LENGTH = 4
+
+# Сколько тем читать заранее, чтобы оценить частоты основ при ленивом чтении
+FREQ_SAMPLE = 5000
+
+STOP_WORDS = frozenset({
+    "а", "в", "во", "и", "к", "ко", "о", "об", "с", "со", "у", "на", "по", "за",
+    "из", "от", "до", "для", "при", "про", "без", "под", "над", "же", "ли", "не",
+    "или", "как", "что", "это", "так", "все", "всё", "его", "ее", "их", "чем",
+    "где", "когда", "какие", "какой", "какая", "the", "a", "an", "of", "in",
+    "on", "for", "to", "and", "or", "how",
+})
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def topic_tokens(topic: str) -> frozenset[str]:
+    """Множество основ темы без служебных слов."""
+    words = _WORD_RE.findall(topic.lower().replace("ё", "е"))
+    return frozenset(w[:STEM_LENGTH] for w in words if w not in STOP_WORDS)
+
+
+def threshold_error(threshold) -> Optional[str]:
+    """Почему порог сходства не годится (None — годится): префиксный фильтр работает при t > 0.5."""
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)):
+        return f"порог сходства должен быть числом в (0.5, 1]: {threshold!r}"
+    if not 0.5 < threshold <= 1:
+        return f"порог сходства должен быть в (0.5, 1]: {threshold}"
+    return None
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    inter = len(a & b)
+    return inter / (len(a) + len(b) - inter)
+
+
+@dataclass
+class DuplicateTopic:
+    topic: str
+    duplicate_of: str
+    similarity: float
+    published: bool  # похожа на уже опубликованную запись, а не на тему из списка
+
+
+class TopicDeduper:
+    """
+    Инкрементальный поиск дублей: check() для каждой новой темы.
+    token_freq задаёт порядок основ (редкие первыми); без него порядок
+    алфавитный — результат тот же, только кандидатов больше.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        token_freq: Optional[Counter] = None,
+    ):
+        error = threshold_error(threshold)
+        if error:
+            raise ValueError(error[0].upper() + error[1:])
+        self.threshold = threshold
+        self._freq = token_freq or Counter()
+
+        self._topics: list[str] = []
+        self._tokens: list[frozenset] = []
+        self._published: list[bool] = []
+        self._root: list[int] = []  # представитель кластера для каждой записи
+
+        self._exact: dict[frozenset, int] = {}
+        # пара основ -> (размер темы, позиция второй основы) -> записи;
+        # группировка позволяет отбрасывать по оценке целые группы сразу
+        self._postings: dict[tuple[str, str], dict[tuple[int, int], list[int]]] = {}
+
+    def _prefix_pairs(self, tokens: frozenset) -> list[tuple[tuple[str, str], int]]:
+        """
+        Пары основ из префикса с позицией второй основы пары.
+        Общих основ у похожих тем не меньше ceil(t * n) >= 2, значит первые
+        две общие лежат среди n - ceil(t * n) + 2 самых редких. Пары идут по
+        возрастанию позиций: первой кандидата находит пара первых двух общих.
+        """
+        n = len(tokens)
+        freq = self._freq
+        order = sorted(tokens, key=lambda t: (freq[t], t))
+        size = min(n, n - math.ceil(self.threshold * n - 1e-9) + 2)
+        return [
+            ((order[i], order[j]), j)
+            for j in range(1, size)
+            for i in range(j)
+        ]
+
+    def _find(self, tokens: frozenset) -> tuple[Optional[int], float]:
+        """Самая похожая из уже добавленных записей и сходство с ней."""
+        if not tokens:
+            return None, 0.0
+
+        idx = self._exact.get(tokens)
+        if idx is not None:
+            return idx, 1.0
+
+        t = self.threshold
+        n = len(tokens)
+        lo, hi = t * n, n / t
+        overlap_ratio = t / (1 + t)
+        seen = set()
+        best, best_sim = None, 0.0
+        for pair, pos in self._prefix_pairs(tokens):
+            for (m, cand_pos), cands in self._postings.get(pair, {}).items():
+                if not lo <= m <= hi:
+                    continue
+                # две общие основы плюс всё, что может совпасть после них
+                if 2 + min(n - 1 - pos, m - 1 - cand_pos) < math.ceil(overlap_ratio * (n + m) - 1e-9):
+                    continue
+                for cand in cands:
+                    if cand in seen:
+                        continue
+                    seen.add(cand)
+                    sim = jaccard(tokens, self._tokens[cand])
+                    if sim > best_sim:
+                        best, best_sim = cand, sim
+        return best, best_sim
+
+    def _add(self, topic: str, tokens: frozenset, published: bool, root: Optional[int]) -> int:
+        idx = len(self._topics)
+        self._topics.append(topic)
+        self._tokens.append(tokens)
+        self._published.append(published)
+        self._root.append(idx if root is None else root)
+
+        # точный повтор уже проиндексированного множества не индексируем;
+        # одной основе похожа только такая же — её находит _exact
+        n = len(tokens)
+        if n and self._exact.setdefault(tokens, idx) == idx and n > 1:
+            for pair, pos in self._prefix_pairs(tokens):
+                groups = self._postings.setdefault(pair, {})
+                groups.setdefault((n, pos), []).append(idx)
+        return idx
+
+    def add(self, text: str) -> int:
+        """Индексирует текст без проверки; возвращает его номер (для nearest)."""
+        return self._add(text, topic_tokens(text), False, None)
+
+    def nearest(self, text: str) -> tuple[Optional[int], float]:
+        """
+        Номер самого похожего из добавленных текстов и сходство с ним.
+        Ищутся только тексты не ниже порога; нет таких — (None, 0.0).
+        """
+        match, sim = self._find(topic_tokens(text))
+        if match is None or sim < self.threshold:
+            return None, 0.0
+        return match, sim
+
+    def add_published(self, title: str) -> None:
+        """Добавляет опубликованную запись (тему или заголовок) как уже занятую."""
+        tokens = topic_tokens(title)
+        match, sim = self._find(tokens)
+        root = self._root[match] if match is not None and sim >= self.threshold else None
+        self._add(title, tokens, True, root)
+
+    def check(self, topic: str) -> Optional[DuplicateTopic]:
+        """None, если тема новая (и она запоминается), иначе описание дубля."""
+        tokens = topic_tokens(topic)
+        match, sim = self._find(tokens)
+
+        if match is None or sim < self.threshold:
+            self._add(topic, tokens, False, None)
+            return None
+
+        # дубль тоже индексируется: цепочки перефразировок сходятся к одному кластеру
+        root = self._root[match]
+        self._add(topic, tokens, False, root)
+        return DuplicateTopic(
+            topic=topic,
+            duplicate_of=self._topics[root],
+            similarity=round(sim, 3),
+            published=self._published[root],
+        )
+
+
+def iter_unique_topics(
+    topics: Iterable[str],
+    published: Iterable[str] = (),
+    threshold: float = DEFAULT_THRESHOLD,
+    on_duplicate: Optional[Callable[[DuplicateTopic], None]] = None,
+    sample_size: Optional[int] = FREQ_SAMPLE,
+) -> Iterator[str]:
+    """
+    Лениво отдаёт уникальные темы в исходном порядке, дубли — в on_duplicate.
+    Частоты основ оцениваются по первым sample_size темам (None — по всем,
+    тогда список читается целиком): на результат это не влияет, только
+    на число кандидатов.
+    """
+    topics = iter(topics)
+    published = [t for t in published if t]
+    head = list(topics if sample_size is None else islice(topics, sample_size))
+
+    freq: Counter = Counter()
+    for text in chain(published, head):
+        freq.update(topic_tokens(text))
+
+    deduper = TopicDeduper(threshold=threshold, token_freq=freq)
+    for title in published:
+        deduper.add_published(title)
+
+    for topic in chain(head, topics):
+        dup = deduper.check(topic)
+        if dup is None:
+            yield topic
+        elif on_duplicate is not None:
+            on_duplicate(dup)
+
+
+def dedupe_topics(
+    topics: Iterable[str],
+    published: Iterable[str] = (),
+    threshold: float = DEFAULT_THRESHOLD,
+) -> tuple[list[str], list[DuplicateTopic]]:
+    """Делит темы на уникальные (в исходном порядке) и дубли."""
+    duplicates: list[DuplicateTopic] = []
+    unique = list(iter_unique_topics(
+        topics, published, threshold, on_duplicate=duplicates.append, sample_size=None,
+    ))
+    return unique, duplicates
+
+
+def format_duplicate(dup: DuplicateTopic) -> str:
+    where = "опубликовано" if dup.published else "в списке"
+    return f"{dup.topic!r} ≈ {dup.duplicate_of!r} ({where}, {dup.similarity})"
@@ -0,0 +1,381 @@
+"""
+Общая очередь задач (сайт, тема) для нескольких воркеров и машин.
+
+Темы кладутся в очередь один раз (`cli_multisite.py queue add`), а
+любое число воркеров (`cli_multisite.py worker`) разбирает её
+параллельно. Задачу воркер берёт в аренду (lease) на lease_ttl секунд и,
+пока работает, продлевает аренду (heartbeat). Пока аренда жива, ту же
+тему никто другой не получит, поэтому две копии скрипта не опубликуют
+её дважды. Аренда упавшего воркера истекает, и задачу забирает другой.
+
+Задача с ошибкой возвращается в очередь с паузой (retry_delay,
+удваивается с каждой попыткой), а после max_attempts попыток уходит в
+dead — её видно в `queue dead`, вернуть можно через `queue requeue`.
+
+Состояния: ready → leased → done | ready (повтор) | dead.
+
+Хранилище подключаемое (WorkQueue): здесь SQLite-файл — годится для
+воркеров на одной машине или на общем диске с нормальными блокировками.
+Для сетевого хранилища (Postgres, Redis) достаточно реализовать те же
+методы и вернуть их из open_work_queue.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Iterable, Optional, Protocol
+
+
+DEFAULT_QUEUE_PATH = "work_queue.sqlite3"
+
+DEFAULT_LEASE_TTL = 300.0  # секунд; heartbeat продлевает каждые lease_ttl / 3
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 60.0  # пауза перед повтором, удваивается с каждой попыткой
+
+STATES = ("ready", "leased", "done", "dead")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    site_key     TEXT NOT NULL,
+    topic        TEXT NOT NULL,
+    publish      INTEGER,
+    category_id  INTEGER,
+    state        TEXT NOT NULL DEFAULT 'ready',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_id     TEXT,
+    owner        TEXT,
+    lease_until  REAL,
+    error        TEXT,
+    enqueued_at  REAL NOT NULL,
+    updated_at   REAL NOT NULL,
+    PRIMARY KEY (site_key, topic)
+);
+CREATE INDEX IF NOT EXISTS queue_state ON queue (state, available_at);
+"""
+
+
+@dataclass
+class Lease:
+    site_key: str
+    topic: str
+    lease_id: str
+    attempt: int  # номер попытки, считая эту
+    publish: Optional[bool] = None
+    category_id: Optional[int] = None
+
+
+@dataclass
+class QueueItem:
+    site_key: str
+    topic: str
+    state: str
+    attempts: int
+    owner: Optional[str]
+    error: Optional[str]
+    updated_at: float
+
+
+def default_worker_id() -> str:
+    """Имя воркера в очереди: хост и PID."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue(Protocol):
+    def enqueue(
+        self,
+        items: Iterable[tuple[str, str]],
+        publish: Optional[bool] = None,
+        category_id: Optional[int] = None,
+    ) -> int:
+        """Добавляет (сайт, тема); уже известные пары пропускаются. Возвращает число новых."""
+
+    def lease(
+        self,
+        owner: str,
+        limit: int = 1,
+        sites: Optional[Iterable[str]] = None,
+        skip_sites: Iterable[str] = (),
+    ) -> list[Lease]:
+        """Берёт в аренду до limit готовых задач (включая задачи с истёкшей арендой)."""
+
+    def heartbeat(self, leases: list[Lease]) -> list[Lease]:
+        """Продлевает аренду; возвращает те, что продлить не удалось (аренду уже забрали)."""
+
+    def complete(self, lease: Lease) -> bool:
+        ...
+
+    def fail(self, lease: Lease, error: str) -> str:
+        """Ошибка попытки; новое состояние: ready (повтор), dead или lost (аренду уже забрали)."""
+
+    def release(self, lease: Lease) -> None:
+        """Возвращает задачу в очередь без траты попытки (воркер останавливается)."""
+
+    def pending(self, sites: Optional[Iterable[str]] = None) -> int:
+        """Сколько задач ещё не завершено (ready и leased)."""
+
+    def stats(self) -> list[tuple[str, str, int]]:
+        """(сайт, состояние, число задач)."""
+
+    def items(self, state: str, site_key: Optional[str] = None, limit: int = 50) -> list[QueueItem]:
+        ...
+
+    def requeue(self, state: str = "dead", site_key: Optional[str] = None) -> int:
+        """Возвращает задачи из state в ready с нулевым счётчиком попыток."""
+
+    def close(self) -> None:
+        ...
+
+
+def _in(column: str, values: list[str]) -> tuple[str, list]:
+    return f"{column} IN ({', '.join('?' * len(values))})", list(values)
+
+
+class SQLiteWorkQueue:
+    """
+    Очередь в SQLite (WAL). Аренда берётся в транзакции BEGIN IMMEDIATE:
+    пока один воркер выбирает задачи, остальные ждут блокировку записи,
+    поэтому одна задача не достаётся двоим. Потокобезопасна.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_QUEUE_PATH,
+        lease_ttl: float = DEFAULT_LEASE_TTL,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+    ):
+        self.path = path
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+
+        # транзакции ведём сами (isolation_level=None), чтобы взять BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _write(self, fn):
+        """fn(conn, now) в одной транзакции записи."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn, time.time())
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    # ---- постановка ----
+
+    def enqueue(
+        self,
+        items: Iterable[tuple[str, str]],
+        publish: Optional[bool] = None,
+        category_id: Optional[int] = None,
+    ) -> int:
+        rows = [(site_key, topic.strip()) for site_key, topic in items]
+
+        def do(conn, now):
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO queue (site_key, topic, publish, category_id, "
+                "available_at, enqueued_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (site_key, topic, None if publish is None else int(publish), category_id, now, now, now)
+                    for site_key, topic in rows
+                ],
+            )
+            return conn.total_changes - before
+
+        return self._write(do)
+
+    # ---- аренда ----
+
+    def lease(
+        self,
+        owner: str,
+        limit: int = 1,
+        sites: Optional[Iterable[str]] = None,
+        skip_sites: Iterable[str] = (),
+    ) -> list[Lease]:
+        if limit <= 0:
+            return []
+        sites = list(sites) if sites is not None else None
+        skip_sites = list(skip_sites)
+
+        def do(conn, now):
+            # аренда упавшего воркера истекла на последней попытке — в dead
+            conn.execute(
+                "UPDATE queue SET state = 'dead', lease_id = NULL, updated_at = ?, "
+                "error = COALESCE(error, 'аренда истекла') "
+                "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+
+            where = [
+                "((state = 'ready' AND available_at <= ?) OR (state = 'leased' AND lease_until < ?))"
+            ]
+            params: list = [now, now]
+            if sites is not None:
+                clause, values = _in("site_key", sites)
+                where.append(clause)
+                params += values
+            if skip_sites:
+                clause, values = _in("site_key", skip_sites)
+                where.append("NOT " + clause)
+                params += values
+            rows = conn.execute(
+                "SELECT site_key, topic, publish, category_id, attempts FROM queue "
+                f"WHERE {' AND '.join(where)} ORDER BY available_at LIMIT ?",
+                params + [limit],
+            ).fetchall()
+
+            leases = []
+            for site_key, topic, publish, category_id, attempts in rows:
+                lease = Lease(
+                    site_key,
+                    topic,
+                    uuid.uuid4().hex,
+                    attempts + 1,
+                    None if publish is None else bool(publish),
+                    category_id,
+                )
+                conn.execute(
+                    "UPDATE queue SET state = 'leased', attempts = ?, lease_id = ?, owner = ?, "
+                    "lease_until = ?, updated_at = ? WHERE site_key = ? AND topic = ?",
+                    (lease.attempt, lease.lease_id, owner, now + self.lease_ttl, now, site_key, topic),
+                )
+                leases.append(lease)
+            return leases
+
+        return self._write(do)
+
+    def heartbeat(self, leases: list[Lease]) -> list[Lease]:
+        def do(conn, now):
+            lost = []
+            for lease in leases:
+                cur = conn.execute(
+                    "UPDATE queue SET lease_until = ?, updated_at = ? "
+                    "WHERE site_key = ? AND topic = ? AND lease_id = ? AND state = 'leased'",
+                    (now + self.lease_ttl, now, lease.site_key, lease.topic, lease.lease_id),
+                )
+                if cur.rowcount != 1:
+                    lost.append(lease)
+            return lost
+
+        return self._write(do) if leases else []
+
+    def complete(self, lease: Lease) -> bool:
+        """False — аренду к этому моменту уже забрал другой воркер."""
+        def do(conn, now):
+            cur = conn.execute(
+                "UPDATE queue SET state = 'done', lease_id = NULL, lease_until = NULL, "
+                "error = NULL, updated_at = ? WHERE site_key = ? AND topic = ? AND lease_id = ?",
+                (now, lease.site_key, lease.topic, lease.lease_id),
+            )
+            return cur.rowcount == 1
+
+        return self._write(do)
+
+    def fail(self, lease: Lease, error: str) -> str:
+        dead = lease.attempt >= self.max_attempts
+        state = "dead" if dead else "ready"
+
+        def do(conn, now):
+            delay = self.retry_delay * 2 ** (lease.attempt - 1)
+            cur = conn.execute(
+                "UPDATE queue SET state = ?, lease_id = NULL, lease_until = NULL, error = ?, "
+                "available_at = ?, updated_at = ? WHERE site_key = ? AND topic = ? AND lease_id = ?",
+                (state, error, now + delay, now, lease.site_key, lease.topic, lease.lease_id),
+            )
+            return state if cur.rowcount == 1 else "lost"
+
+        return self._write(do)
+
+    def release(self, lease: Lease) -> None:
+        def do(conn, now):
+            conn.execute(
+                "UPDATE queue SET state = 'ready', attempts = MAX(attempts - 1, 0), lease_id = NULL, "
+                "lease_until = NULL, available_at = ?, updated_at = ? "
+                "WHERE site_key = ? AND topic = ? AND lease_id = ?",
+                (now, now, lease.site_key, lease.topic, lease.lease_id),
+            )
+
+        self._write(do)
+
+    # ---- чтение ----
+
+    def pending(self, sites: Optional[Iterable[str]] = None) -> int:
+        query = "SELECT COUNT(*) FROM queue WHERE state IN ('ready', 'leased')"
+        params: list = []
+        if sites is not None:
+            clause, params = _in("site_key", list(sites))
+            query += " AND " + clause
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def stats(self) -> list[tuple[str, str, int]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT site_key, state, COUNT(*) FROM queue GROUP BY site_key, state "
+                "ORDER BY site_key, state"
+            ).fetchall()
+
+    def items(self, state: str, site_key: Optional[str] = None, limit: int = 50) -> list[QueueItem]:
+        query = (
+            "SELECT site_key, topic, state, attempts, owner, error, updated_at "
+            "FROM queue WHERE state = ?"
+        )
+        params: list = [state]
+        if site_key is not None:
+            query += " AND site_key = ?"
+            params.append(site_key)
+        query += " ORDER BY updated_at DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(query, params + [limit]).fetchall()
+        return [QueueItem(*row) for row in rows]
+
+    def requeue(self, state: str = "dead", site_key: Optional[str] = None) -> int:
+        if state not in STATES:
+            raise ValueError(f"Неизвестное состояние {state!r}, есть: {', '.join(STATES)}")
+
+        def do(conn, now):
+            query = (
+                "UPDATE queue SET state = 'ready', attempts = 0, lease_id = NULL, "
+                "lease_until = NULL, available_at = ?, updated_at = ? WHERE state = ?"
+            )
+            params: list = [now, now, state]
+            if site_key is not None:
+                query += " AND site_key = ?"
+                params.append(site_key)
+            return conn.execute(query, params).rowcount
+
+        return self._write(do)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_work_queue(url: Optional[str] = None, **options) -> WorkQueue:
+    """
+    Очередь по адресу: путь к файлу или sqlite:///путь (по умолчанию
+    DEFAULT_QUEUE_PATH). Другие схемы — место для сетевых реализаций WorkQueue.
+    options — lease_ttl, max_attempts, retry_delay.
+    """
+    url = url or DEFAULT_QUEUE_PATH
+    scheme, sep, rest = url.partition("://")
+    if not sep:
+        return SQLiteWorkQueue(url, **options)
+    if scheme == "sqlite":
+        # как в SQLAlchemy: sqlite:///rel.db — относительный путь, sqlite:////abs.db — абсолютный
+        return SQLiteWorkQueue(rest[1:] if rest.startswith("/") else rest, **options)
+    raise ValueError(f"Очередь {scheme}:// не поддерживается: реализуй WorkQueue и добавь её в open_work_queue")
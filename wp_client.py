@@ -0,0 +1,293 @@
+"""
+Клиент WordPress REST API на сайт.
+
+Один WPClient на site_key держит requests.Session с пулом keep-alive
+соединений, поэтому загрузки медиа и создание постов для одного хоста
+не платят каждый раз за TCP+TLS рукопожатие. Временные ошибки
+(429, 5xx, обрыв соединения) повторяются с экспоненциальной паузой,
+чтобы уже оплаченная статья не пропадала из-за одного сбоя WP. POST
+повторяется только когда WP его точно не выполнил: соединение не
+установилось или хост отказал (429/503). После таймаута чтения или
+500/502/504 запись могла уже появиться — такие ошибки уходят наверх,
+к журналу и индексу записей, а не в повтор.
+
+Несколько записей можно отправить одним запросом batch/v1 (WP 5.6+):
+один цикл загрузки WordPress вместо одного на каждую запись.
+"""
+
+import re
+import threading
+from typing import TYPE_CHECKING, Optional
+
+from config_multisite import SITES_CONFIG
+from metrics import get_metrics
+from rate_limit import THROTTLE_STATUSES, RateLimiter, parse_retry_after, wp_limiters
+
+# requests импортируется при создании первой сессии, а не при импорте модуля
+if TYPE_CHECKING:
+    import requests
+
+
+# Значения по умолчанию; на сайт переопределяются ключами
+# pool_size / max_retries / retry_backoff / timeout в SITES_CONFIG.
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_RETRY_BACKOFF = 1.0
+DEFAULT_TIMEOUT = 60
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# POST (записи, медиа, batch/v1) не идемпотентен: повторяем только явный отказ хоста
+POST_RETRY_STATUSES = (429, 503)
+
+BATCH_ROUTE = "batch/v1"
+# rest_get_max_batch_size() по умолчанию; сервер сообщает свой лимит в OPTIONS
+DEFAULT_BATCH_LIMIT = 25
+# ответы, после которых считаем, что batch/v1 на хосте нет или он выключен
+BATCH_UNSUPPORTED_STATUSES = (400, 401, 403, 404, 405, 501)
+
+_ID_RE = re.compile(r"/\d+(?=/|$)")
+
+
+def build_session(
+    pool_size: int = DEFAULT_POOL_SIZE,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    backoff_factor: float = DEFAULT_RETRY_BACKOFF,
+    limiters: Optional[list[RateLimiter]] = None,
+) -> "requests.Session":
+    """
+    Session с пулом соединений и повторами.
+    GET/OPTIONS повторяются при любых временных ошибках. POST — только
+    если запрос не дошёл (ошибка соединения) или хост ответил 429/503:
+    после таймаута чтения и 500/502/504 запись могла создаться, и
+    повтор дал бы дубль.
+    С limiters каждый повтор тоже ждёт своей очереди, а 429/503 сбавляют
+    общий темп хоста (см. rate_limit.py).
+    """
+    limiters = limiters or []
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class CountingRetry(Retry):
+        """Retry, который отмечает каждый повтор в метриках (код ответа или тип ошибки)."""
+
+        def is_retry(self, method, status_code, has_retry_after=False):
+            if not self._is_method_retryable(method):
+                return status_code in POST_RETRY_STATUSES
+            return super().is_retry(method, status_code, has_retry_after)
+
+        def increment(self, method=None, url=None, response=None, error=None, *args, **kwargs):
+            # таймаут чтения POST Retry пробрасывает сам — повтором он не считается
+            retry = super().increment(method, url, response, error, *args, **kwargs)
+
+            if response is not None:
+                reason = str(response.status)
+            else:
+                reason = type(error).__name__ if error is not None else "unknown"
+            get_metrics().inc("retries_total", source="wp", reason=reason)
+            get_metrics().event("retry", source="wp", method=method, url=url, reason=reason)
+            if response is not None and response.status in THROTTLE_STATUSES:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                for limiter in limiters:
+                    limiter.throttle(retry_after)
+            for limiter in limiters:
+                limiter.acquire()
+            return retry
+
+    retry = CountingRetry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # POST — см. is_retry
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class WPClient:
+    """REST-клиент одного сайта WordPress с постоянной сессией."""
+
+    def __init__(
+        self,
+        site_key: str,
+        cfg: dict,
+        pool_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_factor: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.site_key = site_key
+        self.cfg = cfg
+        self.wp_url = cfg["wp_url"].rstrip("/")
+        self.timeout = timeout or cfg.get("timeout") or DEFAULT_TIMEOUT
+        # хост сайта и группа хостов на том же IP — общие для всех воркеров
+        self.limiters = wp_limiters(cfg)
+
+        self.session = build_session(
+            pool_size=pool_size or cfg.get("pool_size") or DEFAULT_POOL_SIZE,
+            max_retries=(
+                max_retries
+                if max_retries is not None
+                else cfg.get("max_retries", DEFAULT_MAX_RETRIES)
+            ),
+            backoff_factor=(
+                backoff_factor
+                if backoff_factor is not None
+                else cfg.get("retry_backoff", DEFAULT_RETRY_BACKOFF)
+            ),
+            limiters=self.limiters,
+        )
+        self.session.auth = (cfg["username"], cfg["app_password"])
+
+        # None — ещё не спрашивали, 0 — batch/v1 не поддерживается
+        self._batch_limit: Optional[int] = None
+        self._batch_lock = threading.Lock()
+
+    def endpoint(self, path: str) -> str:
+        """'wp/v2/posts' -> 'https://site/wp-json/wp/v2/posts'."""
+        return f"{self.wp_url}/wp-json/{path.lstrip('/')}"
+
+    def request(self, method: str, path: str, **kwargs) -> "requests.Response":
+        kwargs.setdefault("timeout", self.timeout)
+        # id записи в метку не попадает: 'POST wp/v2/posts/{id}'
+        op = f"{method} {_ID_RE.sub('/{id}', path.strip('/'))}"
+        metrics = get_metrics()
+        for limiter in self.limiters:
+            limiter.acquire()
+        with metrics.labels(site=self.site_key), metrics.timer("wp_seconds", op=op):
+            resp = self.session.request(method, self.endpoint(path), **kwargs)
+        metrics.inc("wp_responses_total", op=op, status=resp.status_code, site=self.site_key)
+
+        # промежуточные 429 уже учтены в повторах; здесь — итог запроса
+        if resp.status_code in THROTTLE_STATUSES:
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            for limiter in self.limiters:
+                limiter.throttle(retry_after)
+        else:
+            for limiter in self.limiters:
+                limiter.success()
+        return resp
+
+    def get(self, path: str, **kwargs) -> "requests.Response":
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> "requests.Response":
+        return self.request("POST", path, **kwargs)
+
+    def batch_limit(self) -> int:
+        """
+        Сколько запросов WP принимает в одном batch/v1; 0 — не поддерживает.
+        Спрашивается один раз (OPTIONS) и запоминается на клиент.
+        """
+        with self._batch_lock:
+            if self._batch_limit is None:
+                self._batch_limit = self._probe_batch()
+            return self._batch_limit
+
+    def _probe_batch(self) -> int:
+        try:
+            resp = self.request("OPTIONS", BATCH_ROUTE)
+        except OSError as e:
+            print(f"[WARN] [{self.site_key}] Не удалось проверить {BATCH_ROUTE}: {e}")
+            return 0
+        if resp.status_code != 200:
+            print(f"[{self.site_key}] {BATCH_ROUTE} недоступен ({resp.status_code}), записи по одной")
+            return 0
+        try:
+            return int(resp.json()["endpoints"][0]["args"]["requests"]["maxItems"])
+        except (ValueError, KeyError, IndexError, TypeError):
+            return DEFAULT_BATCH_LIMIT
+
+    def batch(self, items: list[dict]) -> Optional[list[dict]]:
+        """
+        Отправляет items ({"method", "path", "body"}) одним запросом batch/v1.
+        Возвращает ответы в том же порядке ({"status", "body"}) — ошибка одного
+        не отменяет остальные. None — хост batch/v1 не принимает (клиент это
+        запоминает), отправляй по одному.
+        """
+        calls = [
+            {
+                "method": item.get("method", "POST"),
+                "path": "/" + item["path"].strip("/"),
+                "body": item.get("body") or {},
+            }
+            for item in items
+        ]
+        resp = self.post(BATCH_ROUTE, json={"validation": "normal", "requests": calls})
+
+        if resp.status_code in BATCH_UNSUPPORTED_STATUSES:
+            with self._batch_lock:
+                self._batch_limit = 0
+            print(
+                f"[WARN] [{self.site_key}] {BATCH_ROUTE} отклонён ({resp.status_code}), "
+                f"дальше записи по одной"
+            )
+            return None
+        if resp.status_code not in (200, 207):
+            raise RuntimeError(
+                f"[{self.site_key}] Ошибка {BATCH_ROUTE}: {resp.status_code} {resp.text}"
+            )
+
+        responses = resp.json().get("responses") or []
+        if len(responses) != len(items):
+            raise RuntimeError(
+                f"[{self.site_key}] {BATCH_ROUTE} вернул {len(responses)} ответов "
+                f"на {len(items)} запросов"
+            )
+        get_metrics().observe("wp_batch_size", len(items))
+        return [{"status": int(r.get("status") or 0), "body": r.get("body")} for r in responses]
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_clients: dict[str, WPClient] = {}
+_clients_lock = threading.Lock()
+
+_download_session: Optional["requests.Session"] = None
+
+
+def get_wp_client(site_key: str) -> WPClient:
+    """Возвращает (и при первом вызове создаёт) клиент сайта."""
+    with _clients_lock:
+        client = _clients.get(site_key)
+        if client is None:
+            if site_key not in SITES_CONFIG:
+                raise KeyError(f"Сайт '{site_key}' не найден в SITES_CONFIG")
+            client = WPClient(site_key, SITES_CONFIG[site_key])
+            _clients[site_key] = client
+        return client
+
+
+def get_download_session() -> "requests.Session":
+    """Общая сессия для скачивания файлов (картинки по URL от OpenAI)."""
+    global _download_session
+    with _clients_lock:
+        if _download_session is None:
+            _download_session = build_session()
+        return _download_session
+
+
+def close_all() -> None:
+    """Закрывает все сессии (в конце прогона)."""
+    global _download_session
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        if _download_session is not None:
+            _download_session.close()
+            _download_session = None